@@ -0,0 +1,155 @@
+"""
+Purges activation codes and never-activated users that can no longer be used,
+and outbox emails that were given up on.
+
+Rows are deleted in small batches, one short transaction each, with a pause
+between batches so the purge does not compete with live traffic. Rows locked
+by in-flight requests are skipped and picked up by a later run. With
+DB_SHARDS, every shard is purged in turn.
+
+    python activation_reaper.py          run one purge pass and exit
+    python activation_reaper.py --loop   keep purging every REAPER_INTERVAL_SECONDS
+"""
+import argparse
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from background import PeriodicTask, run_until_signalled
+from config import Settings
+from database import PRIMARY_SHARD, close_async_pool, get_async_conn, init_async_pool, shard_names
+from metrics import REAPER_LAST_SUCCESS, REAPER_ROWS_DELETED, REAPER_RUN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Each query deletes at most one batch: (cutoff seconds, batch size)
+PURGE_QUERIES = {
+    "expired_codes": """
+        DELETE FROM activation_codes WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM activation_codes
+            WHERE created_at < NOW() - make_interval(secs => %s)
+            LIMIT %s FOR UPDATE SKIP LOCKED
+        ))
+    """,
+    "used_codes": """
+        DELETE FROM activation_codes WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM activation_codes
+            WHERE used AND created_at < NOW() - make_interval(secs => %s)
+            LIMIT %s FOR UPDATE SKIP LOCKED
+        ))
+    """,
+    "inactive_users": """
+        DELETE FROM users WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM users
+            WHERE NOT active AND created_at < NOW() - make_interval(secs => %s)
+            LIMIT %s FOR UPDATE SKIP LOCKED
+        ))
+    """,
+    "dead_emails": """
+        DELETE FROM email_outbox WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM email_outbox
+            WHERE status = 'dead' AND created_at < NOW() - make_interval(secs => %s)
+            LIMIT %s FOR UPDATE SKIP LOCKED
+        ))
+    """,
+}
+
+
+@dataclass
+class ReaperRunStats:
+    deleted: Dict[str, int] = field(default_factory=lambda: {name: 0 for name in PURGE_QUERIES})
+    batches: int = 0
+    duration_seconds: float = 0.0
+
+    @property
+    def total_deleted(self) -> int:
+        return sum(self.deleted.values())
+
+
+class ActivationReaper:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or Settings()
+        self.last_run: Optional[ReaperRunStats] = None
+
+    def cutoffs(self) -> Dict[str, float]:
+        """
+        Age in seconds past which each kind of row is purged. Expired codes are
+        kept for a grace period so late attempts still get CODE_EXPIRED rather
+        than INVALID_CODE. A retention of 0 disables that purge.
+        """
+        settings = self.settings
+        cutoffs: Dict[str, float] = {
+            "expired_codes": settings.code_ttl_seconds + settings.reaper_expired_code_grace_seconds,
+            "used_codes": 0,
+            "inactive_users": settings.reaper_inactive_user_retention_seconds,
+            "dead_emails": settings.reaper_dead_email_retention_seconds,
+        }
+        if not settings.reaper_inactive_user_retention_seconds:
+            del cutoffs["inactive_users"]
+        if not settings.reaper_dead_email_retention_seconds:
+            del cutoffs["dead_emails"]
+        return cutoffs
+
+    async def _delete_batch(self, query: str, cutoff: float, batch_size: int, shard: str = PRIMARY_SHARD) -> int:
+        async with get_async_conn(shard=shard) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (cutoff, batch_size))
+                deleted: int = cur.rowcount
+            await conn.commit()
+        return deleted
+
+    async def run_once(self) -> ReaperRunStats:
+        settings = self.settings
+        stats = ReaperRunStats()
+        started = time.perf_counter()
+        pause = settings.reaper_batch_pause_ms / 1000
+
+        for shard in shard_names():
+            for name, cutoff in self.cutoffs().items():
+                for _ in range(settings.reaper_max_batches_per_run):
+                    deleted = await self._delete_batch(PURGE_QUERIES[name], cutoff, settings.reaper_batch_size, shard)
+                    stats.deleted[name] += deleted
+                    stats.batches += 1
+                    REAPER_ROWS_DELETED.labels(name).inc(deleted)
+                    if deleted < settings.reaper_batch_size:
+                        break
+                    await asyncio.sleep(pause)
+
+        stats.duration_seconds = time.perf_counter() - started
+        self.last_run = stats
+        REAPER_RUN_SECONDS.observe(stats.duration_seconds)
+        REAPER_LAST_SUCCESS.set_to_current_time()
+        logger.info(
+            "Reaper removed %d rows (%s) in %d batches, %.0fms",
+            stats.total_deleted,
+            ", ".join(f"{name}={count}" for name, count in stats.deleted.items()),
+            stats.batches,
+            stats.duration_seconds * 1000,
+        )
+        return stats
+
+    def periodic(self) -> PeriodicTask:
+        return PeriodicTask("activation-reaper", self.run_once, self.settings.reaper_interval_seconds)
+
+
+async def _main(loop: bool) -> None:
+    await init_async_pool()
+    try:
+        reaper = ActivationReaper()
+        if loop:
+            await run_until_signalled(reaper.periodic())
+        else:
+            await reaper.run_once()
+    finally:
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop", action="store_true", help="run continuously instead of once")
+    args = parser.parse_args()
+    asyncio.run(_main(args.loop))
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import signal
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Runs an async callable every `interval` seconds until stopped.
+
+    Stopping is signalled with an event rather than relying on task
+    cancellation alone: database drivers may absorb a CancelledError raised
+    mid-query, which would leave a cancelled loop sleeping until its next
+    run and hold up application shutdown.
+    """
+
+    def __init__(self, name: str, func: Callable[[], Awaitable[object]], interval: float):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self._run(), name=self.name)
+        return self._task
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await self.func()
+            except Exception as e:
+                logger.error("%s run failed: %s", self.name, e)
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def request_stop(self) -> None:
+        self._stop.set()
+
+    async def wait(self) -> None:
+        if self._task is not None:
+            await self._task
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Let the current run finish, cancelling it if it takes longer than timeout."""
+        self._stop.set()
+        if self._task is None:
+            return
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        if not done:
+            logger.warning("%s did not stop within %.0fs, cancelling", self.name, timeout)
+            self._task.cancel()
+            await asyncio.wait({self._task}, timeout=1.0)
+        self._task = None
+
+
+async def run_until_signalled(task: PeriodicTask) -> None:
+    """Run a periodic task in the foreground until SIGINT/SIGTERM, letting the current run finish."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.request_stop)
+    task.start()
+    await task.wait()
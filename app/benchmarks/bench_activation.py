@@ -0,0 +1,141 @@
+"""
+Compare activation before and after the single-statement claim.
+
+  legacy:  select the latest code, check used/TTL/hash in Python, then two
+           UPDATEs (the ActivationService.verify_and_use_code this replaced)
+  atomic:  ActivationService.verify_and_use_code, the latest code locked and
+           compared in constant time, then claimed in one conditional CTE
+
+Users and codes are created up front so only activation is timed. With
+--race-trials, each path also gets that many users attacked by --concurrency
+simultaneous activations with the right code, and the number of users
+activated more than once is reported (the legacy read-modify-write lets
+several attempts pass the used check).
+
+Run from the app directory against the configured database:
+
+    python -m benchmarks.bench_activation --iterations 500 --concurrency 8 --race-trials 50
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.common import print_table, summarize
+from config import Settings
+from database import close_async_pool, get_async_conn, init_async_pool
+from email_client import activation_email
+from errors import CodeExpired, InvalidCode
+from models import UserRecord
+from repositories.user_repository import UserRepository
+from services.activation_service import ActivationService
+
+EMAIL_PREFIX = "bench-act-"
+CODE = "2468"
+
+# The unlocked latest-code read the legacy flow ran
+LATEST_CODE_QUERY = (
+    "SELECT id, code_hash, salt, created_at, used FROM activation_codes "
+    "WHERE user_id=%s ORDER BY created_at DESC LIMIT 1"
+)
+
+
+async def legacy_path(user: UserRecord, code: str) -> None:
+    user_id = user.id
+    settings = Settings()
+    async with get_async_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(LATEST_CODE_QUERY, (user_id,))
+            row = await cur.fetchone()
+            if not row:
+                raise InvalidCode()
+            code_id, code_hash_db, salt, created_at, used = row
+            if used:
+                raise InvalidCode()
+            if datetime.now(timezone.utc) - created_at > timedelta(seconds=settings.code_ttl_seconds):
+                raise CodeExpired()
+            if hashlib.sha256(bytes(salt) + code.encode()).digest() != bytes(code_hash_db):
+                raise InvalidCode()
+            await cur.execute("UPDATE activation_codes SET used=TRUE WHERE id=%s", (code_id,))
+            await cur.execute("UPDATE users SET active=TRUE WHERE id=%s", (user_id,))
+            await conn.commit()
+
+
+async def atomic_path(user: UserRecord, code: str) -> None:
+    await ActivationService().verify_and_use_code(user.id, code, user.email)
+
+
+async def create_users(count: int) -> List[UserRecord]:
+    async def one() -> UserRecord:
+        email = f"{EMAIL_PREFIX}{uuid.uuid4().hex}@example.com"
+        code_hash, salt = ActivationService().new_code_hash(CODE)
+        user = await UserRepository.create_user_with_activation(
+            email, b"benchmark", code_hash, salt, activation_email(email, CODE)
+        )
+        return user
+
+    return list(await asyncio.gather(*(one() for _ in range(count))))
+
+
+async def measure(
+    path: Callable[[UserRecord, str], Awaitable[None]], users: List[UserRecord], concurrency: int
+) -> List[float]:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user: UserRecord) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await path(user, CODE)
+            samples.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(user) for user in users))
+    return samples
+
+
+async def race(path: Callable[[UserRecord, str], Awaitable[None]], trials: int, concurrency: int) -> int:
+    """Users whose code was accepted by more than one of concurrency simultaneous attempts."""
+    double_used = 0
+    for user in await create_users(trials):
+        results = await asyncio.gather(*(path(user, CODE) for _ in range(concurrency)), return_exceptions=True)
+        if sum(result is None for result in results) > 1:
+            double_used += 1
+    return double_used
+
+
+async def cleanup() -> None:
+    async with get_async_conn() as conn:
+        await conn.execute("DELETE FROM users WHERE email LIKE %s", (f"{EMAIL_PREFIX}%",))
+        await conn.commit()
+
+
+async def main(iterations: int, concurrency: int, warmup: int, race_trials: int) -> None:
+    await init_async_pool()
+    paths = {"legacy": legacy_path, "atomic": atomic_path}
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        for name, path in paths.items():
+            await measure(path, await create_users(warmup), concurrency)
+            users = await create_users(iterations)
+            started = time.perf_counter()
+            samples = await measure(path, users, concurrency)
+            results[name] = summarize(samples, time.perf_counter() - started)
+            if race_trials:
+                results[name]["double_used"] = await race(path, race_trials, concurrency)
+        print_table(results)
+    finally:
+        await cleanup()
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--race-trials", type=int, default=0, help="users attacked with concurrent activations")
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.concurrency, args.warmup, args.race_trials))
@@ -0,0 +1,102 @@
+"""
+Load test the mailer client against mailer/mock_mailer.py and count how
+many TCP connections each strategy opens.
+
+  per_request: a new httpx.AsyncClient per email (the previous behaviour)
+  shared:      the application-lifetime MailTransport
+
+    python -m benchmarks.bench_mailer_connections --emails 1000 --concurrency 50
+
+EMAIL_API_BASE_URL must point at a running mock mailer.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.common import print_table, summarize
+from config import get_settings
+from email_client import close_mail_transport, get_mail_transport
+
+
+class ConnectionCounter:
+    """httpx trace hook counting completed TCP connects."""
+
+    def __init__(self) -> None:
+        self.connects = 0
+
+    async def trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.connects += 1
+
+    async def on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self.trace
+
+
+def payload() -> Dict[str, str]:
+    return {
+        "to": f"bench-mail-{uuid.uuid4().hex[:12]}@example.com",
+        "subject": "Your activation code",
+        "body": "Your code is: 1234",
+    }
+
+
+async def run(
+    send: Callable[[], Awaitable[None]], emails: int, concurrency: int
+) -> List[float]:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await send()
+            samples.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(emails)))
+    return samples
+
+
+async def main(emails: int, concurrency: int) -> None:
+    settings = get_settings()
+    results = {}
+
+    counter = ConnectionCounter()
+
+    async def per_request() -> None:
+        async with httpx.AsyncClient(
+            timeout=settings.email_timeout_seconds, event_hooks={"request": [counter.on_request]}
+        ) as client:
+            resp = await client.post(f"{settings.email_api_base_url}/send", json=payload())
+            resp.raise_for_status()
+
+    started = time.perf_counter()
+    samples = await run(per_request, emails, concurrency)
+    results["per_request"] = {**summarize(samples, time.perf_counter() - started), "connects": counter.connects}
+
+    counter = ConnectionCounter()
+    transport = get_mail_transport()
+    transport.client.event_hooks["request"].append(counter.on_request)
+
+    async def shared() -> None:
+        await transport.post("/send", json=payload())
+
+    try:
+        started = time.perf_counter()
+        samples = await run(shared, emails, concurrency)
+        results["shared"] = {**summarize(samples, time.perf_counter() - started), "connects": counter.connects}
+    finally:
+        await close_mail_transport()
+
+    print_table(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.emails, args.concurrency))
@@ -0,0 +1,182 @@
+"""
+Requests/sec through the middleware stack for /health and /v1/users.
+
+  legacy: the previous BaseHTTPMiddleware implementations (copied below)
+  asgi:   the pure ASGI RateLimitMiddleware and SecurityMiddleware
+
+Requests are driven straight into the ASGI app, with no server or sockets,
+and the user controller is replaced through dependency_overrides, so
+the numbers reflect framework and middleware cost only. No database or mailer is
+needed.
+
+    python -m benchmarks.bench_middleware --requests 20000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from benchmarks.common import print_table, summarize
+from config import Settings
+from dependencies import get_user_controller
+from fastapi import FastAPI, HTTPException, Request
+from main import health, register_user
+from middleware.rate_limiting import InMemoryRateLimiter, RateLimiter, RateLimitMiddleware
+from middleware.security_middleware import SecurityMiddleware
+from schemas import CreateUserResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+# Large enough that no benchmark request is rejected
+LIMIT = 10 ** 9
+
+
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+
+    def __init__(self, app, limiter: RateLimiter):
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request: Request, call_next):
+        if os.getenv("LOG_LEVEL") == "warning":
+            return await call_next(request)
+
+        if request.url.path in ["/v1/users", "/v1/users/activate"]:
+            client_ip = request.client.host if request.client else "unknown"
+
+            if request.url.path == "/v1/users":
+                if not await self.limiter.is_allowed(f"reg:{client_ip}", LIMIT, 3600):
+                    raise HTTPException(429, "Too many registration attempts. Try again later.")
+
+            elif request.url.path == "/v1/users/activate":
+                if not await self.limiter.is_allowed(f"act:{client_ip}", LIMIT, 3600):
+                    raise HTTPException(429, "Too many activation attempts. Try again later.")
+
+        return await call_next(request)
+
+
+class LegacySecurityMiddleware(BaseHTTPMiddleware):
+
+    async def dispatch(self, request: Request, call_next):
+        request_id = secrets.token_hex(8)
+        request.state.request_id = request_id
+
+        response = await call_next(request)
+
+        response.headers["x-request-id"] = request_id
+        response.headers["x-content-type-options"] = "nosniff"
+        response.headers["x-frame-options"] = "DENY"
+        response.headers["x-xss-protection"] = "1; mode=block"
+        response.headers["strict-transport-security"] = "max-age=31536000; includeSubDomains"
+
+        return response
+
+
+class StubUserController:
+
+    async def register_user(self, payload) -> CreateUserResponse:
+        return CreateUserResponse(
+            id="00000000-0000-0000-0000-000000000000",
+            email=payload.email,
+            created_at=datetime.now(timezone.utc).isoformat(),
+            active=False,
+        )
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+    app.add_api_route("/health", health, methods=["GET"])
+    app.add_api_route("/v1/users", register_user, methods=["POST"], response_model=CreateUserResponse, status_code=201)
+    app.dependency_overrides[get_user_controller] = StubUserController
+
+    limiter = InMemoryRateLimiter()
+    if stack == "legacy":
+        app.add_middleware(LegacyRateLimitMiddleware, limiter=limiter)
+        app.add_middleware(LegacySecurityMiddleware)
+    else:
+        settings = Settings(
+            rate_limit_enabled=True,
+            rate_limit_registration_max_requests=LIMIT,
+            rate_limit_activation_max_requests=LIMIT,
+        )
+        app.add_middleware(RateLimitMiddleware, limiter=limiter, settings=settings)
+        app.add_middleware(SecurityMiddleware)
+    return app
+
+
+async def call(app: FastAPI, method: str, path: str, body: bytes, client_ip: str) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": (client_ip, 50000),
+        "server": ("bench", 80),
+        "state": {},
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status_code = 0
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Never disconnects; BaseHTTPMiddleware cancels this wait when the response is done
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    await app(scope, receive, send)
+    return status_code
+
+
+async def run(app: FastAPI, method: str, path: str, requests: int, concurrency: int) -> Dict[str, float]:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        body = json.dumps({"email": f"bench{i}@example.com", "password": "password123"}).encode() if method == "POST" else b""
+        async with semaphore:
+            started = time.perf_counter()
+            status_code = await call(app, method, path, body, f"10.0.{i % 256}.{i // 256 % 256}")
+            samples.append(time.perf_counter() - started)
+        assert status_code in (200, 201), f"{method} {path} returned {status_code}"
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    summary: Dict[str, float] = summarize(samples, time.perf_counter() - started)
+    return summary
+
+
+async def main(requests: int, concurrency: int) -> None:
+    results = {}
+    for stack in ("legacy", "asgi"):
+        app = build_app(stack)
+        # Warm up route and validation caches before measuring
+        await run(app, "GET", "/health", 200, concurrency)
+        results[f"{stack} GET /health"] = await run(app, "GET", "/health", requests, concurrency)
+        results[f"{stack} POST /v1/users"] = await run(app, "POST", "/v1/users", requests, concurrency)
+    print_table(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
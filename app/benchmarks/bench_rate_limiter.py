@@ -0,0 +1,122 @@
+"""
+Microbenchmark: list-of-timestamps limiter (previous implementation) versus
+the O(1) sliding-window-counter InMemoryRateLimiter.
+
+Two scenarios:
+  hot:    a few clients each sending up to the limit (100 requests/window)
+  unique: every request from a new IP, showing the memory that idle keys retain
+          (the new limiter caps it at --max-keys)
+
+    python -m benchmarks.bench_rate_limiter --requests 200000
+    python -m benchmarks.bench_rate_limiter --postgres --requests 2000   # shared backend
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from benchmarks.common import print_table
+from middleware.rate_limiting import InMemoryRateLimiter, PostgresRateLimiter
+
+LIMIT = 100
+WINDOW = 3600
+
+
+class LegacyListRateLimiter:
+    """The limiter as it was: rebuilds a list of timestamps on every call and never evicts keys."""
+
+    def __init__(self) -> None:
+        self.requests: Dict[str, List[float]] = {}
+
+    def is_allowed(self, key: str, max_requests: int, window_seconds: int) -> bool:
+        now = time.time()
+        if key not in self.requests:
+            self.requests[key] = []
+        self.requests[key] = [t for t in self.requests[key] if now - t < window_seconds]
+        if len(self.requests[key]) >= max_requests:
+            return False
+        self.requests[key].append(now)
+        return True
+
+
+def measure(make_check: Callable[[], Callable[[str], bool]], keys: List[str]) -> Dict[str, float]:
+    check = make_check()
+    started = time.perf_counter()
+    for key in keys:
+        check(key)
+    elapsed = time.perf_counter() - started
+
+    # Memory on a fresh instance; tracemalloc would distort the timing above
+    check = make_check()
+    tracemalloc.start()
+    for key in keys:
+        check(key)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ns_per_op": elapsed / len(keys) * 1e9,
+        "ops_per_s": len(keys) / elapsed,
+        "peak_mib": peak / 2 ** 20,
+    }
+
+
+def legacy_check() -> Callable[[str], bool]:
+    limiter = LegacyListRateLimiter()
+    return lambda key: limiter.is_allowed(key, LIMIT, WINDOW)
+
+
+def counter_check(max_keys: int) -> Callable[[], Callable[[str], bool]]:
+    def make() -> Callable[[str], bool]:
+        limiter = InMemoryRateLimiter(max_keys=max_keys)
+        return lambda key: limiter.hit(key, LIMIT, WINDOW)
+    return make
+
+
+def scenarios(requests: int) -> Dict[str, List[str]]:
+    return {
+        "hot": [f"reg:10.0.0.{i % 50}" for i in range(requests)],
+        "unique": [f"reg:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(requests)],
+    }
+
+
+def run_in_memory(requests: int, max_keys: int) -> None:
+    results = {}
+    for name, keys in scenarios(requests).items():
+        results[f"legacy/{name}"] = measure(legacy_check, keys)
+        results[f"counter/{name}"] = measure(counter_check(max_keys), keys)
+    print_table(results)
+
+
+async def run_postgres(requests: int, concurrency: int) -> None:
+    from database import close_async_pool, init_async_pool
+
+    await init_async_pool()
+    limiter = PostgresRateLimiter()
+    semaphore = asyncio.Semaphore(concurrency)
+    keys = scenarios(requests)["hot"]
+
+    async def one(key: str) -> None:
+        async with semaphore:
+            await limiter.is_allowed(f"bench:{key}", LIMIT, WINDOW)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(key) for key in keys))
+        elapsed = time.perf_counter() - started
+        print_table({"postgres/hot": {"ops_per_s": requests / elapsed, "ms_per_op": elapsed / requests * 1000}})
+    finally:
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--postgres", action="store_true", help="benchmark the shared Postgres backend")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-keys", type=int, default=50_000, help="InMemoryRateLimiter key cap")
+    args = parser.parse_args()
+    if args.postgres:
+        asyncio.run(run_postgres(args.requests, args.concurrency))
+    else:
+        run_in_memory(args.requests, args.max_keys)
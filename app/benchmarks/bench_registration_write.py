@@ -0,0 +1,105 @@
+"""
+Compare the registration write path before and after the single-statement
+unit of work.
+
+  legacy: insert the user, then its activation code (two pool checkouts,
+          two transactions; the path this replaced, kept as a local copy)
+  cte:    UserRepository.create_user_with_activation
+          (one checkout, one statement)
+
+bcrypt is computed once up front so only database cost is measured.
+
+Run from the app directory against the configured database:
+
+    python -m benchmarks.bench_registration_write --iterations 500 --concurrency 8
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, List
+
+from benchmarks.common import print_table, summarize
+from database import close_async_pool, get_async_conn, init_async_pool
+from email_client import activation_email
+from repositories.user_repository import UserRepository
+from services.activation_service import ActivationService
+from services.auth_service import bcrypt_hash
+from sharding import get_shard_map
+
+EMAIL_PREFIX = "bench-reg-"
+
+
+async def legacy_path(email: str, password_hash: bytes, code: str) -> None:
+    shard = (await get_shard_map()).shard_for(email)
+    async with get_async_conn(shard=shard) as conn:
+        cur = await conn.execute(
+            "INSERT INTO users (email, password_hash) VALUES (%s, %s) RETURNING id", (email, password_hash)
+        )
+        (user_id,) = await cur.fetchone()
+        await conn.commit()
+    code_hash, salt = ActivationService().new_code_hash(code)
+    async with get_async_conn(shard=shard) as conn:
+        await conn.execute(
+            "INSERT INTO activation_codes (user_id, code_hash, salt) VALUES (%s, %s, %s)", (user_id, code_hash, salt)
+        )
+        await conn.commit()
+
+
+async def cte_path(email: str, password_hash: bytes, code: str) -> None:
+    code_hash, salt = ActivationService().new_code_hash(code)
+    await UserRepository.create_user_with_activation(
+        email, password_hash, code_hash, salt, activation_email(email, code)
+    )
+
+
+async def measure(
+    path: Callable[[str, bytes, str], Awaitable[None]],
+    password_hash: bytes,
+    iterations: int,
+    concurrency: int,
+) -> List[float]:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            email = f"{EMAIL_PREFIX}{uuid.uuid4().hex}@example.com"
+            started = time.perf_counter()
+            await path(email, password_hash, "1234")
+            samples.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    return samples
+
+
+async def cleanup() -> None:
+    async with get_async_conn() as conn:
+        await conn.execute("DELETE FROM users WHERE email LIKE %s", (f"{EMAIL_PREFIX}%",))
+        await conn.commit()
+
+
+async def main(iterations: int, concurrency: int, warmup: int) -> None:
+    await init_async_pool()
+    password_hash = bcrypt_hash("benchmark-password", 4)
+    paths = {"legacy": legacy_path, "cte": cte_path}
+    results = {}
+    try:
+        for name, path in paths.items():
+            await measure(path, password_hash, warmup, concurrency)
+            started = time.perf_counter()
+            samples = await measure(path, password_hash, iterations, concurrency)
+            results[name] = summarize(samples, time.perf_counter() - started)
+        print_table(results)
+    finally:
+        await cleanup()
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.concurrency, args.warmup))
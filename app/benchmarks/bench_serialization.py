@@ -0,0 +1,205 @@
+"""
+Response serialization per endpoint: response models versus pre-encoded bytes.
+
+  legacy: the controller returns CreateUserResponse / CreateUsersBatchResponse /
+          a dict, which FastAPI re-validates against response_model and encodes
+          with jsonable_encoder and json.dumps (the UserController this replaced)
+  raw:    the controller returns a Response encoded by serialization.py
+
+Two measurements for each of POST /v1/users, POST /v1/users:batch (--batch-size
+items, every other one a duplicate) and POST /v1/users/activate:
+
+  serialize: building the response body from UserRecords, in microseconds per call
+  request:   the whole request through the route, with the services replaced by
+             stubs, so no database, mailer or hashing is involved
+
+    python -m benchmarks.bench_serialization --calls 2000 --requests 1000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+
+from benchmarks.common import print_table, summarize
+from controllers.user_controller import UserController
+from dependencies import get_user_controller
+from errors import EmailAlreadyUsed
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from main import activate_user, register_user, register_users
+from models import UserRecord
+from schemas import BatchItemResult, CreateUserResponse, CreateUsersBatchResponse
+
+NOW = datetime.now(timezone.utc)
+
+
+def record(i: int, active: bool = False) -> UserRecord:
+    return UserRecord(id=f"00000000-0000-0000-0000-{i:012d}", email=f"bench{i}@example.com", created_at=NOW, active=active)
+
+
+class StubUserService:
+
+    async def register_user(self, email: str, password: str) -> UserRecord:
+        return record(0)
+
+    async def register_users(self, items: List[Any]) -> List[Any]:
+        return [record(i) if i % 2 == 0 else EmailAlreadyUsed() for i in range(len(items))]
+
+    async def activate_user(self, user_id: str, code: str, email: str) -> None:
+        return None
+
+
+class StubAuthService:
+
+    async def authenticate_user(self, email: str, password: str) -> UserRecord:
+        return record(0)
+
+
+class LegacyUserController(UserController):
+    """The response building as it was: pydantic models FastAPI validates again."""
+
+    async def register_user(self, payload):
+        user = await self.user_service.register_user(payload.email, payload.password)
+        return self._user_response(user)
+
+    async def register_users(self, payload):
+        outcomes = await self.user_service.register_users([(item.email, item.password) for item in payload.items])
+        results = []
+        for index, outcome in enumerate(outcomes):
+            if isinstance(outcome, UserRecord):
+                results.append(BatchItemResult(index=index, status=201, user=self._user_response(outcome)))
+            else:
+                results.append(BatchItemResult(index=index, status=outcome.status_code, error=outcome.detail))
+        created = sum(result.user is not None for result in results)
+        return CreateUsersBatchResponse(created=created, failed=len(results) - created, results=results)
+
+    @staticmethod
+    def _user_response(user: UserRecord) -> CreateUserResponse:
+        return CreateUserResponse(
+            id=user.id, email=user.email, created_at=user.created_at.isoformat(), active=user.active
+        )
+
+    async def activate_user(self, payload, credentials, background_tasks):
+        await self.auth_service.authenticate_user(credentials.username, credentials.password)
+        await self.user_service.activate_user("0", payload.code, credentials.username)
+        return {"message": "Account activated successfully"}
+
+
+def build_app(controller: UserController) -> FastAPI:
+    app = FastAPI()
+    app.add_api_route("/v1/users", register_user, methods=["POST"], response_model=CreateUserResponse, status_code=201)
+    app.add_api_route("/v1/users:batch", register_users, methods=["POST"], response_model=CreateUsersBatchResponse)
+    app.add_api_route("/v1/users/activate", activate_user, methods=["POST"])
+    app.dependency_overrides[get_user_controller] = lambda: controller
+    return app
+
+
+class Payload:
+    def __init__(self, items: int):
+        self.email, self.password, self.code = "bench0@example.com", "password123", "1234"
+        self.items = [self] * items
+
+
+async def legacy_body(app: FastAPI, path: str, content: Any) -> bytes:
+    """What FastAPI does with a non-Response return value."""
+    route = next(r for r in app.routes if isinstance(r, APIRoute) and r.path == path)
+    encoded = await serialize_response(field=route.response_field, response_content=content)
+    return JSONResponse(encoded).body
+
+
+async def time_calls(func: Callable[[], Awaitable[Any]], calls: int) -> Dict[str, float]:
+    for _ in range(min(calls, 500)):
+        await func()
+    started = time.perf_counter()
+    for _ in range(calls):
+        await func()
+    return {"us_per_call": (time.perf_counter() - started) / calls * 1e6}
+
+
+async def serialize(calls: int, batch_size: int) -> Dict[str, Dict[str, float]]:
+    legacy = LegacyUserController(StubUserService(), StubAuthService())
+    raw = UserController(StubUserService(), StubAuthService())
+    app = build_app(legacy)
+    single, batch = Payload(0), Payload(batch_size)
+    credentials = type("Credentials", (), {"username": "bench0@example.com", "password": "password123"})()
+    cases = {
+        "POST /v1/users": (
+            lambda: legacy.register_user(single), "/v1/users", lambda: raw.register_user(single),
+        ),
+        "POST /v1/users:batch": (
+            lambda: legacy.register_users(batch), "/v1/users:batch", lambda: raw.register_users(batch),
+        ),
+        "POST /v1/users/activate": (
+            lambda: legacy.activate_user(single, credentials, None), "/v1/users/activate",
+            lambda: raw.activate_user(single, credentials, _NoBackground()),
+        ),
+    }
+    results = {}
+    for name, (legacy_call, path, raw_call) in cases.items():
+        async def legacy_path():
+            return await legacy_body(app, path, await legacy_call())
+
+        async def raw_path():
+            return (await raw_call()).body
+
+        assert json.loads(await legacy_path()) == json.loads(await raw_path()), f"{name} bodies differ"
+        results[f"legacy serialize {name}"] = await time_calls(legacy_path, calls)
+        results[f"raw serialize {name}"] = await time_calls(raw_path, calls)
+    return results
+
+
+class _NoBackground:
+    def add_task(self, *args: Any) -> None:
+        pass
+
+
+async def requests(count: int, concurrency: int, batch_size: int) -> Dict[str, Dict[str, float]]:
+    import httpx
+
+    authorization = "Basic " + base64.b64encode(b"bench0@example.com:password123").decode()
+    bodies = {
+        "/v1/users": {"email": "bench0@example.com", "password": "password123"},
+        "/v1/users:batch": {"items": [{"email": f"bench{i}@example.com", "password": "password123"} for i in range(batch_size)]},
+        "/v1/users/activate": {"code": "1234"},
+    }
+    results = {}
+    for stack, controller_class in (("legacy", LegacyUserController), ("raw", UserController)):
+        app = build_app(controller_class(StubUserService(), StubAuthService()))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://bench") as client:
+            for path, body in bodies.items():
+                semaphore = asyncio.Semaphore(concurrency)
+                samples: List[float] = []
+
+                async def one() -> None:
+                    async with semaphore:
+                        started = time.perf_counter()
+                        resp = await client.post(path, json=body, headers={"authorization": authorization})
+                        samples.append(time.perf_counter() - started)
+                    assert resp.status_code in (200, 201), f"{path} returned {resp.status_code}"
+
+                await asyncio.gather(*(one() for _ in range(min(count, 200))))
+                samples.clear()
+                started = time.perf_counter()
+                await asyncio.gather(*(one() for _ in range(count)))
+                results[f"{stack} request POST {path}"] = summarize(samples, time.perf_counter() - started)
+    return results
+
+
+async def main(calls: int, count: int, concurrency: int, batch_size: int) -> None:
+    print_table(await serialize(calls, batch_size))
+    print()
+    print_table(await requests(count, concurrency, batch_size))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="serializations timed per endpoint")
+    parser.add_argument("--requests", type=int, default=1000, help="requests sent per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.requests, args.concurrency, args.batch_size))
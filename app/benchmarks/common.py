@@ -0,0 +1,46 @@
+import statistics
+import time
+from typing import Dict, List, Sequence
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: Sequence[float], elapsed: float = 0.0) -> Dict[str, float]:
+    """Latency summary in milliseconds; samples are in seconds."""
+    summary = {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000 if samples else 0.0,
+    }
+    if elapsed:
+        summary["rps"] = len(samples) / elapsed
+    return summary
+
+
+def print_table(rows: Dict[str, Dict[str, float]]) -> None:
+    columns: List[str] = []
+    for summary in rows.values():
+        columns.extend(key for key in summary if key not in columns)
+    name_width = max(len(name) for name in rows)
+    print(" ".join([" " * name_width] + [f"{column:>10}" for column in columns]))
+    for name, summary in rows.items():
+        cells = [f"{summary.get(column, 0):>10.2f}" for column in columns]
+        print(" ".join([name.ljust(name_width)] + cells))
+
+
+class Timer:
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.started
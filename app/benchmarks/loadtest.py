@@ -0,0 +1,249 @@
+"""
+Load test of the registration and activation flow.
+
+Each virtual user registers, waits for its activation code to reach the
+mock mailer (mailer/mock_mailer.py), and activates. Latency percentiles and
+throughput are reported per step:
+
+  register        POST /v1/users
+  email_delivery  registration response until the code is readable from the mailer
+  activate        POST /v1/users/activate
+
+The target is either a running stack (--url, e.g. docker compose) or the
+app loaded in-process (--asgi, still using the configured database and
+mailer). In-process runs disable rate limiting; against a running stack,
+start the app with RATE_LIMIT_ENABLED=false or requests past the per-IP
+limit are counted as errors.
+
+    python -m benchmarks.loadtest --url http://localhost:8000 --users 200 --concurrency 20
+    python -m benchmarks.loadtest --asgi --users 200 --save-baseline benchmarks/baselines/asgi.json
+    python -m benchmarks.loadtest --asgi --users 200 --baseline benchmarks/baselines/asgi.json --max-regression 0.2
+
+With --baseline the run exits with status 1 if any step's p50/p95/p99
+latency rose, or its throughput fell, by more than --max-regression, or
+its error rate rose.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from benchmarks.common import print_table, summarize
+
+STEPS = ("register", "email_delivery", "activate")
+PASSWORD = "LoadTest123!"
+
+# Metric -> direction that counts as a regression
+REGRESSION_CHECKS = {"p50_ms": "higher", "p95_ms": "higher", "p99_ms": "higher", "rps": "lower"}
+
+
+@dataclass
+class StepResults:
+    samples: List[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, seconds: float, ok: bool, status: str) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if ok:
+            self.samples.append(seconds)
+        else:
+            self.errors += 1
+
+
+class LoadTest:
+
+    def __init__(self, app_client: httpx.AsyncClient, mailer_client: httpx.AsyncClient, code_timeout: float):
+        self.app_client = app_client
+        self.mailer_client = mailer_client
+        self.code_timeout = code_timeout
+        self.run_id = uuid.uuid4().hex[:8]
+        self.results = {step: StepResults() for step in STEPS}
+
+    async def wait_for_code(self, email: str) -> Optional[str]:
+        deadline = time.perf_counter() + self.code_timeout
+        while time.perf_counter() < deadline:
+            r = await self.mailer_client.get("/__last_code", params={"email": email})
+            if r.status_code == 200:
+                code: str = r.json()["code"]
+                return code
+            await asyncio.sleep(0.05)
+        return None
+
+    async def user_flow(self, index: int, record: bool) -> None:
+        email = f"load-{self.run_id}-{index}@example.com"
+        results = self.results if record else {step: StepResults() for step in STEPS}
+
+        started = time.perf_counter()
+        r = await self.app_client.post("/v1/users", json={"email": email, "password": PASSWORD})
+        registered = time.perf_counter()
+        results["register"].record(registered - started, r.status_code == 201, str(r.status_code))
+        if r.status_code != 201:
+            return
+
+        code = await self.wait_for_code(email)
+        delivered = time.perf_counter()
+        results["email_delivery"].record(delivered - registered, code is not None, "ok" if code else "timeout")
+        if code is None:
+            return
+
+        r = await self.app_client.post("/v1/users/activate", json={"code": code}, auth=(email, PASSWORD))
+        results["activate"].record(time.perf_counter() - delivered, r.status_code == 200, str(r.status_code))
+
+    async def run(self, users: int, concurrency: int, offset: int = 0, record: bool = True) -> float:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(index: int) -> None:
+            async with semaphore:
+                try:
+                    await self.user_flow(index, record)
+                except httpx.HTTPError as e:
+                    if record:
+                        self.results["register"].record(0.0, False, type(e).__name__)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(offset + i) for i in range(users)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for step, results in self.results.items():
+            attempts = len(results.samples) + results.errors
+            report[step] = {
+                **summarize(results.samples, elapsed),
+                "errors": results.errors,
+                "error_rate": results.errors / attempts if attempts else 0.0,
+                "statuses": results.statuses,
+            }
+        return report
+
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Regressions of the current run against a baseline, as readable lines."""
+    regressions = []
+    for step, base in baseline.items():
+        result = current.get(step)
+        if result is None:
+            regressions.append(f"{step}: missing from this run")
+            continue
+        for metric, worse in REGRESSION_CHECKS.items():
+            before, after = base.get(metric, 0.0), result.get(metric, 0.0)
+            if not before:
+                continue
+            change = (after - before) / before
+            if (worse == "higher" and change > threshold) or (worse == "lower" and -change > threshold):
+                regressions.append(f"{step} {metric}: {before:.2f} -> {after:.2f} ({change:+.0%})")
+        if result["error_rate"] > base.get("error_rate", 0.0):
+            regressions.append(f"{step} error_rate: {base.get('error_rate', 0.0):.2%} -> {result['error_rate']:.2%}")
+    return regressions
+
+
+async def _asgi_app(stack: AsyncExitStack) -> Any:
+    # Settings read the environment at import time, so this must precede importing the app
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    from main import app
+
+    await stack.enter_async_context(app.router.lifespan_context(app))
+    return app
+
+
+async def run_load(args: argparse.Namespace) -> Tuple[str, float, LoadTest]:
+    """Run the flows against the chosen target; returns (target, elapsed seconds, finished load test)."""
+    async with AsyncExitStack() as stack:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        if args.asgi:
+            app = await _asgi_app(stack)
+            transport = httpx.ASGITransport(app=app)
+            app_client = httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout)
+            target = "asgi"
+        else:
+            app_client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits)
+            target = args.url
+        await stack.enter_async_context(app_client)
+        mailer_client = await stack.enter_async_context(
+            httpx.AsyncClient(base_url=args.mailer_url, timeout=args.timeout, limits=limits)
+        )
+
+        load_test = LoadTest(app_client, mailer_client, args.code_timeout)
+        if args.warmup:
+            await load_test.run(args.warmup, args.concurrency, offset=args.users, record=False)
+        elapsed = await load_test.run(args.users, args.concurrency)
+    return target, elapsed, load_test
+
+
+def print_report(report: Dict[str, Dict[str, Any]]) -> None:
+    print_table({step: {k: v for k, v in result.items() if k != "statuses"} for step, result in report.items()})
+    for step, result in report.items():
+        if result["errors"]:
+            print(f"{step} statuses: {result['statuses']}")
+
+
+def check_baseline(path: str, meta: Dict[str, Any], report: Dict[str, Dict[str, Any]], threshold: float) -> int:
+    """Compare against the baseline at path; 1 if anything regressed beyond threshold, else 0."""
+    with open(path) as f:
+        baseline = json.load(f)
+    for key in ("target", "users", "concurrency"):
+        if baseline["meta"].get(key) != meta[key]:
+            print(f"warning: baseline {key}={baseline['meta'].get(key)!r}, this run {key}={meta[key]!r}")
+    regressions = compare(report, baseline["results"], threshold)
+    if regressions:
+        print(f"Regressions beyond {threshold:.0%} against {path}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions beyond {threshold:.0%} against {path}")
+    return 0
+
+
+async def main(args: argparse.Namespace) -> int:
+    target, elapsed, load_test = await run_load(args)
+    report = load_test.report(elapsed)
+    print(f"{target}: {args.users} users, concurrency {args.concurrency}, {elapsed:.1f}s")
+    print_report(report)
+
+    meta = {
+        "target": target,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+    }
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({"meta": meta, "results": report}, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        return check_baseline(args.baseline, meta, report, args.max_regression)
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default=os.getenv("APP_BASE", "http://localhost:8000"), help="running app to load")
+    target.add_argument("--asgi", action="store_true", help="load the app in-process instead of over HTTP")
+    parser.add_argument("--mailer-url", default=os.getenv("MAILER_BASE", "http://localhost:8081"))
+    parser.add_argument("--users", type=int, default=200, help="registration/activation flows to run")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=10, help="unrecorded flows run first")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--code-timeout", type=float, default=15.0, help="seconds to wait for an activation email")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write this run's results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,278 @@
+"""
+Bulk import of users from CSV or JSONL.
+
+Input is read as a stream and processed in chunks of IMPORT_CHUNK_SIZE
+rows; across chunks only a 16-byte digest of each email is kept, to catch
+repeats. For each chunk, plaintext passwords are
+hashed on the API's shared hashing executor (HASH_EXECUTOR_*) with the
+configured algorithm (existing bcrypt or argon2id hashes pass through
+unchanged; outdated ones are upgraded at the user's next login), the rows are
+COPYed into a temporary staging table and merged into users in one
+statement. A result is reported for every input line:
+
+    created    new user inserted
+    updated    existing user's password overwritten (--on-conflict update)
+    exists     email already registered, row skipped (--on-conflict skip)
+    duplicate  email repeated earlier in the input, row skipped
+    invalid    row rejected before writing (error explains why)
+
+Emails are stored as normalized by EmailStr validation, like registrations,
+so spellings that differ only in the case of the domain are one email. The
+first row for an email is imported and every later one is a duplicate,
+whatever the chunk size.
+
+Each row has an email and either password or password_hash, plus an
+optional active flag. New users are created active: imported accounts
+already exist elsewhere and get no activation code, so active=false is
+rejected as invalid. Existing users keep their activation state, also
+with --on-conflict update. CSV input needs a header row. Quoted fields may
+not span lines.
+
+    python bulk_import.py users.csv > results.ndjson
+    python bulk_import.py users.jsonl --on-conflict update
+    cat users.jsonl | python bulk_import.py - --format jsonl
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import re
+import sys
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Union, cast
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+
+from config import Settings
+from database import close_async_pool, init_async_pool
+from errors import ServiceOverloaded
+from hashing_executor import get_hashing_executor, shutdown_hashing_executor
+from repositories.user_repository import UserRepository
+from services.auth_service import HashPolicy
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+CONFLICT_POLICIES = ("skip", "update")
+
+PASSWORD_HASH = re.compile(
+    r"^(\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}"
+    r"|\$argon2id\$v=19\$m=\d+,t=\d+,p=\d+\$[A-Za-z0-9+/]+\$[A-Za-z0-9+/]+)$"
+)
+_email_adapter = TypeAdapter(EmailStr)
+
+
+@dataclass(frozen=True, slots=True)
+class ImportRow:
+    line: int
+    email: str
+    password: Optional[str] = None
+    password_hash: Optional[bytes] = None
+
+
+@dataclass(slots=True)
+class ImportResult:
+    line: int
+    email: str
+    status: str
+    user_id: Optional[str] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"line": self.line, "email": self.email, "status": self.status}
+        if self.user_id is not None:
+            result["id"] = self.user_id
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+def _parse_active(value: Any) -> bool:
+    if value is None or value == "":
+        return True
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in ("true", "1", "yes"):
+        return True
+    if normalized in ("false", "0", "no"):
+        return False
+    raise ValueError(f"active must be true or false, got {value!r}")
+
+
+class RowParser:
+    """
+    Turns input lines into ImportRows, or ImportResults for rows that will
+    not be written: invalid rows, and repeats of an email earlier in the
+    input (caught here, before their passwords are hashed).
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown import format: {fmt}")
+        self.fmt = fmt
+        self.header: Optional[List[str]] = None
+        self.line = 0
+        # Digests rather than the emails themselves bound the memory a large import keeps
+        self.seen: Set[bytes] = set()
+
+    def parse(self, text: str) -> Optional[Union[ImportRow, ImportResult]]:
+        self.line += 1
+        text = text.rstrip("\r\n")
+        if not text.strip():
+            return None
+
+        if self.fmt == "csv":
+            values = next(csv.reader([text]))
+            if self.header is None:
+                self.header = [name.strip().lower() for name in values]
+                return None
+            record: Dict[str, Any] = dict(zip(self.header, values))
+        else:
+            try:
+                record = json.loads(text)
+            except json.JSONDecodeError as e:
+                return ImportResult(self.line, "", "invalid", error=f"invalid JSON: {e.msg}")
+            if not isinstance(record, dict):
+                return ImportResult(self.line, "", "invalid", error="expected a JSON object")
+
+        email = str(record.get("email") or "").strip()
+        try:
+            row = self._row(email, record)
+        except (ValueError, ValidationError) as e:
+            message = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+            return ImportResult(self.line, email, "invalid", error=message)
+        key = hashlib.blake2b(row.email.encode(), digest_size=16).digest()
+        if key in self.seen:
+            return ImportResult(self.line, row.email, "duplicate")
+        self.seen.add(key)
+        return row
+
+    def _row(self, email: str, record: Dict[str, Any]) -> ImportRow:
+        email = _email_adapter.validate_python(email)
+        if not _parse_active(record.get("active")):
+            raise ValueError("active=false is not supported: imported users get no activation code")
+        secret = record.get("password_hash") or record.get("password")
+        if not secret:
+            raise ValueError("password or password_hash is required")
+        secret = str(secret)
+        if PASSWORD_HASH.match(secret):
+            return ImportRow(self.line, email, password_hash=secret.encode())
+        if record.get("password_hash"):
+            raise ValueError("password_hash is not a bcrypt or argon2id hash")
+        if not 8 <= len(secret) <= 128:
+            raise ValueError("password must be 8 to 128 characters")
+        return ImportRow(self.line, email, password=secret)
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream (e.g. a request body) into decoded lines."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+async def aiter_file_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    for line in lines:
+        yield line
+
+
+class BulkImporter:
+
+    def __init__(self, settings: Optional[Settings] = None, on_conflict: str = "skip"):
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"Unknown conflict policy: {on_conflict}")
+        self.settings = settings or Settings()
+        self.on_conflict = on_conflict
+        self.counts: Dict[str, int] = {}
+
+    async def run(self, lines: AsyncIterator[str], fmt: str) -> AsyncIterator[ImportResult]:
+        """Import every row from lines, yielding one result per input row as each chunk completes."""
+        parser = RowParser(fmt)
+        chunk: List[Union[ImportRow, ImportResult]] = []
+        async for text in lines:
+            item = parser.parse(text)
+            if item is None:
+                continue
+            chunk.append(item)
+            if len(chunk) >= self.settings.import_chunk_size:
+                for result in await self._import_chunk(chunk):
+                    yield result
+                chunk = []
+        if chunk:
+            for result in await self._import_chunk(chunk):
+                yield result
+
+    async def _import_chunk(self, chunk: List[Union[ImportRow, ImportResult]]) -> List[ImportResult]:
+        rows = [item for item in chunk if isinstance(item, ImportRow)]
+        hash_function, cost = HashPolicy.from_settings(self.settings).hash_call()
+        executor = get_hashing_executor()
+        # The pool is shared with live requests: at most one hash per worker in
+        # flight, and waiting out a full queue instead of failing the import
+        slots = asyncio.Semaphore(executor.max_workers)
+
+        async def hash_password(password: str) -> bytes:
+            async with slots:
+                while True:
+                    try:
+                        return cast(bytes, await executor.run(hash_function, password, *cost))
+                    except ServiceOverloaded:
+                        await asyncio.sleep(0.1)
+
+        hashes = await asyncio.gather(*(hash_password(row.password) for row in rows if row.password is not None))
+        pending_hashes = iter(hashes)
+        staged = [
+            (row.line, row.email, row.password_hash or next(pending_hashes))
+            for row in rows
+        ]
+        merged = await UserRepository.bulk_merge(staged, update_existing=self.on_conflict == "update") if staged else {}
+
+        results = []
+        for item in chunk:
+            if isinstance(item, ImportResult):
+                result = item
+            else:
+                user_id, inserted = merged[item.line]
+                if user_id is None:
+                    status = "exists"
+                else:
+                    status = "created" if inserted else "updated"
+                result = ImportResult(item.line, item.email, status, user_id=user_id)
+            self.counts[result.status] = self.counts.get(result.status, 0) + 1
+            results.append(result)
+        logger.info("Imported chunk of %d rows: %s", len(chunk), self.counts)
+        return results
+
+
+async def _main(path: str, fmt: str, on_conflict: str) -> Dict[str, int]:
+    await init_async_pool()
+    importer = BulkImporter(on_conflict=on_conflict)
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+    try:
+        async for result in importer.run(aiter_file_lines(source), fmt):
+            sys.stdout.write(json.dumps(result.to_dict()) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        await close_async_pool()
+        shutdown_hashing_executor()
+    return importer.counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV or JSONL file, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    parser.add_argument("--on-conflict", choices=CONFLICT_POLICIES, default="skip")
+    args = parser.parse_args()
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    counts = asyncio.run(_main(args.path, fmt, args.on_conflict))
+    logger.info("Import finished: %s", counts)
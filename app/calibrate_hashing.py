@@ -0,0 +1,117 @@
+"""
+Benchmark password hashing on this machine and recommend a cost.
+
+Each candidate cost is timed through AuthService.hash_password, so samples
+include the HashingExecutor the API uses (HASH_EXECUTOR_KIND/WORKERS), with
+--concurrency hashes in flight to reproduce load. The recommendation is the
+highest cost whose p99 stays within --target-p99-ms. Candidates are tried
+from cheapest up and the scan stops once p99 exceeds twice the target.
+
+    python calibrate_hashing.py                                   bcrypt rounds 8-14
+    python calibrate_hashing.py --target-p99-ms 150 --concurrency 8
+    python calibrate_hashing.py --algorithm argon2id --memory-kib 65536
+
+Run it on the hardware the API is deployed to, then set the printed
+variables. Stored hashes made with other settings are upgraded as users
+log in (PASSWORD_REHASH_ENABLED).
+"""
+import argparse
+import asyncio
+import dataclasses
+import logging
+import secrets
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.common import print_table, summarize
+from config import Settings
+from hashing_executor import get_hashing_executor, shutdown_hashing_executor
+from services.auth_service import HASH_ALGORITHMS, AuthService, HashPolicy
+
+logger = logging.getLogger(__name__)
+
+
+def candidates(args: argparse.Namespace, base: HashPolicy) -> List[HashPolicy]:
+    if args.algorithm == "argon2id":
+        return [
+            dataclasses.replace(base, algorithm="argon2id", argon2_time_cost=t, argon2_memory_cost_kib=args.memory_kib)
+            for t in range(args.min_time_cost, args.max_time_cost + 1)
+        ]
+    return [
+        dataclasses.replace(base, algorithm="bcrypt", bcrypt_rounds=rounds)
+        for rounds in range(args.min_rounds, args.max_rounds + 1)
+    ]
+
+
+def env_vars(policy: HashPolicy) -> str:
+    if policy.algorithm == "argon2id":
+        return (
+            f"PASSWORD_HASH_ALGORITHM=argon2id ARGON2_TIME_COST={policy.argon2_time_cost} "
+            f"ARGON2_MEMORY_COST_KIB={policy.argon2_memory_cost_kib} ARGON2_PARALLELISM={policy.argon2_parallelism}"
+        )
+    return f"PASSWORD_HASH_ALGORITHM=bcrypt BCRYPT_ROUNDS={policy.bcrypt_rounds}"
+
+
+async def measure(policy: HashPolicy, samples: int, concurrency: int) -> Dict[str, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    durations: List[float] = []
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await AuthService.hash_password(secrets.token_urlsafe(12), policy)
+            durations.append(time.perf_counter() - started)
+
+    await AuthService.hash_password(secrets.token_urlsafe(12), policy)
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(samples)))
+    summary: Dict[str, float] = summarize(durations, time.perf_counter() - started)
+    return summary
+
+
+async def _main(args: argparse.Namespace) -> Optional[HashPolicy]:
+    base = HashPolicy.from_settings(Settings())
+    executor = get_hashing_executor()
+    concurrency = args.concurrency or executor.max_workers
+    print(
+        f"{args.algorithm}: {args.samples} hashes per cost, concurrency {concurrency}, "
+        f"{executor.kind} executor with {executor.max_workers} workers, target p99 {args.target_p99_ms:.0f}ms"
+    )
+
+    results: Dict[str, Dict[str, float]] = {}
+    recommended: Optional[HashPolicy] = None
+    try:
+        for policy in candidates(args, base):
+            summary = await measure(policy, args.samples, concurrency)
+            results[policy.describe()] = summary
+            if summary["p99_ms"] <= args.target_p99_ms:
+                recommended = policy
+            elif summary["p99_ms"] > args.target_p99_ms * 2:
+                break
+    finally:
+        shutdown_hashing_executor()
+
+    print_table(results)
+    current = base.describe()
+    if recommended is None:
+        print(f"No {args.algorithm} cost tried fits a p99 of {args.target_p99_ms:.0f}ms on this machine")
+    else:
+        print(f"Recommended: {recommended.describe()} (currently {current})")
+        print(f"  {env_vars(recommended)}")
+    return recommended
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--algorithm", choices=HASH_ALGORITHMS, default=settings.password_hash_algorithm)
+    parser.add_argument("--target-p99-ms", type=float, default=250.0, help="latency budget for one hash")
+    parser.add_argument("--samples", type=int, default=30, help="hashes timed per cost")
+    parser.add_argument("--concurrency", type=int, default=0, help="hashes in flight (default: one per worker)")
+    parser.add_argument("--min-rounds", type=int, default=8, help="lowest bcrypt cost tried")
+    parser.add_argument("--max-rounds", type=int, default=14, help="highest bcrypt cost tried")
+    parser.add_argument("--min-time-cost", type=int, default=1, help="lowest argon2id time cost tried")
+    parser.add_argument("--max-time-cost", type=int, default=8, help="highest argon2id time cost tried")
+    parser.add_argument("--memory-kib", type=int, default=settings.argon2_memory_cost_kib, help="argon2id memory cost")
+    asyncio.run(_main(parser.parse_args()))
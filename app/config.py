@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List, Optional, Tuple
 
 from pydantic import BaseModel
 
@@ -7,24 +8,207 @@ class Settings(BaseModel):
     app_host: str = os.getenv("APP_HOST", "0.0.0.0")
     app_port: int = int(os.getenv("APP_PORT", "8000"))
     log_level: str = os.getenv("LOG_LEVEL", "info")
+    # API worker logs (log_pipeline.py): json or text lines written by a background thread
+    log_format: str = os.getenv("LOG_FORMAT", "json")
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Fraction of INFO/DEBUG records kept per logger, e.g. "uvicorn.access=0.1"; warnings are always kept
+    log_sample_rates: str = os.getenv("LOG_SAMPLE_RATES", "")
+    # Serving (gunicorn.conf.py); 0 workers means one per available CPU core
+    app_workers: int = int(os.getenv("APP_WORKERS", "0"))
+    app_preload: bool = os.getenv("APP_PRELOAD", "true").lower() == "true"
+    app_graceful_timeout_seconds: float = float(os.getenv("APP_GRACEFUL_TIMEOUT_SECONDS", "30"))
+    app_shutdown_task_timeout_seconds: float = float(os.getenv("APP_SHUTDOWN_TASK_TIMEOUT_SECONDS", "10"))
 
     db_host: str = os.getenv("DB_HOST", "localhost")
     db_port: int = int(os.getenv("DB_PORT", "5432"))
     db_name: str = os.getenv("DB_NAME", "usersdb")
     db_user: str = os.getenv("DB_USER", "userapi")
     db_password: str = os.getenv("DB_PASSWORD", "userapi_password")
+    db_pool_min_size: int = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    db_pool_max_size: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    db_pool_timeout_seconds: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "5"))
+    db_pool_max_waiting: int = int(os.getenv("DB_POOL_MAX_WAITING", "0"))
+    db_pool_max_idle_seconds: float = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "600"))
+    db_pool_max_lifetime_seconds: float = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "3600"))
+    db_connect_timeout_seconds: int = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "5"))
+    db_statement_timeout_ms: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+    # Connections this API may hold across all its workers; 0 sizes each worker by DB_POOL_MAX_SIZE
+    db_max_connections_budget: int = int(os.getenv("DB_MAX_CONNECTIONS_BUDGET", "0"))
+    db_pool_warmup_timeout_seconds: float = float(os.getenv("DB_POOL_WARMUP_TIMEOUT_SECONDS", "10"))
+    # Extra shards for users and their activation codes, comma-separated name=host[:port][/dbname] (same
+    # credentials); the primary above is shard "0". Buckets are assigned to shards in its shard_map table.
+    db_shards: str = os.getenv("DB_SHARDS", "")
+    db_shard_map_refresh_seconds: float = float(os.getenv("DB_SHARD_MAP_REFRESH_SECONDS", "5"))
+    # Streaming replicas (comma-separated host[:port]) serving read-only lookups; each gets a pool sized like the primary's
+    db_replica_hosts: str = os.getenv("DB_REPLICA_HOSTS", "")
+    # Reads go to the primary while a replica is further behind than this or failed its last check
+    db_replica_max_lag_seconds: float = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+    db_replica_check_interval_seconds: float = float(os.getenv("DB_REPLICA_CHECK_INTERVAL_SECONDS", "2"))
+    # Kept short so a saturated replica falls back to the primary instead of stalling the request
+    db_replica_pool_timeout_seconds: float = float(os.getenv("DB_REPLICA_POOL_TIMEOUT_SECONDS", "0.5"))
 
     email_api_base_url: str = os.getenv("EMAIL_API_BASE_URL", "http://localhost:8081")
     email_timeout_seconds: float = float(os.getenv("EMAIL_TIMEOUT_SECONDS", "3"))
+    email_http2: bool = os.getenv("EMAIL_HTTP2", "false").lower() == "true"
+    email_max_connections: int = int(os.getenv("EMAIL_MAX_CONNECTIONS", "20"))
+    email_max_keepalive_connections: int = int(os.getenv("EMAIL_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    email_keepalive_expiry_seconds: float = float(os.getenv("EMAIL_KEEPALIVE_EXPIRY_SECONDS", "30"))
+    email_batch_enabled: bool = os.getenv("EMAIL_BATCH_ENABLED", "true").lower() == "true"
+    email_batch_max_size: int = int(os.getenv("EMAIL_BATCH_MAX_SIZE", "100"))
+    email_batch_max_delay_ms: int = int(os.getenv("EMAIL_BATCH_MAX_DELAY_MS", "20"))
+    email_max_concurrency_per_host: int = int(os.getenv("EMAIL_MAX_CONCURRENCY_PER_HOST", "20"))
 
     code_ttl_seconds: int = int(os.getenv("CODE_TTL_SECONDS", "60"))
     code_salt_bytes: int = int(os.getenv("CODE_SALT_BYTES", "16"))
+    # New hashes use this algorithm (bcrypt or argon2id); stored hashes of either are verified by prefix.
+    # Pick costs with calibrate_hashing.py.
+    password_hash_algorithm: str = os.getenv("PASSWORD_HASH_ALGORITHM", "bcrypt")
     bcrypt_rounds: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    argon2_time_cost: int = int(os.getenv("ARGON2_TIME_COST", "3"))
+    argon2_memory_cost_kib: int = int(os.getenv("ARGON2_MEMORY_COST_KIB", "65536"))
+    argon2_parallelism: int = int(os.getenv("ARGON2_PARALLELISM", "1"))
+    # Rehash with the current algorithm/cost after a successful login when the stored hash differs
+    password_rehash_enabled: bool = os.getenv("PASSWORD_REHASH_ENABLED", "true").lower() == "true"
+    # Verified Basic auth credentials are remembered (as an HMAC, never plaintext) so retries skip bcrypt
+    credential_cache_enabled: bool = os.getenv("CREDENTIAL_CACHE_ENABLED", "true").lower() == "true"
+    credential_cache_ttl_seconds: float = float(os.getenv("CREDENTIAL_CACHE_TTL_SECONDS", "300"))
+    credential_cache_max_entries: int = int(os.getenv("CREDENTIAL_CACHE_MAX_ENTRIES", "10000"))
+    # Reject already-registered emails before hashing; the Bloom filter lets most new emails skip the lookup
+    email_precheck_enabled: bool = os.getenv("EMAIL_PRECHECK_ENABLED", "true").lower() == "true"
+    email_filter_enabled: bool = os.getenv("EMAIL_FILTER_ENABLED", "true").lower() == "true"
+    email_filter_capacity: int = int(os.getenv("EMAIL_FILTER_CAPACITY", "1000000"))
+    email_filter_error_rate: float = float(os.getenv("EMAIL_FILTER_ERROR_RATE", "0.01"))
+    email_filter_refresh_seconds: float = float(os.getenv("EMAIL_FILTER_REFRESH_SECONDS", "10"))
+    email_filter_scan_batch_size: int = int(os.getenv("EMAIL_FILTER_SCAN_BATCH_SIZE", "5000"))
+    # Items accepted by one POST /v1/users:batch call
+    batch_registration_max_items: int = int(os.getenv("BATCH_REGISTRATION_MAX_ITEMS", "100"))
+    # Comma-separated Bearer tokens of partners allowed to call POST /v1/users:batch; disabled while empty
+    partner_api_tokens: str = os.getenv("PARTNER_API_TOKENS", "")
 
+    # Bearer token for /v1/admin endpoints; admin endpoints are disabled while empty
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")
+    import_chunk_size: int = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
 
-def get_db_dsn() -> str:
+    health_probe_interval_seconds: float = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "5"))
+    health_probe_timeout_seconds: float = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "2"))
+    health_max_pool_waiting: int = int(os.getenv("HEALTH_MAX_POOL_WAITING", "10"))
+    health_max_pool_wait_ms: float = float(os.getenv("HEALTH_MAX_POOL_WAIT_MS", "500"))
+    health_max_db_latency_ms: float = float(os.getenv("HEALTH_MAX_DB_LATENCY_MS", "1000"))
+    health_require_mailer: bool = os.getenv("HEALTH_REQUIRE_MAILER", "false").lower() == "true"
+    health_mailer_path: str = os.getenv("HEALTH_MAILER_PATH", "/health")
+
+    # Rate limiting was historically switched off by running with LOG_LEVEL=warning
+    rate_limit_enabled: bool = os.getenv(
+        "RATE_LIMIT_ENABLED", "false" if os.getenv("LOG_LEVEL") == "warning" else "true"
+    ).lower() == "true"
+    rate_limit_window_seconds: int = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "3600"))
+    rate_limit_registration_max_requests: int = int(os.getenv("RATE_LIMIT_REGISTRATION_MAX_REQUESTS", "100"))
+    rate_limit_activation_max_requests: int = int(os.getenv("RATE_LIMIT_ACTIVATION_MAX_REQUESTS", "50"))
+    # POST /v1/users:batch is charged one request per item
+    rate_limit_batch_registration_max_items: int = int(os.getenv("RATE_LIMIT_BATCH_REGISTRATION_MAX_ITEMS", "1000"))
+    rate_limit_backend: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    rate_limit_max_keys: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    rate_limit_purge_interval_seconds: float = float(os.getenv("RATE_LIMIT_PURGE_INTERVAL_SECONDS", "300"))
+
+    outbox_dispatcher_enabled: bool = os.getenv("OUTBOX_DISPATCHER_ENABLED", "true").lower() == "true"
+    outbox_poll_interval_seconds: float = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "0.5"))
+    outbox_batch_size: int = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    outbox_max_batches_per_run: int = int(os.getenv("OUTBOX_MAX_BATCHES_PER_RUN", "20"))
+    outbox_lease_seconds: float = float(os.getenv("OUTBOX_LEASE_SECONDS", "30"))
+    outbox_max_attempts: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    outbox_backoff_base_seconds: float = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "2"))
+    outbox_backoff_max_seconds: float = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "300"))
+
+    reaper_enabled: bool = os.getenv("REAPER_ENABLED", "false").lower() == "true"
+    reaper_interval_seconds: float = float(os.getenv("REAPER_INTERVAL_SECONDS", "300"))
+    reaper_batch_size: int = int(os.getenv("REAPER_BATCH_SIZE", "1000"))
+    reaper_batch_pause_ms: int = int(os.getenv("REAPER_BATCH_PAUSE_MS", "50"))
+    reaper_max_batches_per_run: int = int(os.getenv("REAPER_MAX_BATCHES_PER_RUN", "100"))
+    reaper_expired_code_grace_seconds: int = int(os.getenv("REAPER_EXPIRED_CODE_GRACE_SECONDS", "3600"))
+    reaper_inactive_user_retention_seconds: int = int(
+        os.getenv("REAPER_INACTIVE_USER_RETENTION_SECONDS", "604800")
+    )
+    reaper_dead_email_retention_seconds: int = int(os.getenv("REAPER_DEAD_EMAIL_RETENTION_SECONDS", "604800"))
+
+    hash_executor_kind: str = os.getenv("HASH_EXECUTOR_KIND", "thread")
+    # Hashing threads/processes per API worker; 0 splits the available CPU cores evenly across the workers
+    hash_executor_workers: int = int(os.getenv("HASH_EXECUTOR_WORKERS", "0"))
+    hash_executor_max_pending: int = int(os.getenv("HASH_EXECUTOR_MAX_PENDING", "64"))
+
+
+def available_cpu_count() -> int:
+    """CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def app_worker_count(settings: Optional[Settings] = None) -> int:
+    """APP_WORKERS, or one worker per CPU core available to this process."""
+    settings = settings or Settings()
+    if settings.app_workers > 0:
+        return settings.app_workers
+    return available_cpu_count()
+
+
+def hash_worker_count(settings: Optional[Settings] = None) -> int:
+    """
+    Size of each worker's hashing pool: HASH_EXECUTOR_WORKERS, or the
+    available cores split evenly across the API workers, so all of them
+    together run at most one hash per core.
+    """
+    settings = settings or Settings()
+    if settings.hash_executor_workers > 0:
+        return settings.hash_executor_workers
+    return max(1, available_cpu_count() // app_worker_count(settings))
+
+
+def db_pool_sizes(settings: Optional[Settings] = None) -> Tuple[int, int]:
+    """
+    (min_size, max_size) of each worker's async pool. With a connection
+    budget, max_size is the budget split evenly across the workers.
+    """
+    settings = settings or Settings()
+    max_size = settings.db_pool_max_size
+    if settings.db_max_connections_budget > 0:
+        max_size = max(1, settings.db_max_connections_budget // app_worker_count(settings))
+    return min(settings.db_pool_min_size, max_size), max_size
+
+
+def db_replica_addresses(settings: Optional[Settings] = None) -> List[Tuple[str, int]]:
+    """(host, port) of each DB_REPLICA_HOSTS entry; the port defaults to DB_PORT."""
+    settings = settings or Settings()
+    addresses = []
+    for entry in settings.db_replica_hosts.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(":") if ":" in entry else (entry, "", "")
+        addresses.append((host, int(port) if port else settings.db_port))
+    return addresses
+
+
+def db_shard_addresses(settings: Optional[Settings] = None) -> Dict[str, Tuple[str, int, str]]:
+    """Shard name -> (host, port, dbname), starting with the primary as shard "0"."""
+    settings = settings or Settings()
+    shards = {"0": (settings.db_host, settings.db_port, settings.db_name)}
+    for entry in settings.db_shards.split(","):
+        name, _, address = entry.strip().partition("=")
+        if not name or not address:
+            continue
+        address, _, dbname = address.partition("/")
+        host, _, port = address.partition(":")
+        shards[name.strip()] = (host, int(port) if port else settings.db_port, dbname or settings.db_name)
+    return shards
+
+
+def get_db_dsn(host: Optional[str] = None, port: Optional[int] = None, dbname: Optional[str] = None) -> str:
+    """DSN of the primary, or of another server or database with the same credentials."""
     settings = Settings()
-    return f"postgresql://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
+    host = host or settings.db_host
+    port = port or settings.db_port
+    dbname = dbname or settings.db_name
+    return f"postgresql://{settings.db_user}:{settings.db_password}@{host}:{port}/{dbname}"
 
 
 def get_settings() -> Settings:
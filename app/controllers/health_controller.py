@@ -1,9 +1,31 @@
 from typing import Dict
 
+from fastapi.responses import JSONResponse
+
+from health_prober import HealthProber
+
 
 class HealthController:
     
     @staticmethod
     def check_health() -> Dict[str, str]:
         return {"status": "healthy"}
-    
+
+    @staticmethod
+    def liveness() -> Dict[str, str]:
+        """The process is up and serving; dependencies are not consulted."""
+        return {"status": "alive"}
+
+    @staticmethod
+    def readiness(prober: HealthProber) -> JSONResponse:
+        """Report the prober's cached snapshot; 503 takes the instance out of rotation."""
+        snapshot = prober.current()
+        return JSONResponse(
+            status_code=200 if snapshot.ready else 503,
+            content={
+                "status": "ready" if snapshot.ready else "not_ready",
+                "checked_at": snapshot.checked_at,
+                "failures": snapshot.failures,
+                "checks": snapshot.checks,
+            },
+        )
@@ -0,0 +1,48 @@
+import json
+import logging
+from typing import AsyncIterator
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from bulk_import import BulkImporter, aiter_lines
+from config import Settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class _UploadStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that does not listen for client disconnects. The stock
+    one consumes receive() concurrently with the body iterator, which would
+    swallow the request body chunks the import is still reading.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+
+class ImportController:
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+
+    def import_users(self, request: Request, fmt: str, on_conflict: str) -> StreamingResponse:
+        """Stream one NDJSON result per input row as chunks are merged, then a summary line."""
+        importer = BulkImporter(self.settings, on_conflict=on_conflict)
+
+        async def results() -> AsyncIterator[bytes]:
+            try:
+                async for result in importer.run(aiter_lines(request.stream()), fmt):
+                    yield (json.dumps(result.to_dict()) + "\n").encode()
+            except Exception as e:
+                # Headers are already sent; report the failure in-band so the client knows the import stopped
+                logger.exception("Bulk import failed after %s", importer.counts)
+                yield (json.dumps({"error": f"{type(e).__name__}: {e}", "summary": importer.counts}) + "\n").encode()
+                return
+            logger.info("Bulk import finished: %s", importer.counts)
+            yield (json.dumps({"summary": importer.counts}) + "\n").encode()
+
+        return _UploadStreamingResponse(results(), media_type="application/x-ndjson")
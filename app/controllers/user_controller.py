@@ -4,9 +4,11 @@ from fastapi import BackgroundTasks, Depends, status
 from fastapi.responses import Response
 from fastapi.security import HTTPBasicCredentials
 
-from async_tasks import log_user_activation_task, send_activation_email_task
+from async_tasks import log_user_activation_task
 from errors import AlreadyActive, CodeExpired, InvalidCode, InvalidCredentials
-from schemas import ActivateRequest, CreateUserRequest, CreateUserResponse
+from models import UserRecord
+from schemas import ActivateRequest, CreateUserRequest, CreateUsersBatchRequest
+from serialization import ACTIVATED_BODY, batch_item_json, json_response, user_json
 from services.auth_service import AuthService
 from services.user_service import UserService
 
@@ -20,29 +22,40 @@ class UserController:
         self.user_service = user_service
         self.auth_service = auth_service
     
-    async def register_user(self, payload: CreateUserRequest, background_tasks: BackgroundTasks) -> CreateUserResponse:
-        result = self.user_service.register_user(payload.email, payload.password)
-        user = result["user"]
-        activation_code = result["activation_code"]
-
-        background_tasks.add_task(send_activation_email_task, payload.email, activation_code)
-        
-        logger.info(f"User {user['id']} registered, activation email queued")
-        return CreateUserResponse(**user)
-    
+    async def register_user(self, payload: CreateUserRequest) -> Response:
+        user = await self.user_service.register_user(payload.email, payload.password)
+
+        logger.info("User %s registered, activation email queued", user.id)
+        response: Response = json_response(user_json(user), status.HTTP_201_CREATED)
+        return response
+
+    async def register_users(self, payload: CreateUsersBatchRequest) -> Response:
+        outcomes = await self.user_service.register_users([(item.email, item.password) for item in payload.items])
+
+        results = []
+        created = 0
+        for index, outcome in enumerate(outcomes):
+            if isinstance(outcome, UserRecord):
+                results.append(batch_item_json(index, status.HTTP_201_CREATED, user=outcome))
+                created += 1
+            else:
+                results.append(batch_item_json(index, outcome.status_code, error=outcome.detail))
+        response: Response = json_response({"created": created, "failed": len(results) - created, "results": results})
+        return response
+
     async def activate_user(self, payload: ActivateRequest, credentials: HTTPBasicCredentials, background_tasks: BackgroundTasks) -> Response:
-        user = self.auth_service.authenticate_user(credentials.username, credentials.password)
+        user = await self.auth_service.authenticate_user(credentials.username, credentials.password)
         if not user:
             raise InvalidCredentials()
 
-        if user["active"]:
+        if user.active:
             raise AlreadyActive()
 
         try:
-            self.user_service.activate_user(user["id"], payload.code)
-            background_tasks.add_task(log_user_activation_task, user["id"])
+            await self.user_service.activate_user(user.id, payload.code, user.email)
+            background_tasks.add_task(log_user_activation_task, user.id)
             
         except (InvalidCode, CodeExpired) as e:
             raise e
 
-        return {"message": "Account activated successfully"}
+        return Response(ACTIVATED_BODY, media_type="application/json")
@@ -1,26 +1,265 @@
+import asyncio
+import itertools
+import logging
+import time
 import psycopg
-from contextlib import contextmanager
-from typing import Optional, Generator
-from psycopg_pool import ConnectionPool
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional, Generator
+from psycopg_pool import AsyncConnectionPool, ConnectionPool, PoolTimeout, TooManyRequests
 
-from config import get_db_dsn
+from config import Settings, db_pool_sizes, db_replica_addresses, db_shard_addresses, get_db_dsn
+from errors import ServiceOverloaded
+from metrics import DB_POOL_WAIT_SECONDS, DB_READ_ROUTES, DB_REPLICA_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# The DB_HOST database; shards added with DB_SHARDS get pools of their own
+PRIMARY_SHARD = "0"
+
+
+class Replica:
+    """
+    A streaming replica's pool and the outcome of its last check. Until the
+    first check a replica is unhealthy, so reads start on the primary.
+    """
+
+    __slots__ = ("name", "pool", "healthy", "lag_seconds", "error")
+
+    def __init__(self, name: str, pool: AsyncConnectionPool):
+        self.name = name
+        self.pool = pool
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"healthy": self.healthy, "lag_seconds": self.lag_seconds, "error": self.error}
 
 
 _pool: Optional[ConnectionPool] = None
+_async_pool: Optional[AsyncConnectionPool] = None
+_async_pool_lock = asyncio.Lock()
+_replicas: List[Replica] = []
+_shard_pools: Dict[str, AsyncConnectionPool] = {}
+_replica_turn = itertools.count()
+
 
-def init_pool(min_size: int = 1, max_size: int = 10) -> ConnectionPool:
+def _connection_kwargs(settings: Settings) -> Dict[str, Any]:
+    return {
+        "connect_timeout": settings.db_connect_timeout_seconds,
+        "options": f"-c statement_timeout={settings.db_statement_timeout_ms}",
+    }
+
+def init_pool(min_size: Optional[int] = None, max_size: Optional[int] = None) -> ConnectionPool:
     """
-    Initialize PostgreSQL connection pool with lazy loading.
+    Initialize the synchronous PostgreSQL connection pool with lazy loading.
+    Only command-line tooling uses it; request handlers use the async pool.
     """
     global _pool
     if _pool is None:
-        dsn = get_db_dsn()
-        _pool = ConnectionPool(conninfo=dsn, min_size=min_size, max_size=max_size, open=True)
+        settings = Settings()
+        _pool = ConnectionPool(
+            conninfo=get_db_dsn(),
+            min_size=min_size if min_size is not None else settings.db_pool_min_size,
+            max_size=max_size if max_size is not None else settings.db_pool_max_size,
+            timeout=settings.db_pool_timeout_seconds,
+            kwargs=_connection_kwargs(settings),
+            open=True,
+        )
     return _pool
 
-@contextmanager 
+@contextmanager
 def get_conn() -> Generator[psycopg.Connection, None, None]:
-    if _pool is None:
-        init_pool()
-    with _pool.connection() as conn:
+    pool = _pool or init_pool()
+    with pool.connection() as conn:
         yield conn
+
+def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def _async_pool_for(settings: Settings, conninfo: str, timeout: float) -> AsyncConnectionPool:
+    min_size, max_size = db_pool_sizes(settings)
+    return AsyncConnectionPool(
+        conninfo=conninfo,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=timeout,
+        max_waiting=settings.db_pool_max_waiting,
+        max_idle=settings.db_pool_max_idle_seconds,
+        max_lifetime=settings.db_pool_max_lifetime_seconds,
+        kwargs=_connection_kwargs(settings),
+        open=False,
+    )
+
+async def init_async_pool() -> AsyncConnectionPool:
+    """
+    Initialize the async PostgreSQL connection pool used by the request path,
+    plus one pool per DB_SHARDS and DB_REPLICA_HOSTS entry. Sizing (see
+    db_pool_sizes), timeouts and the per-statement timeout come from
+    Settings. Replica pools open without waiting for a connection, so a
+    replica that is down does not stop the API from starting.
+    """
+    global _async_pool
+    async with _async_pool_lock:
+        if _async_pool is None:
+            settings = Settings()
+            pool = _async_pool_for(settings, get_db_dsn(), settings.db_pool_timeout_seconds)
+            await pool.open()
+            for name, (host, port, dbname) in db_shard_addresses(settings).items():
+                if name != PRIMARY_SHARD:
+                    shard = _async_pool_for(settings, get_db_dsn(host, port, dbname), settings.db_pool_timeout_seconds)
+                    await shard.open()
+                    _shard_pools[name] = shard
+            for host, port in db_replica_addresses(settings):
+                replica = _async_pool_for(settings, get_db_dsn(host, port), settings.db_replica_pool_timeout_seconds)
+                await replica.open()
+                _replicas.append(Replica(f"{host}:{port}", replica))
+            _async_pool = pool
+    return _async_pool
+
+async def warm_async_pool(timeout: float) -> None:
+    """
+    Wait until the async pool of every shard holds min_size connections, so
+    the first requests do not pay for connection setup. psycopg closes the
+    pool and raises PoolTimeout if that takes longer than timeout.
+    """
+    pool = _async_pool or await init_async_pool()
+    await asyncio.gather(pool.wait(timeout=timeout), *(shard.wait(timeout=timeout) for shard in _shard_pools.values()))
+
+def has_replicas() -> bool:
+    return bool(_replicas)
+
+def shard_names() -> List[str]:
+    """Every configured shard, the primary first. Only valid once the pool is initialized."""
+    return [PRIMARY_SHARD, *_shard_pools]
+
+def _choose_replica() -> Optional[Replica]:
+    """The next healthy replica within the lag limit, round-robin; None if there is none."""
+    count = len(_replicas)
+    turn = next(_replica_turn)
+    for offset in range(count):
+        replica = _replicas[(turn + offset) % count]
+        if replica.healthy:
+            return replica
+    return None
+
+@asynccontextmanager
+async def get_async_conn(
+    read_only: bool = False, shard: str = PRIMARY_SHARD
+) -> AsyncGenerator[psycopg.AsyncConnection, None]:
+    """
+    A pooled connection to the primary, or with read_only=True to a replica
+    when one is healthy and within DB_REPLICA_MAX_LAG_SECONDS. Reads fall
+    back to the primary when no replica qualifies or the chosen one has no
+    free connection within DB_REPLICA_POOL_TIMEOUT_SECONDS.
+
+    Replica reads may miss writes from the last few seconds; callers that
+    need their own writes use the primary.
+
+    shard selects another DB_SHARDS database (see sharding.shard_for);
+    replicas only serve the primary, so reads from other shards use the
+    shard itself.
+    """
+    pool = _async_pool or await init_async_pool()
+    if shard != PRIMARY_SHARD:
+        if shard not in _shard_pools:
+            raise ValueError(f"Unknown shard {shard!r}: not configured in DB_SHARDS")
+        pool = _shard_pools[shard]
+    elif read_only:
+        replica = _choose_replica() if _replicas else None
+        if replica is not None:
+            stack = AsyncExitStack()
+            try:
+                conn = await stack.enter_async_context(replica.pool.connection())
+            except (PoolTimeout, TooManyRequests):
+                # Out of rotation until its next check confirms it again
+                replica.healthy, replica.error = False, "no connection available"
+                logger.warning("Replica %s unavailable, reading from the primary", replica.name)
+            else:
+                DB_READ_ROUTES.labels("replica").inc()
+                async with stack:
+                    yield conn
+                return
+        DB_READ_ROUTES.labels("primary").inc()
+    started = time.perf_counter()
+    try:
+        async with pool.connection() as conn:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+            yield conn
+    except (PoolTimeout, TooManyRequests):
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        raise ServiceOverloaded()
+
+def get_async_pool_stats() -> Dict[str, int]:
+    """Cumulative usage counters of the async pool (empty before it is opened)."""
+    return _async_pool.get_stats() if _async_pool is not None else {}
+
+def get_replica_status() -> Dict[str, Dict[str, Any]]:
+    """Health and lag of each replica as of its last check."""
+    return {replica.name: replica.status() for replica in _replicas}
+
+# On a standby, lag is zero while everything received has been replayed and
+# the WAL receiver is streaming; otherwise it is the age of the last replayed
+# transaction. A server that is not in recovery is never behind.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+             AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+async def _check_replica(replica: Replica, settings: Settings) -> None:
+    try:
+        async with replica.pool.connection() as conn:
+            row = await (await conn.execute(REPLICA_LAG_QUERY)).fetchone()
+            if row is None:
+                raise RuntimeError("lag query returned no row")
+    except Exception as e:
+        replica.healthy, replica.lag_seconds, replica.error = False, None, f"{type(e).__name__}: {e}"
+    else:
+        lag = float(row[0])
+        replica.healthy = lag <= settings.db_replica_max_lag_seconds
+        replica.lag_seconds, replica.error = lag, None
+        DB_REPLICA_LAG_SECONDS.labels(replica.name).set(lag)
+
+async def check_replicas(settings: Optional[Settings] = None) -> None:
+    """
+    Refresh every replica's health and replication lag, each bounded by
+    HEALTH_PROBE_TIMEOUT_SECONDS. Run every DB_REPLICA_CHECK_INTERVAL_SECONDS
+    by the API's replica-check task.
+    """
+    settings = settings or Settings()
+
+    async def bounded(replica: Replica) -> None:
+        was_healthy = replica.healthy
+        try:
+            await asyncio.wait_for(_check_replica(replica, settings), timeout=settings.health_probe_timeout_seconds)
+        except asyncio.TimeoutError:
+            replica.healthy, replica.lag_seconds, replica.error = False, None, "replica check timed out"
+        if replica.healthy != was_healthy:
+            if replica.healthy:
+                logger.info("Replica %s serving reads (lag %.1fs)", replica.name, replica.lag_seconds)
+            else:
+                logger.warning(
+                    "Replica %s out of rotation: %s", replica.name,
+                    replica.error or f"lag {replica.lag_seconds:.1f}s",
+                )
+
+    await asyncio.gather(*(bounded(replica) for replica in _replicas))
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await asyncio.gather(
+            *(replica.pool.close() for replica in _replicas), *(shard.close() for shard in _shard_pools.values())
+        )
+        _replicas.clear()
+        _shard_pools.clear()
+        await _async_pool.close()
+        _async_pool = None
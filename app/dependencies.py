@@ -1,8 +1,15 @@
+import secrets
 from functools import lru_cache
+from typing import Optional
+
+from fastapi import Depends
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from config import Settings
+from errors import AdminAccessDenied, PartnerAccessDenied
 from services.user_service import UserService
 from services.auth_service import AuthService
+from controllers.import_controller import ImportController
 from controllers.user_controller import UserController
 
 
@@ -31,3 +38,31 @@ def get_user_controller() -> UserController:
         user_service=get_user_service(),
         auth_service=get_auth_service()
     )
+
+
+@lru_cache()
+def get_import_controller() -> ImportController:
+    """Get ImportController instance (singleton)"""
+    return ImportController(settings=get_settings())
+
+
+admin_bearer = HTTPBearer(auto_error=False)
+
+
+def require_admin(credentials: Optional[HTTPAuthorizationCredentials] = Depends(admin_bearer)) -> None:
+    """Reject the request unless it carries ADMIN_TOKEN; with no token configured, admin endpoints are disabled."""
+    token = get_settings().admin_token
+    if not token or credentials is None or not secrets.compare_digest(credentials.credentials.encode(), token.encode()):
+        raise AdminAccessDenied()
+
+
+partner_bearer = HTTPBearer(auto_error=False)
+
+
+def require_partner(credentials: Optional[HTTPAuthorizationCredentials] = Depends(partner_bearer)) -> None:
+    """Reject the request unless it carries one of PARTNER_API_TOKENS; with none configured, partner endpoints are disabled."""
+    tokens = [token.strip().encode() for token in get_settings().partner_api_tokens.split(",") if token.strip()]
+    presented = credentials.credentials.encode() if credentials is not None else b""
+    # Every token is compared so the time taken does not reveal which one matched
+    if not sum(secrets.compare_digest(presented, token) for token in tokens):
+        raise PartnerAccessDenied()
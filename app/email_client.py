@@ -1,16 +1,176 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
 import httpx
-from config import get_settings
+from config import Settings, get_settings
+from metrics import MAILER_REQUEST_SECONDS
+from models import OutboxMessage
+
+
+class MailDeliveryError(Exception):
+    """The mailer rejected an individual message."""
+
+
+def _payload(message: OutboxMessage) -> Dict[str, str]:
+    return {"to": message.recipient, "subject": message.subject, "body": message.body}
+
+
+class MailTransport:
+    """
+    Application-lifetime HTTP client for the mailer service.
+
+    Connections are pooled and kept alive between sends (optionally over
+    HTTP/2), and the number of in-flight requests to any one host is capped
+    so a burst of registrations cannot open an unbounded number of sockets.
+    """
+
+    def __init__(self, settings: Settings):
+        self.base_url = settings.email_api_base_url
+        self.max_concurrency_per_host = settings.email_max_concurrency_per_host
+        self.client = httpx.AsyncClient(
+            timeout=settings.email_timeout_seconds,
+            http2=settings.email_http2,
+            limits=httpx.Limits(
+                max_connections=settings.email_max_connections,
+                max_keepalive_connections=settings.email_max_keepalive_connections,
+                keepalive_expiry=settings.email_keepalive_expiry_seconds,
+            ),
+        )
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.batcher: Optional[MailBatcher] = None
+        if settings.email_batch_enabled:
+            self.batcher = MailBatcher(
+                self, settings.email_batch_max_size, settings.email_batch_max_delay_ms / 1000
+            )
+
+    def _slots(self, url: httpx.URL) -> asyncio.Semaphore:
+        key = f"{url.scheme}://{url.netloc.decode()}"
+        if key not in self._host_slots:
+            self._host_slots[key] = asyncio.Semaphore(self.max_concurrency_per_host)
+        return self._host_slots[key]
+
+    async def post(self, path: str, json: Any) -> httpx.Response:
+        url = httpx.URL(f"{self.base_url}{path}")
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self._slots(url):
+                resp = await self.client.post(url, json=json)
+            resp.raise_for_status()
+            outcome = "ok"
+            return resp
+        finally:
+            MAILER_REQUEST_SECONDS.labels(path, outcome).observe(time.perf_counter() - started)
+
+    async def aclose(self) -> None:
+        if self.batcher is not None:
+            await self.batcher.aclose()
+        await self.client.aclose()
+
+
+class MailBatcher:
+    """
+    Coalesces individual sends into POST /send/batch requests.
+
+    A batch is sent once it holds max_batch_size messages or max_delay
+    seconds after its first message, whichever comes first. Each caller
+    waits for the outcome of its own message: the mailer reports results
+    per message, so a rejected message fails on its own and can be retried
+    without resending the rest of its batch.
+    """
+
+    def __init__(self, transport: MailTransport, max_batch_size: int, max_delay: float):
+        self.transport = transport
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending: List[Tuple[OutboxMessage, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def send(self, message: OutboxMessage) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((message, future))
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self.flush)
+        await future
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._deliver(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, batch: List[Tuple[OutboxMessage, asyncio.Future]]) -> None:
+        try:
+            resp = await self.transport.post(
+                "/send/batch", json={"messages": [_payload(message) for message, _ in batch]}
+            )
+            results = {result["index"]: result for result in resp.json()["results"]}
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            result = results.get(index, {"status": "missing"})
+            if result["status"] == "accepted":
+                future.set_result(None)
+            else:
+                future.set_exception(MailDeliveryError(result.get("error", result["status"])))
+
+    async def aclose(self) -> None:
+        self.flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+
+_transport: Optional[MailTransport] = None
+
+def init_mail_transport() -> MailTransport:
+    """
+    Create the shared mail transport. Called from the app lifespan; also
+    created lazily on first use for scripts that run outside it.
+    """
+    global _transport
+    if _transport is None:
+        _transport = MailTransport(get_settings())
+    return _transport
+
+def get_mail_transport() -> MailTransport:
+    return _transport or init_mail_transport()
+
+async def close_mail_transport() -> None:
+    global _transport
+    if _transport is not None:
+        await _transport.aclose()
+        _transport = None
+
+
+def activation_email(email: str, code: str) -> OutboxMessage:
+    return OutboxMessage(
+        recipient=email, subject="Your activation code", body=f"Your code is: {code}",
+        ttl_seconds=get_settings().code_ttl_seconds,
+    )
+
+
+async def send_email(message: OutboxMessage) -> None:
+    transport = get_mail_transport()
+    if transport.batcher is not None:
+        await transport.batcher.send(message)
+    else:
+        await transport.post("/send", json=_payload(message))
 
 
 async def send_activation_email(email: str, code: str) -> None:
-    settings = get_settings()
-    
-    payload = {
-        "to": email,
-        "subject": "Your activation code",
-        "body": f"Your code is: {code}"
-    }
-    
-    async with httpx.AsyncClient(timeout=settings.email_timeout_seconds) as client:
-        resp = await client.post(f"{settings.email_api_base_url}/send", json=payload)
-        resp.raise_for_status()
+    await send_email(activation_email(email, code))
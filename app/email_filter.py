@@ -0,0 +1,164 @@
+"""
+In-process Bloom filter of registered emails, used to turn away duplicate
+signups before paying for a bcrypt hash.
+
+A Bloom filter never reports a stored email as absent, so a negative answer
+lets registration skip the existence query entirely; a positive answer may
+be a false positive (about EMAIL_FILTER_ERROR_RATE of new emails) and is
+confirmed with UserRepository.email_exists. The users table's unique
+constraint stays the source of truth: emails registered by other workers
+since the last refresh are simply not pre-rejected.
+
+The filter is built with a streaming scan of users on startup, then
+refreshed every EMAIL_FILTER_REFRESH_SECONDS with users created since the
+previous scan (served by users_created_at_idx), shard by shard with a
+watermark each. Registrations made by this worker are added as they happen. Once it holds more than its capacity the
+next refresh rebuilds it twice as large.
+"""
+import hashlib
+import logging
+import math
+import struct
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from background import PeriodicTask
+from config import Settings
+from database import PRIMARY_SHARD, get_async_conn, shard_names
+from metrics import DB_QUERY_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+# Rows created in a transaction that commits after the refresh reads past
+# their created_at are caught by rescanning this far behind the watermark
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+_HALVES = struct.Struct("<QQ")
+
+
+class BloomFilter:
+
+    __slots__ = ("capacity", "size", "hashes", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str) -> List[int]:
+        # Double hashing: k positions from the two 64-bit halves of one digest
+        h1, h2 = _HALVES.unpack(hashlib.blake2b(value.encode(), digest_size=16).digest())
+        h2 |= 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, value: str) -> None:
+        # Counted only if it set a new bit, so re-adding a value (refreshes
+        # overlap) does not inflate the count that triggers a resize
+        bits = self.bits
+        added = False
+        for position in self._positions(value):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                added = True
+        self.count += added
+
+    def __contains__(self, value: str) -> bool:
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class EmailFilter:
+
+    SCAN_QUERY = "SELECT email FROM users"
+    REFRESH_QUERY = "SELECT email FROM users WHERE created_at > %s"
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or Settings()
+        self.bloom: Optional[BloomFilter] = None
+        self.watermarks: Dict[str, datetime] = {}
+
+    def might_contain(self, email: str) -> bool:
+        """False only if email is certainly not registered (as of the last refresh or local insert)."""
+        return self.bloom is None or email in self.bloom
+
+    def add(self, email: str) -> None:
+        if self.bloom is not None:
+            self.bloom.add(email)
+
+    async def _scan(self, bloom: BloomFilter, since: Optional[datetime], shard: str = PRIMARY_SHARD) -> int:
+        """
+        Stream a shard's emails into bloom through a server-side cursor, on a
+        replica when one is available. The shard's watermark becomes the scan
+        transaction's start time, so the next refresh picks up from there even
+        when no rows were read; replicas serve reads only while their lag is
+        well inside REFRESH_OVERLAP, so rows they had not replayed yet are
+        rescanned.
+        """
+        scanned = 0
+        async with get_async_conn(read_only=True, shard=shard) as conn:
+            started_at = (await (await conn.execute("SELECT now()")).fetchone())[0]
+            async with conn.cursor(name="email_filter_scan") as cur:
+                cur.itersize = self.settings.email_filter_scan_batch_size
+                if since is None:
+                    await cur.execute(self.SCAN_QUERY)
+                else:
+                    await cur.execute(self.REFRESH_QUERY, (since,))
+                async for (email,) in cur:
+                    bloom.add(email)
+                    scanned += 1
+            await conn.commit()
+        self.watermarks[shard] = started_at
+        return scanned
+
+    async def build(self, capacity: Optional[int] = None) -> None:
+        settings = self.settings
+        bloom = BloomFilter(capacity or settings.email_filter_capacity, settings.email_filter_error_rate)
+        started = time.perf_counter()
+        scanned = 0
+        with timed(DB_QUERY_SECONDS, query="users.email_filter_scan"):
+            for shard in shard_names():
+                scanned += await self._scan(bloom, since=None, shard=shard)
+        self.bloom = bloom
+        logger.info(
+            "Email filter built from %d users in %.0fms (capacity %d, %d KiB)",
+            scanned, (time.perf_counter() - started) * 1000, bloom.capacity, len(bloom.bits) // 1024,
+        )
+
+    async def refresh(self) -> None:
+        bloom = self.bloom
+        if bloom is None:
+            await self.build()
+        elif bloom.count > bloom.capacity:
+            await self.build(capacity=bloom.capacity * 2)
+        else:
+            scanned = 0
+            with timed(DB_QUERY_SECONDS, query="users.email_filter_refresh"):
+                for shard in shard_names():
+                    watermark = self.watermarks.get(shard)
+                    since = watermark - REFRESH_OVERLAP if watermark is not None else None
+                    scanned += await self._scan(bloom, since=since, shard=shard)
+            logger.debug("Email filter refreshed with %d users", scanned)
+
+    def periodic(self) -> PeriodicTask:
+        return PeriodicTask("email-filter", self.refresh, self.settings.email_filter_refresh_seconds)
+
+
+_email_filter: Optional[EmailFilter] = None
+
+def init_email_filter(settings: Optional[Settings] = None) -> EmailFilter:
+    global _email_filter
+    if _email_filter is None:
+        _email_filter = EmailFilter(settings)
+    return _email_filter
+
+def get_email_filter() -> Optional[EmailFilter]:
+    """The process-wide filter, or None when it is disabled."""
+    return _email_filter
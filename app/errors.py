@@ -54,3 +54,60 @@ class AlreadyActive(HTTPException):
                 "code": "DM_REG_005"
             }
         )
+
+class ServiceOverloaded(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+            detail={
+                "error": "SERVICE_OVERLOADED",
+                "message": "Service is temporarily overloaded. Try again later.",
+                "code": "DM_REG_006"
+            },
+            headers={"Retry-After": "1"}
+        )
+
+class RateLimited(HTTPException):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, 
+            detail={
+                "error": "RATE_LIMITED",
+                "message": message,
+                "code": "DM_REG_007"
+            },
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class AdminAccessDenied(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail={
+                "error": "ADMIN_ACCESS_DENIED",
+                "message": "A valid admin token is required.",
+                "code": "DM_REG_008"
+            }
+        )
+
+class PartnerAccessDenied(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail={
+                "error": "PARTNER_ACCESS_DENIED",
+                "message": "A valid partner API token is required.",
+                "code": "DM_REG_009"
+            }
+        )
+
+class RequestTooLarge(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, 
+            detail={
+                "error": "REQUEST_TOO_LARGE",
+                "message": f"Request body exceeds {max_bytes} bytes.",
+                "code": "DM_REG_010"
+            }
+        )
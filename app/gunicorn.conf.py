@@ -0,0 +1,47 @@
+"""
+Production serving: gunicorn managing uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+Workers default to one per CPU core (APP_WORKERS); each worker is async and
+runs bcrypt in its own hashing pool. With preload the app is imported once in
+the master and shared copy-on-write; pools and executors are created per
+worker in the lifespan. Each worker's connection pool is sized from
+DB_MAX_CONNECTIONS_BUDGET (see config.db_pool_sizes).
+"""
+import os
+import shutil
+
+from config import Settings, app_worker_count
+
+_settings = Settings()
+
+bind = f"{_settings.app_host}:{_settings.app_port}"
+workers = app_worker_count(_settings)
+worker_class = "serving.ServingWorker"
+preload_app = _settings.app_preload
+graceful_timeout = int(_settings.app_graceful_timeout_seconds)
+loglevel = _settings.log_level
+accesslog = "-"
+
+# Must exist before a preloaded app creates its metrics
+_metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if _metrics_dir:
+    os.makedirs(_metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Samples left by a previous run would be aggregated into this one
+    if _metrics_dir:
+        shutil.rmtree(_metrics_dir, ignore_errors=True)
+        os.makedirs(_metrics_dir)
+
+
+def when_ready(server):
+    server.log.info("Serving with %d workers", workers)
+
+
+def child_exit(server, worker):
+    if _metrics_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
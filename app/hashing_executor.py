@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from config import Settings, hash_worker_count
+from errors import ServiceOverloaded
+from metrics import PASSWORD_HASH_QUEUE_SECONDS, PASSWORD_HASH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _timed_call(func: Callable[..., T], *args: Any) -> Tuple[T, float]:
+    """
+    Run func inside the worker and report how long it actually ran.
+    Module-level so it can be pickled for process pools.
+    """
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+@dataclass
+class OperationStats:
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    queue_seconds: float = 0.0
+
+    def record(self, run_seconds: float, queue_seconds: float) -> None:
+        self.calls += 1
+        self.total_seconds += run_seconds
+        self.queue_seconds += queue_seconds
+        if run_seconds > self.max_seconds:
+            self.max_seconds = run_seconds
+
+
+class HashingExecutor:
+    """
+    Runs CPU-bound password hashing off the event loop.
+
+    Work is submitted to a thread or process pool. The number of calls that
+    are queued or running is capped; past that cap new calls are rejected
+    with ServiceOverloaded (503) instead of piling up behind the pool.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 1, max_pending: int = 64):
+        if kind == "process":
+            self._executor: Executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hashing")
+        else:
+            raise ValueError(f"Unknown hash executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.stats: Dict[str, OperationStats] = {}
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning("Hashing queue full (%d pending), shedding %s", self.pending, func.__name__)
+            raise ServiceOverloaded()
+
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, run_seconds = await loop.run_in_executor(self._executor, _timed_call, func, *args)
+        finally:
+            self.pending -= 1
+
+        elapsed = time.perf_counter() - submitted
+        queue_seconds = max(elapsed - run_seconds, 0.0)
+        self.stats.setdefault(func.__name__, OperationStats()).record(run_seconds, queue_seconds)
+        PASSWORD_HASH_SECONDS.labels(func.__name__).observe(run_seconds)
+        PASSWORD_HASH_QUEUE_SECONDS.labels(func.__name__).observe(queue_seconds)
+        logger.debug(
+            "%s ran %.1fms (queued %.1fms)", func.__name__, run_seconds * 1000, queue_seconds * 1000
+        )
+        return result
+
+    def average_seconds(self, name: str) -> float:
+        """Mean run time of the named operation so far, 0.0 before its first call."""
+        op = self.stats.get(name)
+        return op.total_seconds / op.calls if op is not None and op.calls else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "operations": {
+                name: {
+                    "calls": op.calls,
+                    "avg_ms": (op.total_seconds / op.calls * 1000) if op.calls else 0.0,
+                    "max_ms": op.max_seconds * 1000,
+                    "avg_queue_ms": (op.queue_seconds / op.calls * 1000) if op.calls else 0.0,
+                }
+                for name, op in self.stats.items()
+            },
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_executor: Optional[HashingExecutor] = None
+
+def get_hashing_executor() -> HashingExecutor:
+    """
+    Get the process-wide hashing executor, creating it on first use.
+    """
+    global _executor
+    if _executor is None:
+        settings = Settings()
+        _executor = HashingExecutor(
+            kind=settings.hash_executor_kind,
+            max_workers=hash_worker_count(settings),
+            max_pending=settings.hash_executor_max_pending,
+        )
+    return _executor
+
+def shutdown_hashing_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
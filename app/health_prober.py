@@ -0,0 +1,155 @@
+"""
+Background dependency checks backing the readiness endpoint.
+
+Probing Postgres and the mailer on every health request would turn load
+balancer polling into database load. Instead a PeriodicTask refreshes a
+cached HealthSnapshot every HEALTH_PROBE_INTERVAL_SECONDS, and the readiness
+endpoint only reads it.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from background import PeriodicTask
+from config import Settings
+from database import PRIMARY_SHARD, get_async_conn, get_async_pool_stats, get_replica_status, shard_names
+from email_client import get_mail_transport
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HealthSnapshot:
+    ready: bool
+    checked_at: float
+    failures: List[str] = field(default_factory=list)
+    checks: Dict[str, Any] = field(default_factory=dict)
+
+
+class HealthProber:
+    """
+    Checks pool pressure, database round-trip latency and mailer
+    reachability. Pool wait time is averaged over the requests made since
+    the previous probe, from the pool's cumulative counters. Every shard
+    must answer, since its users can neither register nor log in otherwise.
+    Replica status is reported but never fails readiness, since reads fall
+    back to the primary.
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or Settings()
+        self.snapshot: Optional[HealthSnapshot] = None
+        self._previous_pool_stats: Dict[str, int] = {}
+
+    def pool_check(self) -> Dict[str, Any]:
+        stats = get_async_pool_stats()
+        previous, self._previous_pool_stats = self._previous_pool_stats, stats
+        requests = stats.get("requests_num", 0) - previous.get("requests_num", 0)
+        wait_ms = stats.get("requests_wait_ms", 0) - previous.get("requests_wait_ms", 0)
+        return {
+            "size": stats.get("pool_size", 0),
+            "available": stats.get("pool_available", 0),
+            "waiting": stats.get("requests_waiting", 0),
+            "avg_wait_ms": wait_ms / requests if requests > 0 else 0.0,
+        }
+
+    async def database_check(self, shard: str = PRIMARY_SHARD) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            async with get_async_conn(shard=shard) as conn:
+                await conn.execute("SELECT 1")
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return {"ok": True, "latency_ms": (time.perf_counter() - started) * 1000}
+
+    async def mailer_check(self) -> Dict[str, Any]:
+        # Any HTTP response means the mailer is reachable
+        transport = get_mail_transport()
+        started = time.perf_counter()
+        try:
+            resp = await transport.client.get(f"{transport.base_url}{self.settings.health_mailer_path}")
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return {"ok": resp.status_code < 500, "status": resp.status_code, "latency_ms": (time.perf_counter() - started) * 1000}
+
+    async def _bounded(self, check, name: str, *args: Any) -> Dict[str, Any]:
+        try:
+            return await asyncio.wait_for(check(*args), timeout=self.settings.health_probe_timeout_seconds)
+        except asyncio.TimeoutError:
+            return {"ok": False, "error": f"{name} probe timed out"}
+
+    def _failures(
+        self, pool: Dict[str, Any], database: Dict[str, Any], shard_checks: Dict[str, Dict[str, Any]],
+        mailer: Dict[str, Any],
+    ) -> List[str]:
+        """Readiness failures of the checks against the configured thresholds."""
+        settings = self.settings
+        failures = []
+        if pool["waiting"] > settings.health_max_pool_waiting:
+            failures.append(f"{pool['waiting']} requests waiting for a database connection")
+        if pool["avg_wait_ms"] > settings.health_max_pool_wait_ms:
+            failures.append(f"database connection wait {pool['avg_wait_ms']:.0f}ms")
+        databases = {"database": database, **{f"shard {shard}": check for shard, check in shard_checks.items()}}
+        for name, check in databases.items():
+            if not check["ok"]:
+                failures.append(f"{name} unavailable: {check['error']}")
+            elif check["latency_ms"] > settings.health_max_db_latency_ms:
+                failures.append(f"{name} round trip {check['latency_ms']:.0f}ms")
+        if settings.health_require_mailer and not mailer["ok"]:
+            failures.append("mailer unreachable")
+        return failures
+
+    def _record_result(self, snapshot: HealthSnapshot) -> None:
+        """Cache the snapshot, logging when readiness changes."""
+        if self.snapshot is not None and self.snapshot.ready != snapshot.ready:
+            if snapshot.ready:
+                logger.info("Readiness restored")
+            else:
+                logger.warning("Not ready: %s", "; ".join(snapshot.failures))
+        self.snapshot = snapshot
+
+    async def probe(self) -> HealthSnapshot:
+        pool = self.pool_check()
+        shards = [shard for shard in shard_names() if shard != PRIMARY_SHARD]
+        database, mailer, *shard_results = await asyncio.gather(
+            self._bounded(self.database_check, "database"),
+            self._bounded(self.mailer_check, "mailer"),
+            *(self._bounded(self.database_check, f"shard {shard}", shard) for shard in shards),
+        )
+        shard_checks = dict(zip(shards, shard_results))
+        failures = self._failures(pool, database, shard_checks, mailer)
+
+        snapshot = HealthSnapshot(
+            ready=not failures,
+            checked_at=time.time(),
+            failures=failures,
+            checks={
+                "pool": pool,
+                "database": database,
+                "shards": shard_checks,
+                "mailer": mailer,
+                "replicas": get_replica_status(),
+            },
+        )
+        self._record_result(snapshot)
+        return snapshot
+
+    def current(self) -> HealthSnapshot:
+        """The cached snapshot, treated as failing if the prober has stopped refreshing it."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return HealthSnapshot(ready=False, checked_at=0.0, failures=["dependency checks have not run yet"])
+        age = time.time() - snapshot.checked_at
+        if age > self.settings.health_probe_interval_seconds * 3 + self.settings.health_probe_timeout_seconds:
+            return HealthSnapshot(
+                ready=False,
+                checked_at=snapshot.checked_at,
+                failures=[f"dependency checks are stale ({age:.0f}s old)"],
+                checks=snapshot.checks,
+            )
+        return snapshot
+
+    def periodic(self) -> PeriodicTask:
+        return PeriodicTask("health-prober", self.probe, self.settings.health_probe_interval_seconds)
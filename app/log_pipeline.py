@@ -0,0 +1,205 @@
+"""
+Non-blocking log output for the API workers.
+
+Loggers on the request path hand records to a bounded in-memory queue
+(QueueHandler); a QueueListener thread formats them and writes to stdout,
+so a slow or blocked stdout never stalls the event loop. Records keep their
+%-style args until the writer thread formats them, which keeps the cost on
+the request path to a level check, the filters and a queue put. Pass only
+values that will not change afterwards (strings, numbers, ids) as args.
+
+Each record carries the id SecurityMiddleware assigns the request, through
+the request_id_var context variable, and any `extra=` fields. Output is one
+JSON object per line (LOG_FORMAT=json) or plain text.
+
+LOG_SAMPLE_RATES keeps a fraction of a noisy logger's records below
+WARNING, for example "uvicorn.access=0.1,services.user_service=0.5"; a rate
+applies to the logger and its children. When the queue is full, new records
+are dropped rather than waited for. Both kinds of loss are counted in
+log_records_dropped_total{reason}.
+"""
+import json
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+from config import Settings
+from metrics import LOG_RECORDS_DROPPED
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Loggers that install their own handlers; routed through the pipeline instead
+SERVER_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access", "gunicorn.error", "gunicorn.access")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """"name=rate,..." as {logger name: fraction of records kept}."""
+    rates: Dict[str, float] = {}
+    for entry in spec.split(","):
+        name, _, rate = entry.strip().partition("=")
+        if name and rate:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps each record below WARNING with its logger's sample rate (the nearest configured ancestor's)."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, candidate = 1.0, name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.labels("sampled").inc()
+        return False
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps the current request id on the record, in the thread that logged it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Enqueues records untouched, leaving formatting to the listener thread,
+    and drops them when the queue is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+
+class _Listener(QueueListener):
+    # Narrower than the stubs: LogPipeline always passes a queue.Queue, and the
+    # sentinel is the None that QueueListener sets at runtime
+    queue: "queue.Queue[Optional[logging.LogRecord]]"
+    _sentinel: None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for room, so stopping with a full queue still flushes it
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """
+    Owns the queue, the handler installed on the root logger and the writer
+    thread. start() takes over the root and server loggers' handlers and
+    stop() flushes the queue and puts them back.
+    """
+
+    def __init__(self, settings: Optional[Settings] = None, stream: Optional[TextIO] = None):
+        self.settings = settings or Settings()
+        # Records, then the listener's None sentinel when it stops
+        self.queue: "queue.Queue[Optional[logging.LogRecord]]" = queue.Queue(maxsize=self.settings.log_queue_size)
+        self.handler = BoundedQueueHandler(self.queue)
+        self.handler.addFilter(SamplingFilter(parse_sample_rates(self.settings.log_sample_rates)))
+        self.handler.addFilter(RequestContextFilter())
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        if self.settings.log_format == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter(TEXT_FORMAT))
+        self.listener = _Listener(self.queue, output)
+        self._saved: List[Tuple[logging.Logger, List[logging.Handler], bool]] = []
+        self._saved_level = logging.NOTSET
+
+    def start(self) -> None:
+        root = logging.getLogger()
+        self._saved = [(root, root.handlers[:], root.propagate)]
+        for name in SERVER_LOGGERS:
+            logger = logging.getLogger(name)
+            self._saved.append((logger, logger.handlers[:], logger.propagate))
+            logger.handlers = []
+            logger.propagate = True
+        root.handlers = [self.handler]
+        self._saved_level = root.level
+        root.setLevel(self.settings.log_level.upper())
+        self.listener.start()
+
+    def stop(self) -> None:
+        for logger, handlers, propagate in self._saved:
+            logger.handlers = handlers
+            logger.propagate = propagate
+        self._saved = []
+        logging.getLogger().setLevel(self._saved_level)
+        self.listener.stop()
+
+
+_log_pipeline: Optional[LogPipeline] = None
+
+def start_log_pipeline(settings: Optional[Settings] = None) -> LogPipeline:
+    """Start this process's pipeline; called per worker, after the fork."""
+    global _log_pipeline
+    if _log_pipeline is None:
+        _log_pipeline = LogPipeline(settings)
+        _log_pipeline.start()
+    return _log_pipeline
+
+def stop_log_pipeline() -> None:
+    global _log_pipeline
+    if _log_pipeline is not None:
+        _log_pipeline.stop()
+        _log_pipeline = None
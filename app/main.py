@@ -1,15 +1,108 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
+from typing import Literal
 
-from fastapi import BackgroundTasks, Depends, FastAPI
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-
+from activation_reaper import ActivationReaper
+from background import PeriodicTask
 from config import Settings
 from controllers.health_controller import HealthController
+from controllers.import_controller import ImportController
 from controllers.user_controller import UserController
-from dependencies import get_user_controller
-from middleware.rate_limiting import InMemoryRateLimiter, RateLimitMiddleware
+from database import (
+    check_replicas,
+    close_async_pool,
+    has_replicas,
+    init_async_pool,
+    warm_async_pool,
+)
+from dependencies import get_import_controller, get_user_controller, require_admin, require_partner
+from email_client import close_mail_transport, init_mail_transport
+from email_filter import init_email_filter
+from fastapi import BackgroundTasks, Depends, FastAPI, Request, Response
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from hashing_executor import get_hashing_executor, shutdown_hashing_executor
+from health_prober import HealthProber
+from log_pipeline import start_log_pipeline, stop_log_pipeline
+from metrics import render_metrics
+from middleware.metrics_middleware import MetricsMiddleware
+from middleware.rate_limiting import PostgresRateLimiter, RateLimitMiddleware, create_rate_limiter
 from middleware.security_middleware import SecurityMiddleware
-from schemas import ActivateRequest, CreateUserRequest, CreateUserResponse
+from outbox_dispatcher import OutboxDispatcher
+from schemas import (
+    ActivateRequest,
+    CreateUserRequest,
+    CreateUserResponse,
+    CreateUsersBatchRequest,
+    CreateUsersBatchResponse,
+)
+from services.auth_service import AuthService
+from sharding import get_shard_map, is_sharded
+
+
+@asynccontextmanager
+async def app_resources(app: FastAPI):
+    settings = Settings()
+    logger = logging.getLogger("uvicorn.error")
+
+    # Warm up before accepting traffic: open the pool's connections and start the hashing workers
+    hashing_executor = get_hashing_executor()
+    await init_async_pool()
+    await warm_async_pool(settings.db_pool_warmup_timeout_seconds)
+    # Replicas take reads once a check has found them within the lag limit
+    await check_replicas(settings)
+    shard_map = await get_shard_map(settings)
+    await AuthService.warm_up(hashing_executor.max_workers)
+    init_mail_transport()
+    logger.info("Connection pool and hashing workers warmed up")
+
+    background = [app.state.health_prober.periodic()]
+    if has_replicas():
+        background.append(PeriodicTask("replica-check", check_replicas, settings.db_replica_check_interval_seconds))
+    if is_sharded():
+        background.append(shard_map.periodic())
+    if settings.email_precheck_enabled and settings.email_filter_enabled:
+        # Built by the task's first run; until then every precheck queries the database
+        background.append(init_email_filter(settings).periodic())
+    if settings.outbox_dispatcher_enabled:
+        background.append(OutboxDispatcher(settings).periodic())
+    if settings.reaper_enabled:
+        background.append(ActivationReaper(settings).periodic())
+    if isinstance(app.state.rate_limiter, PostgresRateLimiter):
+        background.append(
+            PeriodicTask(
+                "rate-limit-purge",
+                app.state.rate_limiter.purge_idle,
+                settings.rate_limit_purge_interval_seconds,
+            )
+        )
+    for task in background:
+        task.start()
+
+    yield
+
+    # The server has stopped accepting connections and drained in-flight requests;
+    # let background jobs finish their current run before releasing resources
+    await asyncio.gather(
+        *(task.stop(settings.app_shutdown_task_timeout_seconds) for task in background),
+        AuthService.wait_for_rehashes(settings.app_shutdown_task_timeout_seconds),
+    )
+    await close_mail_transport()
+    await close_async_pool()
+    shutdown_hashing_executor()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Started per worker, since the writer thread would not survive gunicorn's fork,
+    # and stopped last so shutdown and startup failures are flushed
+    start_log_pipeline()
+    try:
+        async with app_resources(app):
+            yield
+    finally:
+        stop_log_pipeline()
+
 
 def create_app() -> FastAPI:
     settings = Settings()
@@ -19,15 +112,19 @@ def create_app() -> FastAPI:
         version="1.0.0",
         description="User registration API with email verification and activation codes",
         docs_url="/docs",
-        redoc_url="/redoc"
+        redoc_url="/redoc",
+        lifespan=lifespan
     )
 
     logger = logging.getLogger("uvicorn")
     logger.setLevel(getattr(logging, settings.log_level.upper()))
 
-    rate_limiter = InMemoryRateLimiter()
-    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+    rate_limiter = create_rate_limiter(settings)
+    app.state.rate_limiter = rate_limiter
+    app.state.health_prober = HealthProber(settings)
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, settings=settings)
     app.add_middleware(SecurityMiddleware)
+    app.add_middleware(MetricsMiddleware)
     
     return app
 
@@ -40,13 +137,36 @@ def health():
     return HealthController.check_health()
 
 
+@app.get("/health/live")
+async def health_live():
+    return HealthController.liveness()
+
+
+@app.get("/health/ready")
+async def health_ready(request: Request):
+    return HealthController.readiness(request.app.state.health_prober)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
 @app.post("/v1/users", response_model=CreateUserResponse, status_code=201)
 async def register_user(
     payload: CreateUserRequest,
-    background_tasks: BackgroundTasks,
     controller: UserController = Depends(get_user_controller)
 ):
-    return await controller.register_user(payload, background_tasks)
+    return await controller.register_user(payload)
+
+
+@app.post("/v1/users:batch", response_model=CreateUsersBatchResponse, dependencies=[Depends(require_partner)])
+async def register_users(
+    payload: CreateUsersBatchRequest,
+    controller: UserController = Depends(get_user_controller)
+):
+    return await controller.register_users(payload)
 
 
 @app.post("/v1/users/activate")
@@ -57,3 +177,13 @@ async def activate_user(
     controller: UserController = Depends(get_user_controller)
 ):
     return await controller.activate_user(payload, credentials, background_tasks)
+
+
+@app.post("/v1/admin/users/import", dependencies=[Depends(require_admin)])
+async def import_users(
+    request: Request,
+    format: Literal["csv", "jsonl"] = "jsonl",
+    on_conflict: Literal["skip", "update"] = "skip",
+    controller: ImportController = Depends(get_import_controller)
+):
+    return controller.import_users(request, format, on_conflict)
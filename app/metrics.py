@@ -0,0 +1,173 @@
+"""
+Prometheus metrics for the request path and background jobs, exported at /metrics.
+
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by the workers before they start: each process then writes
+its samples to files there and /metrics aggregates all of them. Without it,
+each process exports only its own registry.
+"""
+import os
+import time
+from functools import wraps
+from inspect import iscoroutinefunction
+from typing import Any, Callable, Dict, Tuple, TypeVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Request-path latencies: sub-millisecond SQL up to slow bcrypt and mailer timeouts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds", "Time spent hashing or verifying a password in a worker",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+PASSWORD_HASH_QUEUE_SECONDS = Histogram(
+    "password_hash_queue_seconds", "Time a hashing call waited for a free worker",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time by query name",
+    ["query"], buckets=LATENCY_BUCKETS,
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time waiting to check out a pooled database connection",
+    buckets=LATENCY_BUCKETS,
+)
+MAILER_REQUEST_SECONDS = Histogram(
+    "mailer_request_duration_seconds", "Mailer HTTP request latency",
+    ["endpoint", "outcome"], buckets=LATENCY_BUCKETS,
+)
+EMAIL_OUTBOX_DELIVERIES = Counter(
+    "email_outbox_deliveries", "Outbox delivery attempts by result (sent, retried, dead, expired)",
+    ["result"],
+)
+PASSWORD_REHASHES = Counter(
+    "password_rehashes", "Outdated password hashes replaced after login (upgraded, superseded, failed)",
+    ["result"],
+)
+CREDENTIAL_CACHE_LOOKUPS = Counter(
+    "credential_cache_lookups", "Basic auth checks answered from the verified-credential cache (hit) or by bcrypt (miss)",
+    ["result"],
+)
+EMAIL_PRECHECKS = Counter(
+    "email_prechecks", "Registration email checks before hashing (filter_negative, new, duplicate)",
+    ["outcome"],
+)
+PASSWORD_HASH_SECONDS_SAVED = Counter(
+    "password_hash_seconds_saved", "Estimated hashing worker time not spent on rejected duplicate emails",
+)
+DB_READ_ROUTES = Counter(
+    "db_read_routes", "Read-only connections served by a replica or by the primary",
+    ["target"],
+)
+# Workers check the same replicas; "livemax" keeps the worst report of the running ones instead of summing them
+DB_REPLICA_LAG_SECONDS = Gauge(
+    "db_replica_lag_seconds", "Replication lag of each replica at its last check",
+    ["replica"], multiprocess_mode="livemax",
+)
+DB_SHARD_REDIRECTS = Counter(
+    "db_shard_redirects", "Sharded writes retried on another shard because their bucket had moved",
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped", "Log records not written, by reason (sampled, queue_full)",
+    ["reason"],
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections", "Requests rejected by the rate limiter",
+    ["rule"],
+)
+REAPER_ROWS_DELETED = Counter(
+    "reaper_rows_deleted", "Rows purged by the activation reaper by category (expired_codes, used_codes, inactive_users, dead_emails)",
+    ["category"],
+)
+REAPER_RUN_SECONDS = Histogram(
+    "reaper_run_duration_seconds", "Duration of complete activation reaper runs",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+# Any process may run the reaper; "max" keeps the most recent completion of all of them
+REAPER_LAST_SUCCESS = Gauge(
+    "reaper_last_success_timestamp_seconds", "Unix time the activation reaper last completed a run",
+    multiprocess_mode="max",
+)
+
+
+# Labelled children by (metric, labels); prometheus_client validates and locks on every labels() call
+_children: Dict[Tuple[Any, Tuple[Tuple[str, str], ...]], Any] = {}
+
+
+def _child(metric: Any, labels: Dict[str, str]) -> Any:
+    key = (metric, tuple(labels.items()))
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(**labels)
+    return child
+
+
+class timed:
+    """
+    Observe elapsed seconds on a histogram, as a context manager
+
+        with timed(DB_QUERY_SECONDS, query="users.by_email"):
+            await cur.execute(...)
+
+    or as a decorator on a sync or async function. Labelled children are
+    cached, so a timer costs two clock reads and one observe.
+    """
+
+    __slots__ = ("child", "started")
+
+    def __init__(self, histogram: Histogram, **labels: str):
+        self.child = _child(histogram, labels) if labels else histogram
+
+    def __enter__(self) -> "timed":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.child.observe(time.perf_counter() - self.started)
+
+    def __call__(self, func: F) -> F:
+        child = self.child
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - started)
+            return async_wrapper  # type: ignore[return-value]
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper  # type: ignore[return-value]
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Exposition payload and content type, aggregated across workers in multiprocess mode."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
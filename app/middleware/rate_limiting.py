@@ -1,50 +1,324 @@
+import json
 import time
-import os
-from typing import Dict, List
-from fastapi import HTTPException, Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Protocol, Tuple
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import Settings
+from database import get_async_conn
+from errors import RateLimited, RequestTooLarge
+from metrics import RATE_LIMIT_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on one JSON-encoded batch item: an email of at most 254 and a
+# password of at most 128 characters, even with every character \u-escaped
+BATCH_ITEM_MAX_BYTES = 4096
+
+
+class RateLimiter(Protocol):
+    async def is_allowed(self, key: str, max_requests: int, window_seconds: int, cost: int = 1) -> bool:
+        ...
+
+
+class _WindowCounter:
+    """Sliding-window-counter state: request counts for the current and previous fixed window."""
+
+    __slots__ = ("window", "window_index", "previous", "current")
+
+    def __init__(self, window: int, window_index: int):
+        self.window = window
+        self.window_index = window_index
+        self.previous = 0
+        self.current = 0
+
+    def roll(self, window_index: int) -> None:
+        if window_index == self.window_index:
+            return
+        self.previous = self.current if window_index == self.window_index + 1 else 0
+        self.current = 0
+        self.window_index = window_index
+
+    def expired(self, now: float) -> bool:
+        # Once two windows have passed, both counts are zero and the key is idle
+        return now >= (self.window_index + 2) * self.window
+
+
+def _previous_weight(now: float, window_seconds: int) -> float:
+    """Share of the previous window still inside the sliding window ending now."""
+    return 1.0 - (now % window_seconds) / window_seconds
 
 
 class InMemoryRateLimiter:
-    
-    def __init__(self) -> None:
-        self.requests: Dict[str, List[float]] = {}
-    
-    def is_allowed(self, key: str, max_requests: int, window_seconds: int) -> bool:
-        now = time.time()
-        
-        if key not in self.requests:
-            self.requests[key] = []
-        
-        self.requests[key] = [req_time for req_time in self.requests[key] 
-                             if now - req_time < window_seconds]
-        
-        if len(self.requests[key]) >= max_requests:
+    """
+    Per-process sliding-window-counter limiter.
+
+    Each key holds two counters instead of a list of timestamps, so a check
+    is O(1) in time and memory regardless of the limit. The estimate weights
+    the previous window's count by how much of it still overlaps the sliding
+    window. Keys are kept in LRU order; idle keys are evicted from the cold
+    end on every call and the total is capped at max_keys.
+    """
+
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = max_keys
+        self.counters: "OrderedDict[str, _WindowCounter]" = OrderedDict()
+
+    def hit(
+        self, key: str, max_requests: int, window_seconds: int, now: Optional[float] = None, cost: int = 1
+    ) -> bool:
+        now = time.time() if now is None else now
+        window_index = int(now // window_seconds)
+
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = _WindowCounter(window_seconds, window_index)
+            self.counters[key] = counter
+        else:
+            counter.roll(window_index)
+            self.counters.move_to_end(key)
+
+        self._evict(now)
+
+        estimate = counter.previous * _previous_weight(now, window_seconds) + counter.current
+        if estimate + cost > max_requests:
             return False
-        
-        self.requests[key].append(now)
+
+        counter.current += cost
         return True
 
+    def _evict(self, now: float) -> None:
+        counters = self.counters
+        while len(counters) > self.max_keys:
+            counters.popitem(last=False)
+        # A couple of idle keys per call is enough to keep pace with new ones
+        for _ in range(2):
+            if not counters:
+                break
+            oldest_key = next(iter(counters))
+            if not counters[oldest_key].expired(now):
+                break
+            del counters[oldest_key]
+
+    async def is_allowed(self, key: str, max_requests: int, window_seconds: int, cost: int = 1) -> bool:
+        return self.hit(key, max_requests, window_seconds, cost=cost)
+
+
+# Upsert computing the sliding-window estimate in the database. The update only
+# adds the request's cost when it fits under the limit and records the decision
+# in last_allowed so it can be returned.
+_ROLLED_PREVIOUS = """CASE
+    WHEN c.window_index = EXCLUDED.window_index THEN c.previous_count
+    WHEN c.window_index = EXCLUDED.window_index - 1 THEN c.current_count
+    ELSE 0 END"""
+_ROLLED_CURRENT = "CASE WHEN c.window_index = EXCLUDED.window_index THEN c.current_count ELSE 0 END"
+_UNDER_LIMIT = f"({_ROLLED_PREVIOUS}) * %(weight)s + ({_ROLLED_CURRENT}) + %(cost)s <= %(limit)s"
+
+POSTGRES_HIT_QUERY = f"""
+    INSERT INTO rate_limit_counters AS c
+        (key, window_index, previous_count, current_count, last_allowed, expires_at)
+    VALUES (
+        %(key)s, %(window_index)s, 0, CASE WHEN %(cost)s <= %(limit)s THEN %(cost)s ELSE 0 END,
+        %(cost)s <= %(limit)s, to_timestamp(%(expires_at)s)
+    )
+    ON CONFLICT (key) DO UPDATE SET
+        previous_count = {_ROLLED_PREVIOUS},
+        current_count = ({_ROLLED_CURRENT}) + CASE WHEN {_UNDER_LIMIT} THEN %(cost)s ELSE 0 END,
+        last_allowed = {_UNDER_LIMIT},
+        window_index = EXCLUDED.window_index,
+        expires_at = EXCLUDED.expires_at
+    RETURNING last_allowed
+"""
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    
-    def __init__(self, app, limiter: InMemoryRateLimiter):
-        super().__init__(app)
+POSTGRES_PURGE_QUERY = """
+    DELETE FROM rate_limit_counters WHERE ctid = ANY(ARRAY(
+        SELECT ctid FROM rate_limit_counters WHERE expires_at < NOW()
+        LIMIT %s FOR UPDATE SKIP LOCKED
+    ))
+"""
+
+
+class PostgresRateLimiter:
+    """
+    Sliding-window-counter limiter shared by every worker and node, backed by
+    the UNLOGGED rate_limit_counters table (migration 0006). Each check is a
+    single upsert. If the database is unavailable requests are let through
+    rather than failing the endpoint.
+    """
+
+    async def is_allowed(self, key: str, max_requests: int, window_seconds: int, cost: int = 1) -> bool:
+        now = time.time()
+        window_index = int(now // window_seconds)
+        params = {
+            "key": key,
+            "window_index": window_index,
+            "weight": _previous_weight(now, window_seconds),
+            "limit": max_requests,
+            "cost": cost,
+            "expires_at": (window_index + 2) * window_seconds,
+        }
+        try:
+            async with get_async_conn() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(POSTGRES_HIT_QUERY, params)
+                    row = await cur.fetchone()
+                await conn.commit()
+            return bool(row[0])
+        except Exception as e:
+            logger.error("Rate limit check failed, allowing request: %s", e)
+            return True
+
+    async def purge_idle(self, batch_size: int = 1000) -> int:
+        """Delete counters whose windows have both passed."""
+        deleted = 0
+        while True:
+            async with get_async_conn() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(POSTGRES_PURGE_QUERY, (batch_size,))
+                    batch = cur.rowcount
+                await conn.commit()
+            deleted += batch
+            if batch < batch_size:
+                return deleted
+
+
+def create_rate_limiter(settings: Settings) -> RateLimiter:
+    if settings.rate_limit_backend == "postgres":
+        return PostgresRateLimiter()
+    if settings.rate_limit_backend == "memory":
+        return InMemoryRateLimiter(max_keys=settings.rate_limit_max_keys)
+    raise ValueError(f"Unknown rate limit backend: {settings.rate_limit_backend}")
+
+
+@dataclass(frozen=True)
+class _RateLimitRule:
+    name: str
+    key_prefix: str
+    max_requests: int
+    window_seconds: int
+    rejection: Tuple[int, List[Tuple[bytes, bytes]], bytes]
+    # Charge one request per element of the JSON body's "items" list
+    per_item: bool = False
+
+
+def _rejection(error: HTTPException) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """Pre-rendered response for an HTTPException, as FastAPI's handler would render it."""
+    body = json.dumps({"detail": error.detail}, separators=(",", ":")).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    headers.extend((name.lower().encode(), value.encode()) for name, value in (error.headers or {}).items())
+    return error.status_code, headers, body
+
+
+async def _read_body(scope: Scope, receive: Receive, max_bytes: int) -> Optional[Tuple[bytes, Receive]]:
+    """
+    Read the whole request body, returning it with a receive callable that
+    replays it to the app. None once it is known to exceed max_bytes, from
+    its content-length or while reading, so an oversized body is never held.
+    """
+    for name, value in scope["headers"]:
+        if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+            return None
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay() -> Message:
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return body, replay
+
+
+async def _send_rejection(send: Send, rejection: Tuple[int, List[Tuple[bytes, bytes]], bytes]) -> None:
+    status_code, headers, body = rejection
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _item_count(body: bytes) -> int:
+    """Items of a batch body; a malformed one counts once and is left for request validation to reject."""
+    try:
+        items = json.loads(body).get("items")
+    except (ValueError, AttributeError):
+        return 1
+    return max(len(items), 1) if isinstance(items, list) else 1
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware applying per-client-IP limits to the registration
+    and activation endpoints. Batch registration is charged per item, so a
+    batch costs what its items would cost as single registrations against
+    its own budget; its body is read to count them, so one larger than
+    BATCH_REGISTRATION_MAX_ITEMS items could be is rejected with 413 instead.
+    Limits are read from Settings once, and rejections are sent directly as
+    pre-rendered responses.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter, settings: Optional[Settings] = None):
+        self.app = app
         self.limiter = limiter
-    
-    async def dispatch(self, request: Request, call_next):
-        if os.getenv("LOG_LEVEL") == "warning":
-            return await call_next(request)
-            
-        if request.url.path in ["/v1/users", "/v1/users/activate"]:
-            client_ip = request.client.host if request.client else "unknown"
-            
-            if request.url.path == "/v1/users":
-                if not self.limiter.is_allowed(f"reg:{client_ip}", 100, 3600):
-                    raise HTTPException(429, "Too many registration attempts. Try again later.")
-            
-            elif request.url.path == "/v1/users/activate":
-                if not self.limiter.is_allowed(f"act:{client_ip}", 50, 3600):
-                    raise HTTPException(429, "Too many activation attempts. Try again later.")
-        
-        return await call_next(request)
+        settings = settings or Settings()
+        self.enabled = settings.rate_limit_enabled
+        window = settings.rate_limit_window_seconds
+        self.max_batch_body_bytes = settings.batch_registration_max_items * BATCH_ITEM_MAX_BYTES
+        self.too_large = _rejection(RequestTooLarge(self.max_batch_body_bytes))
+        self.rules: Dict[str, _RateLimitRule] = {
+            "/v1/users": _RateLimitRule(
+                "registration", "reg:", settings.rate_limit_registration_max_requests, window,
+                _rejection(RateLimited("Too many registration attempts. Try again later.", window)),
+            ),
+            "/v1/users/activate": _RateLimitRule(
+                "activation", "act:", settings.rate_limit_activation_max_requests, window,
+                _rejection(RateLimited("Too many activation attempts. Try again later.", window)),
+            ),
+            "/v1/users:batch": _RateLimitRule(
+                "batch_registration", "regb:", settings.rate_limit_batch_registration_max_items, window,
+                _rejection(RateLimited("Too many batch registrations. Try again later.", window)),
+                per_item=True,
+            ),
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        rule = self.rules.get(scope["path"]) if scope["type"] == "http" and self.enabled else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        cost = 1
+        if rule.per_item:
+            read = await _read_body(scope, receive, self.max_batch_body_bytes)
+            if read is None:
+                await _send_rejection(send, self.too_large)
+                return
+            body, receive = read
+            cost = _item_count(body)
+        if await self.limiter.is_allowed(rule.key_prefix + client_ip, rule.max_requests, rule.window_seconds, cost):
+            await self.app(scope, receive, send)
+            return
+
+        RATE_LIMIT_REJECTIONS.labels(rule.name).inc()
+        await _send_rejection(send, rule.rejection)
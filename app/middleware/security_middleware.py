@@ -1,22 +1,42 @@
 import secrets
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from log_pipeline import request_id_var
+
+
+# Raw ASGI header pairs, encoded once at import
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+]
+
+
+class SecurityMiddleware:
+    """Pure ASGI middleware adding security headers and request tracing"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-class SecurityMiddleware(BaseHTTPMiddleware):
-    """Middleware to add security headers and request tracing"""
-    
-    async def dispatch(self, request: Request, call_next):
         request_id = secrets.token_hex(8)
-        request.state.request_id = request_id
-        
-        response = await call_next(request)
-        
-        response.headers["x-request-id"] = request_id
-        response.headers["x-content-type-options"] = "nosniff"
-        response.headers["x-frame-options"] = "DENY"
-        response.headers["x-xss-protection"] = "1; mode=block"
-        response.headers["strict-transport-security"] = "max-age=31536000; includeSubDomains"
-        
-        return response
+        # Exposed to handlers as request.state.request_id
+        scope.setdefault("state", {})["request_id"] = request_id
+        request_id_header = (b"x-request-id", request_id.encode())
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), request_id_header, *SECURITY_HEADERS]
+            await send(message)
+
+        # Log records from this request (and tasks it spawns) carry the id
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,138 @@
+"""
+Versioned schema migrations.
+
+Migrations are the SQL files in ./migrations, applied in filename order and
+recorded in the schema_migrations table. docker/initdb/01_schema.sql is the
+baseline schema they build on. With DB_SHARDS set, every shard's database
+is migrated in turn, the primary first.
+
+A file whose first line is "-- migrate:no-transaction" runs outside a
+transaction (needed for CREATE INDEX CONCURRENTLY) and must contain a single
+statement. Every other file runs in one transaction together with its
+schema_migrations row.
+
+    python migrate.py            apply pending migrations
+    python migrate.py --status   list applied and pending migrations
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import psycopg
+
+from config import db_shard_addresses, get_db_dsn
+
+logger = logging.getLogger("migrate")
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+NO_TRANSACTION = "-- migrate:no-transaction"
+# Arbitrary constant shared by every runner so only one applies migrations at a time
+ADVISORY_LOCK_KEY = 72_410_001
+
+
+class Migration(NamedTuple):
+    version: str
+    name: str
+    sql: str
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+
+def load_migrations() -> List[Migration]:
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        version, _, name = path.stem.partition("_")
+        migrations.append(Migration(version=version, name=name, sql=path.read_text()))
+    return migrations
+
+
+def shard_dsns() -> Dict[str, str]:
+    return {name: get_db_dsn(*address) for name, address in db_shard_addresses().items()}
+
+
+def connect(dsn: Optional[str] = None, retries: int = 30, delay: float = 1.0) -> psycopg.Connection:
+    attempt = 1
+    while True:
+        try:
+            return psycopg.connect(dsn or get_db_dsn(), autocommit=True)
+        except psycopg.OperationalError as e:
+            if attempt >= retries:
+                raise
+            logger.info("Database not ready (%s), retrying in %.0fs", e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def applied_versions(conn: psycopg.Connection) -> Set[str]:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+
+def apply(conn: psycopg.Connection, migration: Migration) -> None:
+    record = "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)"
+    if migration.transactional:
+        with conn.transaction():
+            conn.execute(migration.sql)
+            conn.execute(record, (migration.version, migration.name))
+    else:
+        conn.execute(migration.sql)
+        conn.execute(record, (migration.version, migration.name))
+
+
+def migrate_database(dsn: Optional[str] = None, shard: str = "0") -> int:
+    with connect(dsn) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+        try:
+            done = applied_versions(conn)
+            pending = [m for m in load_migrations() if m.version not in done]
+            for migration in pending:
+                started = time.perf_counter()
+                apply(conn, migration)
+                logger.info(
+                    "Applied %s_%s on shard %s in %.0fms",
+                    migration.version, migration.name, shard, (time.perf_counter() - started) * 1000
+                )
+            if not pending:
+                logger.info("Schema of shard %s is up to date", shard)
+            return len(pending)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+
+
+def migrate() -> int:
+    """Apply pending migrations on every shard; returns how many were applied in total."""
+    return sum(migrate_database(dsn, shard) for shard, dsn in shard_dsns().items())
+
+
+def status() -> None:
+    dsns = shard_dsns()
+    for shard, dsn in dsns.items():
+        with connect(dsn) as conn:
+            done = applied_versions(conn)
+        prefix = f"shard {shard} " if len(dsns) > 1 else ""
+        for migration in load_migrations():
+            state = "applied" if migration.version in done else "pending"
+            print(f"{prefix}{migration.version}_{migration.name}: {state}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = parser.parse_args()
+    if args.status:
+        status()
+    else:
+        migrate()
@@ -0,0 +1,6 @@
+-- migrate:no-transaction
+-- Serves the "latest code for a user" lookup (WHERE user_id = ? ORDER BY
+-- created_at DESC LIMIT 1) as a single index probe with no sort, and the
+-- ON DELETE CASCADE from users.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS activation_codes_user_id_created_at_idx
+    ON activation_codes (user_id, created_at DESC);
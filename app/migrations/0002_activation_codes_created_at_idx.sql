@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Lets the activation code reaper find expired codes by age.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS activation_codes_created_at_idx
+    ON activation_codes (created_at);
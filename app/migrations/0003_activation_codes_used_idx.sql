@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Partial index over used codes only. The reaper deletes them, so it stays small.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS activation_codes_used_created_at_idx
+    ON activation_codes (created_at) WHERE used;
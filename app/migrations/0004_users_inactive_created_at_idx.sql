@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Partial index over never-activated users for the reaper's age-based purge.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_inactive_created_at_idx
+    ON users (created_at) WHERE NOT active;
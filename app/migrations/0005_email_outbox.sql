@@ -0,0 +1,22 @@
+-- Transactional outbox for outgoing email. Rows are written in the same
+-- transaction as the user and removed by the dispatcher once sent.
+--   pending: waiting to be sent once next_attempt_at has passed
+--   sending: claimed by a dispatcher; next_attempt_at is the lease expiry
+--   dead:    gave up after OUTBOX_MAX_ATTEMPTS, kept for inspection
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'dead')),
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx
+    ON email_outbox (next_attempt_at) WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS email_outbox_user_id_idx ON email_outbox (user_id);
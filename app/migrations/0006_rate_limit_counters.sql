@@ -0,0 +1,12 @@
+-- Shared sliding-window rate limit state. UNLOGGED: counters are cheap to
+-- lose on a crash and skipping WAL keeps the per-request upsert fast.
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    key TEXT PRIMARY KEY,
+    window_index BIGINT NOT NULL,
+    previous_count INT NOT NULL,
+    current_count INT NOT NULL,
+    last_allowed BOOLEAN NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS rate_limit_counters_expires_at_idx ON rate_limit_counters (expires_at);
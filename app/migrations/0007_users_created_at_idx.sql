@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Lets the email filter pick up users created since its last refresh
+-- without scanning the whole table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_created_at_idx
+    ON users (created_at);
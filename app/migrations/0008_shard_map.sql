@@ -0,0 +1,26 @@
+-- Sharding of users by email (see sharding.py). shard_bucket() must stay in
+-- step with sharding.shard_bucket: the first four bytes of the email's
+-- SHA-256, big-endian, modulo 1024. It is declared IMMUTABLE for the
+-- expression index in 0009; convert_to into UTF8 never changes its result.
+CREATE OR REPLACE FUNCTION shard_bucket(email TEXT) RETURNS INT
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    AS $$
+        SELECT (('x' || encode(substring(sha256(convert_to(email, 'UTF8')) FROM 1 FOR 4), 'hex'))::bit(32)::bigint
+                % 1024)::int
+    $$;
+
+-- Bucket -> shard name; read from the primary only. Buckets without a row
+-- live on the primary, shard "0".
+CREATE TABLE IF NOT EXISTS shard_map (
+    bucket INT PRIMARY KEY CHECK (bucket >= 0 AND bucket < 1024),
+    shard TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- On each shard, buckets that reshard.py has moved off it. Sharded writes
+-- check it under the bucket's advisory lock and go to moved_to instead.
+CREATE TABLE IF NOT EXISTS shard_bucket_moves (
+    bucket INT PRIMARY KEY,
+    moved_to TEXT NOT NULL,
+    moved_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
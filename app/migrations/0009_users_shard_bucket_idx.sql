@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Lets reshard.py copy and clean up one bucket's users in id order.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_shard_bucket_idx
+    ON users (shard_bucket(email), id);
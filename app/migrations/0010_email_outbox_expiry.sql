@@ -0,0 +1,10 @@
+-- Outbox bodies hold plaintext activation codes, so they are kept only while
+-- the email can still be delivered. expires_at (the code's expiry) stops
+-- retries; expired and given-up rows are marked dead with their body
+-- cleared, and dead rows are purged by the activation reaper.
+ALTER TABLE email_outbox ALTER COLUMN body DROP NOT NULL;
+ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ;
+UPDATE email_outbox SET body = NULL WHERE status = 'dead';
+
+CREATE INDEX IF NOT EXISTS email_outbox_dead_created_at_idx
+    ON email_outbox (created_at) WHERE status = 'dead';
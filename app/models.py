@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Optional, Sequence
+
+from psycopg.rows import RowMaker
+
+
+@dataclass(frozen=True, slots=True)
+class UserRecord:
+    id: str
+    email: str
+    created_at: datetime
+    active: bool
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "UserRecord":
+        """Build from a (id, email, created_at, active) row."""
+        return cls(id=str(row[0]), email=row[1], created_at=row[2], active=row[3])
+
+    @classmethod
+    def row_factory(cls, cursor: Any) -> RowMaker["UserRecord"]:
+        """psycopg row factory: cursor(row_factory=UserRecord.row_factory) fetches UserRecords."""
+        return cls.from_row
+
+
+@dataclass(frozen=True, slots=True)
+class UserCredentials:
+    user: UserRecord
+    password_hash: bytes
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "UserCredentials":
+        """Build from a (id, email, created_at, active, password_hash) row."""
+        return cls(user=UserRecord.from_row(row), password_hash=bytes(row[4]))
+
+    @classmethod
+    def row_factory(cls, cursor: Any) -> RowMaker["UserCredentials"]:
+        return cls.from_row
+
+
+@dataclass(frozen=True, slots=True)
+class OutboxMessage:
+    recipient: str
+    subject: str
+    body: str
+    # Seconds after queueing past which the message is no longer sent; None keeps retrying
+    ttl_seconds: Optional[float] = None
+
+
+@dataclass(frozen=True, slots=True)
+class ClaimedMessage:
+    id: int
+    attempts: int
+    message: OutboxMessage
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "ClaimedMessage":
+        """Build from an (id, attempts, recipient, subject, body) row."""
+        return cls(id=row[0], attempts=row[1], message=OutboxMessage(*row[2:5]))
@@ -0,0 +1,194 @@
+"""
+Delivers emails queued in the email_outbox table.
+
+Each pass claims due rows in batches with FOR UPDATE SKIP LOCKED, so any
+number of dispatchers (in-process or standalone, on any node) can share the
+table without sending a message twice. A claim is a lease: if a dispatcher
+dies mid-send the row becomes due again once the lease expires. Failed sends
+are retried with exponential backoff and marked dead after
+OUTBOX_MAX_ATTEMPTS, or once the row's expires_at (the activation code's
+TTL) has passed. Dead rows keep their metadata for inspection but not their
+body, which holds the plaintext code; the activation reaper purges them.
+With DB_SHARDS, each shard's outbox (holding the email of the users on it)
+is drained in turn.
+
+    python outbox_dispatcher.py          drain due messages once and exit
+    python outbox_dispatcher.py --loop   keep polling every OUTBOX_POLL_INTERVAL_SECONDS
+"""
+import argparse
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from background import PeriodicTask, run_until_signalled
+from config import Settings
+from database import PRIMARY_SHARD, close_async_pool, get_async_conn, init_async_pool, shard_names
+from email_client import close_mail_transport, send_email
+from metrics import EMAIL_OUTBOX_DELIVERIES
+from models import ClaimedMessage
+
+logger = logging.getLogger(__name__)
+
+CLAIM_QUERY = """
+    UPDATE email_outbox
+    SET status = 'sending',
+        attempts = attempts + 1,
+        next_attempt_at = NOW() + make_interval(secs => %s)
+    WHERE id = ANY(ARRAY(
+        SELECT id FROM email_outbox
+        WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW()
+          AND (expires_at IS NULL OR expires_at > NOW())
+        ORDER BY next_attempt_at
+        LIMIT %s FOR UPDATE SKIP LOCKED
+    ))
+    RETURNING id, attempts, recipient, subject, body
+"""
+
+RETRY_QUERY = """
+    UPDATE email_outbox
+    SET status = 'pending', next_attempt_at = NOW() + make_interval(secs => %s), last_error = %s
+    WHERE id = %s
+"""
+
+DEAD_QUERY = "UPDATE email_outbox SET status = 'dead', body = NULL, last_error = %s WHERE id = %s"
+
+# Due rows whose code has expired; rows under a live lease are left to their dispatcher
+EXPIRE_QUERY = """
+    UPDATE email_outbox
+    SET status = 'dead', body = NULL, last_error = 'expired before delivery'
+    WHERE id = ANY(ARRAY(
+        SELECT id FROM email_outbox
+        WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW() AND expires_at <= NOW()
+        LIMIT %s FOR UPDATE SKIP LOCKED
+    ))
+"""
+
+
+@dataclass
+class DispatchRunStats:
+    sent: int = 0
+    retried: int = 0
+    dead: int = 0
+    expired: int = 0
+
+
+class OutboxDispatcher:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or Settings()
+
+    def backoff_seconds(self, attempts: int) -> float:
+        settings = self.settings
+        delay: float = min(settings.outbox_backoff_base_seconds * 2 ** (attempts - 1), settings.outbox_backoff_max_seconds)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def expire(self, shard: str = PRIMARY_SHARD) -> int:
+        """Mark due messages past their expiry dead without sending them."""
+        async with get_async_conn(shard=shard) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(EXPIRE_QUERY, (self.settings.outbox_batch_size,))
+                expired: int = cur.rowcount
+            await conn.commit()
+        return expired
+
+    async def claim(self, shard: str = PRIMARY_SHARD) -> List[ClaimedMessage]:
+        async with get_async_conn(shard=shard) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(CLAIM_QUERY, (self.settings.outbox_lease_seconds, self.settings.outbox_batch_size))
+                rows = await cur.fetchall()
+            await conn.commit()
+        return [ClaimedMessage.from_row(row) for row in rows]
+
+    async def _send(self, claimed: ClaimedMessage) -> Optional[str]:
+        try:
+            await send_email(claimed.message)
+            return None
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+    async def dispatch_batch(
+        self, batch: List[ClaimedMessage], stats: DispatchRunStats, shard: str = PRIMARY_SHARD
+    ) -> None:
+        errors = await asyncio.gather(*(self._send(claimed) for claimed in batch))
+
+        sent_ids = [claimed.id for claimed, error in zip(batch, errors) if error is None]
+        retries: List[Tuple[float, str, int]] = []
+        dead: List[Tuple[str, int]] = []
+        for claimed, error in zip(batch, errors):
+            if error is None:
+                continue
+            if claimed.attempts >= self.settings.outbox_max_attempts:
+                logger.error(
+                    "Giving up on email %d to %s after %d attempts: %s",
+                    claimed.id, claimed.message.recipient, claimed.attempts, error
+                )
+                dead.append((error, claimed.id))
+                stats.dead += 1
+                EMAIL_OUTBOX_DELIVERIES.labels("dead").inc()
+            else:
+                logger.warning(
+                    "Email %d to %s failed (attempt %d/%d): %s",
+                    claimed.id, claimed.message.recipient, claimed.attempts,
+                    self.settings.outbox_max_attempts, error
+                )
+                retries.append((self.backoff_seconds(claimed.attempts), error, claimed.id))
+                stats.retried += 1
+                EMAIL_OUTBOX_DELIVERIES.labels("retried").inc()
+
+        async with get_async_conn(shard=shard) as conn:
+            async with conn.cursor() as cur:
+                if sent_ids:
+                    await cur.execute("DELETE FROM email_outbox WHERE id = ANY(%s)", (sent_ids,))
+                if retries:
+                    await cur.executemany(RETRY_QUERY, retries)
+                if dead:
+                    await cur.executemany(DEAD_QUERY, dead)
+            await conn.commit()
+        stats.sent += len(sent_ids)
+        EMAIL_OUTBOX_DELIVERIES.labels("sent").inc(len(sent_ids))
+
+    async def run_once(self) -> DispatchRunStats:
+        """Claim and send batches from each shard until nothing is due."""
+        stats = DispatchRunStats()
+        for shard in shard_names():
+            for _ in range(self.settings.outbox_max_batches_per_run):
+                expired = await self.expire(shard)
+                stats.expired += expired
+                EMAIL_OUTBOX_DELIVERIES.labels("expired").inc(expired)
+                batch = await self.claim(shard)
+                if batch:
+                    await self.dispatch_batch(batch, stats, shard)
+                if len(batch) < self.settings.outbox_batch_size and expired < self.settings.outbox_batch_size:
+                    break
+        if stats.sent or stats.retried or stats.dead or stats.expired:
+            logger.info(
+                "Outbox dispatch: sent=%d retried=%d dead=%d expired=%d",
+                stats.sent, stats.retried, stats.dead, stats.expired
+            )
+        return stats
+
+    def periodic(self) -> PeriodicTask:
+        return PeriodicTask("outbox-dispatcher", self.run_once, self.settings.outbox_poll_interval_seconds)
+
+
+async def _main(loop: bool) -> None:
+    await init_async_pool()
+    try:
+        dispatcher = OutboxDispatcher()
+        if loop:
+            await run_until_signalled(dispatcher.periodic())
+        else:
+            await dispatcher.run_once()
+    finally:
+        await close_mail_transport()
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop", action="store_true", help="run continuously instead of once")
+    args = parser.parse_args()
+    asyncio.run(_main(args.loop))
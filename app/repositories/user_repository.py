@@ -1,44 +1,235 @@
+import asyncio
 import logging
-from typing import Any, Dict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
-from database import get_conn
+from database import get_async_conn
+from metrics import DB_QUERY_SECONDS, timed
+from models import OutboxMessage, UserRecord
+from sharding import fence, get_shard_map, on_shard, on_shards, shard_bucket
 
 logger = logging.getLogger(__name__)
 
 
 class UserRepository:
+    """
+    Users and the rows written with them, on the shard of each user's email
+    (see sharding.py). Writes are fenced against concurrent bucket moves.
+    """
+
+    # Inserts the user, its activation code and the activation email's outbox
+    # row in one statement
+    REGISTER_WITH_ACTIVATION_QUERY = """
+        WITH u AS (
+            INSERT INTO users (email, password_hash) VALUES (%s, %s)
+            RETURNING id, email, created_at, active
+        ), a AS (
+            INSERT INTO activation_codes (user_id, code_hash, salt)
+            SELECT id, %s, %s FROM u
+        ), o AS (
+            INSERT INTO email_outbox (user_id, recipient, subject, body, expires_at)
+            SELECT id, %s, %s, %s, NOW() + make_interval(secs => %s) FROM u
+        )
+        SELECT id, email, created_at, active FROM u
+    """
+    
+    # Batch registration: the same three inserts as REGISTER_WITH_ACTIVATION_QUERY
+    # over unnested arrays, one row per item. Emails must be distinct within the
+    # batch; those already registered are skipped and come back with a NULL id.
+    REGISTER_BATCH_WITH_ACTIVATION_QUERY = """
+        WITH i AS (
+            SELECT * FROM unnest(
+                %s::int[], %s::text[], %s::bytea[], %s::bytea[], %s::bytea[], %s::text[], %s::text[], %s::text[],
+                %s::float8[]
+            ) AS t(idx, email, password_hash, code_hash, salt, recipient, subject, body, ttl_seconds)
+        ), u AS (
+            INSERT INTO users (email, password_hash)
+            SELECT email, password_hash FROM i ORDER BY idx
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id, email, created_at, active
+        ), a AS (
+            INSERT INTO activation_codes (user_id, code_hash, salt)
+            SELECT u.id, i.code_hash, i.salt FROM u JOIN i USING (email)
+        ), o AS (
+            INSERT INTO email_outbox (user_id, recipient, subject, body, expires_at)
+            SELECT u.id, i.recipient, i.subject, i.body, NOW() + make_interval(secs => i.ttl_seconds)
+            FROM u JOIN i USING (email)
+        )
+        SELECT i.idx, u.id, u.email, u.created_at, u.active FROM i LEFT JOIN u USING (email)
+    """
+
+    # Bulk import: rows, one per email, are COPYed into a per-transaction
+    # staging table, then merged into users, new users as active. xmax = 0
+    # tells newly inserted rows from updated ones.
+    CREATE_IMPORT_STAGING = """
+        CREATE TEMP TABLE import_staging (
+            line BIGINT NOT NULL, email TEXT NOT NULL, password_hash BYTEA NOT NULL
+        ) ON COMMIT DROP
+    """
+    COPY_IMPORT_STAGING = "COPY import_staging (line, email, password_hash) FROM STDIN"
+    BULK_MERGE_QUERY = """
+        WITH merged AS (
+            INSERT INTO users (email, password_hash, active)
+            SELECT email, password_hash, TRUE FROM import_staging
+            ON CONFLICT (email) {conflict_action}
+            RETURNING id, email, xmax = 0 AS inserted
+        )
+        SELECT s.line, m.id, COALESCE(m.inserted, FALSE)
+        FROM import_staging s
+        LEFT JOIN merged m USING (email)
+    """
     
     @staticmethod
-    def create_user(email: str, password_hash: bytes) -> Dict[str, Any]:
+    async def create_user_with_activation(
+        email: str, password_hash: bytes, code_hash: bytes, salt: bytes, message: OutboxMessage
+    ) -> UserRecord:
+        """
+        Registration unit of work: insert the user, its activation code and
+        the outbox row for the activation email atomically, in one statement
+        on one connection to the user's shard.
+        """
         import psycopg
-        
+
+        async def insert(shard: str) -> UserRecord:
+            async with get_async_conn(shard=shard) as conn:
+                await fence(conn, [shard_bucket(email)])
+                async with conn.cursor(row_factory=UserRecord.row_factory) as cur:
+                    with timed(DB_QUERY_SECONDS, query="users.register_with_activation"):
+                        await cur.execute(
+                            UserRepository.REGISTER_WITH_ACTIVATION_QUERY,
+                            (
+                                email, password_hash, code_hash, salt,
+                                message.recipient, message.subject, message.body, message.ttl_seconds,
+                            )
+                        )
+                    user = await cur.fetchone()
+                    await conn.commit()
+                    return user
+
         try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "INSERT INTO users (email, password_hash) VALUES (%s, %s) RETURNING id, email, created_at, active",
-                        (email, password_hash)
-                    )
-                    row = cur.fetchone()
-                    conn.commit()
-                    return {
-                        "id": str(row[0]),
-                        "email": row[1],
-                        "created_at": row[2].isoformat(),
-                        "active": row[3],
-                    }
+            return await on_shard(email, insert)
         except psycopg.errors.UniqueViolation:
-            logger.debug(f"Duplicate email attempted: {email}")
+            logger.debug("Duplicate email attempted: %s", email)
             from errors import EmailAlreadyUsed
             raise EmailAlreadyUsed()
         except Exception as e:
-            logger.error(f"Database error creating user: {e}")
+            logger.error("Database error registering user: %s", e)
             raise
 
     @staticmethod
-    def email_exists(email: str) -> bool:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1 FROM users WHERE email=%s", (email,))
-                return cur.fetchone() is not None
+    async def create_users_with_activation(
+        items: Sequence[Tuple[str, bytes, bytes, bytes, OutboxMessage]]
+    ) -> List[Optional[UserRecord]]:
+        """
+        Batch form of create_user_with_activation for (email, password_hash,
+        code_hash, salt, message) items with distinct emails, in one statement
+        and one transaction per shard. Returns a record per item, in order, or
+        None where the email was already registered.
+        """
+        emails = [item[0] for item in items]
+        records: List[Optional[UserRecord]] = [None] * len(items)
+
+        async def insert(shard: str, indexes: List[int]) -> None:
+            columns: List[list] = [[] for _ in range(9)]
+            for idx in indexes:
+                email, password_hash, code_hash, salt, message = items[idx]
+                for column, value in zip(columns, (
+                    idx, email, password_hash, code_hash, salt,
+                    message.recipient, message.subject, message.body, message.ttl_seconds,
+                )):
+                    column.append(value)
+
+            async with get_async_conn(shard=shard) as conn:
+                await fence(conn, (shard_bucket(emails[idx]) for idx in indexes))
+                async with conn.cursor() as cur:
+                    with timed(DB_QUERY_SECONDS, query="users.register_batch_with_activation"):
+                        await cur.execute(UserRepository.REGISTER_BATCH_WITH_ACTIVATION_QUERY, columns)
+                    rows = await cur.fetchall()
+                await conn.commit()
+
+            for idx, *user in rows:
+                if user[0] is not None:
+                    records[idx] = UserRecord.from_row(user)
+
+        await on_shards(emails, insert)
+        return records
+
+    @staticmethod
+    async def update_password_hash(email: str, user_id: str, old_hash: bytes, new_hash: bytes) -> bool:
+        """Swap in new_hash if the stored hash is still old_hash; False if it changed meanwhile."""
+
+        async def update(shard: str) -> bool:
+            async with get_async_conn(shard=shard) as conn:
+                await fence(conn, [shard_bucket(email)])
+                async with conn.cursor() as cur:
+                    with timed(DB_QUERY_SECONDS, query="users.update_password_hash"):
+                        await cur.execute(
+                            "UPDATE users SET password_hash=%s WHERE id=%s AND password_hash=%s",
+                            (new_hash, user_id, old_hash)
+                        )
+                    updated: bool = cur.rowcount == 1
+                await conn.commit()
+            return updated
+
+        applied: bool = await on_shard(email, update)
+        return applied
+
+    # email_exists and existing_emails back the pre-hash duplicate check, so
+    # they read from a replica: an email registered within the replica's lag
+    # is still rejected by the unique constraint on insert
+
+    @staticmethod
+    async def email_exists(email: str) -> bool:
+        shard = (await get_shard_map()).shard_for(email)
+        async with get_async_conn(read_only=True, shard=shard) as conn:
+            async with conn.cursor() as cur:
+                with timed(DB_QUERY_SECONDS, query="users.email_exists"):
+                    await cur.execute("SELECT 1 FROM users WHERE email=%s", (email,))
+                return await cur.fetchone() is not None
+
+    @staticmethod
+    async def existing_emails(emails: Sequence[str]) -> Set[str]:
+        async def existing(shard: str, indexes: List[int]) -> Set[str]:
+            async with get_async_conn(read_only=True, shard=shard) as conn:
+                async with conn.cursor() as cur:
+                    with timed(DB_QUERY_SECONDS, query="users.existing_emails"):
+                        await cur.execute("SELECT email FROM users WHERE email = ANY(%s)", ([emails[i] for i in indexes],))
+                    return {email for (email,) in await cur.fetchall()}
+
+        groups = (await get_shard_map()).group(emails)
+        return set().union(*await asyncio.gather(*(existing(shard, indexes) for shard, indexes in groups.items())))
+
+    @staticmethod
+    async def bulk_merge(
+        rows: Sequence[Tuple[int, str, bytes]], update_existing: bool = False
+    ) -> Dict[int, Tuple[Optional[str], bool]]:
+        """
+        Write (line, email, password_hash) rows, with distinct emails, in one
+        transaction per shard. New users are inserted active; with
+        update_existing, existing users get the new password hash and keep
+        their active flag. Returns line -> (user id, newly inserted). The id
+        is None when the email already existed and was left alone.
+        """
+        conflict_action = (
+            "DO UPDATE SET password_hash = EXCLUDED.password_hash" if update_existing else "DO NOTHING"
+        )
+        emails = [row[1] for row in rows]
+        merged: Dict[int, Tuple[Optional[str], bool]] = {}
+
+        async def merge(shard: str, indexes: List[int]) -> None:
+            async with get_async_conn(shard=shard) as conn:
+                await fence(conn, (shard_bucket(emails[i]) for i in indexes))
+                async with conn.cursor() as cur:
+                    await cur.execute(UserRepository.CREATE_IMPORT_STAGING)
+                    with timed(DB_QUERY_SECONDS, query="users.import_copy"):
+                        async with cur.copy(UserRepository.COPY_IMPORT_STAGING) as copy:
+                            for i in indexes:
+                                await copy.write_row(rows[i])
+                    with timed(DB_QUERY_SECONDS, query="users.import_merge"):
+                        await cur.execute(UserRepository.BULK_MERGE_QUERY.format(conflict_action=conflict_action))
+                    results: List[Tuple[int, Optional[object], bool]] = await cur.fetchall()
+                await conn.commit()
+            for line, user_id, inserted in results:
+                merged[line] = (str(user_id) if user_id is not None else None, inserted)
 
+        await on_shards(emails, merge)
+        return merged
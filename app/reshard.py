@@ -0,0 +1,288 @@
+"""
+Moves buckets of users (see sharding.py) between shards while the API keeps
+serving them.
+
+    python reshard.py --status                 buckets and users on each shard
+    python reshard.py --move 0-255 --to 1      move buckets 0 to 255 to shard 1
+    python reshard.py --cleanup                delete moved users' old copies after --grace seconds
+
+Each bucket is moved in three steps:
+
+1. Rows the target still holds for the bucket from an earlier move away are
+   deleted, and the bucket's users and activation codes are copied in id
+   order, --batch-size users per transaction, without blocking writes.
+2. Cutover: the source takes the bucket's advisory lock exclusively, which
+   waits for in-flight writes and holds back new ones. The whole bucket is
+   copied again, which catches what changed during the backfill, and its
+   undelivered outbox rows are moved. The target commits, then the source
+   records the move in shard_bucket_moves and commits, so held-back writes
+   are retried on the target.
+3. shard_map on the primary is updated, so workers route to the target
+   directly from their next reload.
+
+The source keeps its copy of moved users until --cleanup, so reads by
+workers whose map is still stale keep finding them; --grace must exceed
+DB_SHARD_MAP_REFRESH_SECONDS. An email whose send was in flight during the
+cutover may be sent twice. A move that stopped part way can be re-run: the
+target owns a bucket only once the source's cutover committed, and a bucket
+that is already there only gets its shard_map row.
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import psycopg
+
+from config import Settings
+from database import close_async_pool, get_async_conn, init_async_pool, shard_names
+from sharding import SHARD_BUCKETS, SHARD_LOCK_KEY, ShardMap
+
+logger = logging.getLogger("reshard")
+
+Row = Tuple[Any, ...]
+
+USERS_QUERY = """
+    SELECT id, email, password_hash, created_at, active FROM users
+    WHERE shard_bucket(email) = %s AND id > %s ORDER BY id LIMIT %s
+"""
+CODES_QUERY = "SELECT id, user_id, code_hash, salt, created_at, used FROM activation_codes WHERE user_id = ANY(%s)"
+OUTBOX_QUERY = """
+    SELECT id, user_id, recipient, subject, body, status, attempts, next_attempt_at, last_error, created_at, expires_at
+    FROM email_outbox WHERE user_id = ANY(%s)
+"""
+
+UPSERT_USERS = """
+    INSERT INTO users (id, email, password_hash, created_at, active)
+    SELECT * FROM unnest(%s::uuid[], %s::text[], %s::bytea[], %s::timestamptz[], %s::boolean[])
+    ON CONFLICT (id) DO UPDATE
+    SET email = EXCLUDED.email, password_hash = EXCLUDED.password_hash, active = EXCLUDED.active
+"""
+UPSERT_CODES = """
+    INSERT INTO activation_codes (id, user_id, code_hash, salt, created_at, used)
+    SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::bytea[], %s::bytea[], %s::timestamptz[], %s::boolean[])
+    ON CONFLICT (id) DO UPDATE SET used = EXCLUDED.used
+"""
+# Outbox ids are per-shard sequences, so moved rows get new ones
+INSERT_OUTBOX = """
+    INSERT INTO email_outbox
+        (user_id, recipient, subject, body, status, attempts, next_attempt_at, last_error, created_at, expires_at)
+    SELECT * FROM unnest(
+        %s::uuid[], %s::text[], %s::text[], %s::text[], %s::text[], %s::int[], %s::timestamptz[], %s::text[],
+        %s::timestamptz[], %s::timestamptz[]
+    )
+"""
+
+# Locks the move rows it relies on, so a cutover moving a bucket back here
+# waits for the delete instead of having its copy deleted
+CLEANUP_QUERY = """
+    DELETE FROM users WHERE id = ANY(ARRAY(
+        SELECT u.id FROM shard_bucket_moves m
+        JOIN users u ON shard_bucket(u.email) = m.bucket
+        WHERE m.moved_at < NOW() - make_interval(secs => %s)
+        LIMIT %s
+        FOR SHARE OF m
+    ))
+"""
+
+# gen_random_uuid() never returns the nil UUID, the smallest value
+FIRST_ID = uuid.UUID(int=0)
+
+
+def parse_buckets(spec: str) -> List[int]:
+    """"0-127,300" as a sorted list of bucket numbers."""
+    buckets: Set[int] = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        buckets.update(range(int(first), int(last or first) + 1))
+    invalid = [bucket for bucket in buckets if not 0 <= bucket < SHARD_BUCKETS]
+    if invalid:
+        raise ValueError(f"Buckets must be between 0 and {SHARD_BUCKETS - 1}: {invalid[:5]}")
+    return sorted(buckets)
+
+
+def columns(rows: Sequence[Row]) -> List[List[Any]]:
+    return [list(column) for column in zip(*rows)]
+
+
+async def fetch(conn: psycopg.AsyncConnection, query: str, params: Sequence[Any]) -> List[Row]:
+    return await (await conn.execute(query, params)).fetchall()
+
+
+class Resharder:
+
+    def __init__(self, settings: Optional[Settings] = None, batch_size: int = 1000):
+        self.settings = settings or Settings()
+        self.batch_size = batch_size
+        self.shard_map = ShardMap(self.settings)
+
+    async def owner(self, bucket: int) -> str:
+        """The shard holding bucket: its shard_map entry, or where that shard says it was moved to."""
+        shard: str = self.shard_map.shard_of_bucket(bucket)
+        for _ in shard_names():
+            async with get_async_conn(shard=shard) as conn:
+                row = await (await conn.execute(
+                    "SELECT moved_to FROM shard_bucket_moves WHERE bucket = %s", (bucket,)
+                )).fetchone()
+            if row is None:
+                return shard
+            shard = row[0]
+        raise RuntimeError(f"Bucket {bucket} has a cycle of moves in shard_bucket_moves")
+
+    async def _write(
+        self, conn: psycopg.AsyncConnection, users: List[Row], codes: List[Row], outbox: Sequence[Row] = ()
+    ) -> None:
+        if users:
+            await conn.execute(UPSERT_USERS, columns(users))
+        if codes:
+            await conn.execute(UPSERT_CODES, columns(codes))
+        if outbox:
+            await conn.execute(INSERT_OUTBOX, columns(outbox))
+
+    async def backfill(self, bucket: int, source: str, target: str) -> int:
+        async with get_async_conn(shard=target) as conn:
+            await conn.execute("DELETE FROM users WHERE shard_bucket(email) = %s", (bucket,))
+            await conn.commit()
+
+        copied, after = 0, FIRST_ID
+        while True:
+            async with get_async_conn(shard=source) as conn:
+                users = await fetch(conn, USERS_QUERY, (bucket, after, self.batch_size))
+                codes = await fetch(conn, CODES_QUERY, ([user[0] for user in users],)) if users else []
+                await conn.commit()
+            if not users:
+                return copied
+            async with get_async_conn(shard=target) as conn:
+                await self._write(conn, users, codes)
+                await conn.commit()
+            copied += len(users)
+            after = users[-1][0]
+
+    async def cut_over(self, bucket: int, source: str, target: str) -> int:
+        async with get_async_conn(shard=source) as src:
+            await src.execute("SELECT pg_advisory_xact_lock(%s, %s)", (SHARD_LOCK_KEY, bucket))
+            users = await fetch(src, USERS_QUERY, (bucket, FIRST_ID, None))
+            user_ids = [user[0] for user in users]
+            codes = await fetch(src, CODES_QUERY, (user_ids,))
+            outbox = await fetch(src, OUTBOX_QUERY, (user_ids,))
+
+            async with get_async_conn(shard=target) as dst:
+                # First, so a cleanup of this bucket's old copies here finishes before the copy below
+                await dst.execute("DELETE FROM shard_bucket_moves WHERE bucket = %s", (bucket,))
+                await dst.execute(
+                    "DELETE FROM users WHERE shard_bucket(email) = %s AND id <> ALL(%s)", (bucket, user_ids)
+                )
+                await dst.execute(
+                    """
+                    DELETE FROM activation_codes c USING users u
+                    WHERE c.user_id = u.id AND shard_bucket(u.email) = %s AND c.id <> ALL(%s)
+                    """,
+                    (bucket, [code[0] for code in codes])
+                )
+                await self._write(dst, users, codes, [row[1:] for row in outbox])
+                await dst.commit()
+
+            await src.execute("DELETE FROM email_outbox WHERE id = ANY(%s)", ([row[0] for row in outbox],))
+            await src.execute(
+                """
+                INSERT INTO shard_bucket_moves (bucket, moved_to) VALUES (%s, %s)
+                ON CONFLICT (bucket) DO UPDATE SET moved_to = EXCLUDED.moved_to, moved_at = NOW()
+                """,
+                (bucket, target)
+            )
+            await src.commit()
+        return len(users)
+
+    async def assign(self, bucket: int, shard: str) -> None:
+        async with get_async_conn() as conn:
+            await conn.execute(
+                """
+                INSERT INTO shard_map (bucket, shard) VALUES (%s, %s)
+                ON CONFLICT (bucket) DO UPDATE SET shard = EXCLUDED.shard, updated_at = NOW()
+                """,
+                (bucket, shard)
+            )
+            await conn.commit()
+        self.shard_map.assignments[bucket] = shard
+
+    async def move(self, buckets: Sequence[int], target: str) -> int:
+        """Move buckets to target one at a time; returns the number of users moved."""
+        if target not in shard_names():
+            raise ValueError(f"Unknown shard {target!r}; configured: {', '.join(shard_names())}")
+        await self.shard_map.load()
+        moved = 0
+        for bucket in buckets:
+            source = await self.owner(bucket)
+            if source != target:
+                started = time.perf_counter()
+                backfilled = await self.backfill(bucket, source, target)
+                users = await self.cut_over(bucket, source, target)
+                moved += users
+                logger.info(
+                    "Moved bucket %d from shard %s to %s: %d users (%d backfilled) in %.0fms",
+                    bucket, source, target, users, backfilled, (time.perf_counter() - started) * 1000
+                )
+            await self.assign(bucket, target)
+        return moved
+
+    async def cleanup(self, grace_seconds: float) -> Dict[str, int]:
+        """Delete each shard's copies of users in buckets moved off it more than grace_seconds ago."""
+        deleted: Dict[str, int] = {}
+        for shard in shard_names():
+            deleted[shard] = 0
+            while True:
+                async with get_async_conn(shard=shard) as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(CLEANUP_QUERY, (grace_seconds, self.batch_size))
+                        count = cur.rowcount
+                    await conn.commit()
+                deleted[shard] += count
+                if count < self.batch_size:
+                    break
+            logger.info("Removed %d moved users from shard %s", deleted[shard], shard)
+        return deleted
+
+    async def status(self) -> Dict[str, Dict[str, int]]:
+        await self.shard_map.load()
+        report = {}
+        for shard in shard_names():
+            buckets = sum(self.shard_map.shard_of_bucket(bucket) == shard for bucket in range(SHARD_BUCKETS))
+            async with get_async_conn(shard=shard) as conn:
+                users = (await (await conn.execute("SELECT count(*) FROM users")).fetchone())[0]
+                moved = (await (await conn.execute(
+                    "SELECT count(*) FROM shard_bucket_moves m JOIN users u ON shard_bucket(u.email) = m.bucket"
+                )).fetchone())[0]
+            report[shard] = {"buckets": buckets, "users": users - moved, "awaiting_cleanup": moved}
+        return report
+
+
+async def _main(args: argparse.Namespace) -> None:
+    await init_async_pool()
+    try:
+        resharder = Resharder(batch_size=args.batch_size)
+        if args.move:
+            await resharder.move(parse_buckets(args.move), args.to)
+        elif args.cleanup:
+            await resharder.cleanup(args.grace)
+        for shard, counts in (await resharder.status()).items():
+            print(f"shard {shard}: " + " ".join(f"{name}={count}" for name, count in counts.items()))
+    finally:
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--status", action="store_true", help="report buckets and users per shard")
+    action.add_argument("--move", metavar="BUCKETS", help="buckets to move, e.g. 0-127,300")
+    action.add_argument("--cleanup", action="store_true", help="delete moved users' copies from their old shards")
+    parser.add_argument("--to", help="shard to move the buckets to")
+    parser.add_argument("--batch-size", type=int, default=1000, help="users per backfill or cleanup transaction")
+    parser.add_argument("--grace", type=float, default=60, help="seconds since a move before --cleanup removes its copies")
+    args = parser.parse_args()
+    if args.move and not args.to:
+        parser.error("--move needs --to")
+    asyncio.run(_main(args))
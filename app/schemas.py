@@ -1,5 +1,9 @@
+from typing import Dict, List, Optional
+
 from pydantic import BaseModel, EmailStr, Field
 
+from config import Settings
+
 class CreateUserRequest(BaseModel):
     email: EmailStr
     password: str = Field(
@@ -14,5 +18,19 @@ class CreateUserResponse(BaseModel):
     created_at: str
     active: bool
 
+class CreateUsersBatchRequest(BaseModel):
+    items: List[CreateUserRequest] = Field(min_length=1, max_length=Settings().batch_registration_max_items)
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: int
+    user: Optional[CreateUserResponse] = None
+    error: Optional[Dict[str, str]] = None
+
+class CreateUsersBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BatchItemResult]
+
 class ActivateRequest(BaseModel):
     code: str = Field(pattern=r"^\d{4}$", description="4-digit activation code")
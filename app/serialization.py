@@ -0,0 +1,33 @@
+"""
+Response bodies for the user endpoints, encoded straight from UserRecords.
+
+The routes keep their response_model, so the OpenAPI schema is unchanged,
+but the controller returns a ready Response. FastAPI then skips
+re-validating the body against the model (including a second EmailStr check
+of an email read back from the database) and jsonable_encoder. orjson
+encodes created_at natively, in the same form as datetime.isoformat().
+"""
+from typing import Any, Dict, Optional
+
+import orjson
+from fastapi.responses import Response
+
+from models import UserRecord
+
+ACTIVATED_BODY = orjson.dumps({"message": "Account activated successfully"})
+
+
+def user_json(user: UserRecord) -> Dict[str, Any]:
+    """A CreateUserResponse as a dict orjson can encode."""
+    return {"id": user.id, "email": user.email, "created_at": user.created_at, "active": user.active}
+
+
+def batch_item_json(
+    index: int, status: int, user: Optional[UserRecord] = None, error: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """A BatchItemResult as a dict orjson can encode."""
+    return {"index": index, "status": status, "user": user_json(user) if user is not None else None, "error": error}
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    return Response(orjson.dumps(content), status_code=status_code, media_type="application/json")
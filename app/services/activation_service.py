@@ -1,13 +1,37 @@
+import hmac
 import secrets
 import hashlib
-from datetime import datetime, timezone, timedelta
+from typing import Optional, Tuple
 
-from database import get_conn
+from database import get_async_conn
 from config import Settings
 from errors import InvalidCode, CodeExpired
+from metrics import DB_QUERY_SECONDS, timed
+from sharding import fence, on_shard, shard_bucket
 
 
 class ActivationService:
+
+    # Locks the latest code until the transaction ends, so concurrent attempts
+    # queue behind each other and the next one sees used = TRUE. Served by
+    # activation_codes_user_id_created_at_idx (migration 0001)
+    LOCK_LATEST_CODE_QUERY = """
+        SELECT id, code_hash, salt, used, created_at > now() - make_interval(secs => %(ttl)s)
+        FROM activation_codes
+        WHERE user_id = %(user_id)s ORDER BY created_at DESC LIMIT 1
+        FOR UPDATE
+    """
+
+    # Claims the locked code and activates its user in one conditional statement
+    ACTIVATE_QUERY = """
+        WITH claimed AS (
+            UPDATE activation_codes SET used = TRUE
+            WHERE id = %(code_id)s AND user_id = %(user_id)s AND NOT used
+            RETURNING user_id
+        )
+        UPDATE users SET active = TRUE WHERE id IN (SELECT user_id FROM claimed)
+        RETURNING id
+    """
     
     def __init__(self):
         self.settings = Settings()
@@ -17,38 +41,50 @@ class ActivationService:
         h.update(salt + code.encode())
         return h.digest()
 
-    def create_activation(self, user_id: str, code: str) -> None:
+    def new_code_hash(self, code: str) -> Tuple[bytes, bytes]:
+        """Return (code_hash, salt) for a freshly salted code."""
         salt = secrets.token_bytes(self.settings.code_salt_bytes)
-        code_hash = self.hash_code(code, salt)
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO activation_codes (user_id, code_hash, salt) VALUES (%s, %s, %s)",
-                    (user_id, code_hash, salt)
-                )
-
-    def verify_and_use_code(self, user_id: str, code: str) -> None:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT id, code_hash, salt, created_at, used FROM activation_codes WHERE user_id=%s ORDER BY created_at DESC LIMIT 1",
-                    (user_id,)
-                )
-                row = cur.fetchone()
-                if not row:
-                    raise InvalidCode()
-                code_id, code_hash_db, salt, created_at, used = row
-                if used:
-                    raise InvalidCode()
-
-                if datetime.now(timezone.utc) - created_at > timedelta(seconds=self.settings.code_ttl_seconds):
-                    raise CodeExpired()
-
-                candidate = self.hash_code(code, bytes(salt))
-                if candidate != bytes(code_hash_db):
-                    raise InvalidCode()
-
-                cur.execute("UPDATE activation_codes SET used=TRUE WHERE id=%s", (code_id,))
-                cur.execute("UPDATE users SET active=TRUE WHERE id=%s", (user_id,))
-                conn.commit()
+        return self.hash_code(code, salt), salt
+
+    async def verify_and_use_code(self, user_id: str, code: str, email: str) -> None:
+        """
+        Use the user's latest code to activate them, atomically. Raises
+        InvalidCode if there is no code, it was already used or does not
+        match, and CodeExpired if it is older than CODE_TTL_SECONDS.
+
+        The code row is locked, compared with the submitted code in constant
+        time and only then claimed, all in one transaction.
+        """
+        params = {"user_id": user_id, "ttl": self.settings.code_ttl_seconds}
+
+        async def activate(shard: str) -> Optional[Tuple[bool, bool, bool]]:
+            async with get_async_conn(shard=shard) as conn:
+                await fence(conn, [shard_bucket(email)])
+                async with conn.cursor() as cur:
+                    with timed(DB_QUERY_SECONDS, query="activation_codes.lock_latest"):
+                        await cur.execute(self.LOCK_LATEST_CODE_QUERY, params)
+                    row = await cur.fetchone()
+                    if row is None:
+                        return None
+                    code_id, code_hash, salt, used, fresh = row
+                    matches = hmac.compare_digest(bytes(code_hash), self.hash_code(code, bytes(salt)))
+                    activated = False
+                    if matches and fresh and not used:
+                        with timed(DB_QUERY_SECONDS, query="activation_codes.activate"):
+                            await cur.execute(self.ACTIVATE_QUERY, {**params, "code_id": code_id})
+                        activated = await cur.fetchone() is not None
+                await conn.commit()
+            return used, fresh, activated
+
+        row = await on_shard(email, activate)
 
+        if not row:
+            raise InvalidCode()
+        used, fresh, activated = row
+        if activated:
+            return
+        if used:
+            raise InvalidCode()
+        if not fresh:
+            raise CodeExpired()
+        raise InvalidCode()
@@ -1,65 +1,293 @@
+import asyncio
 import bcrypt
+import hashlib
+import hmac
 import logging
-from typing import Any, Dict, Optional
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Set, Tuple
 
-from database import get_conn
+from argon2 import PasswordHasher as Argon2Hasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from config import Settings
+from database import get_async_conn, has_replicas
+from hashing_executor import get_hashing_executor
+from metrics import CREDENTIAL_CACHE_LOOKUPS, DB_QUERY_SECONDS, PASSWORD_REHASHES, timed
+from models import UserCredentials, UserRecord
+from repositories.user_repository import UserRepository
+from sharding import get_shard_map
 
 logger = logging.getLogger(__name__)
 
+HASH_ALGORITHMS = ("bcrypt", "argon2id")
+
+_dummy_hash: Optional[bytes] = None
+_hash_policy: Optional["HashPolicy"] = None
+# Running rehash tasks; referenced here so they are not garbage-collected mid-flight
+_rehash_tasks: Set[asyncio.Task] = set()
+
+
+def bcrypt_hash(password: str, rounds: int) -> bytes:
+    salt = bcrypt.gensalt(rounds=rounds)
+    return bcrypt.hashpw(password.encode(), salt)
+
+
+def bcrypt_verify(password: str, password_hash: bytes) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode(), password_hash)
+    except ValueError:
+        return False
+
+
+def argon2_hash(password: str, time_cost: int, memory_cost: int, parallelism: int) -> bytes:
+    hasher = Argon2Hasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    return hasher.hash(password).encode()
+
+
+def argon2_verify(password: str, password_hash: bytes) -> bool:
+    try:
+        return Argon2Hasher().verify(password_hash.decode(), password)
+    except (VerificationError, InvalidHashError, UnicodeDecodeError):
+        return False
+
+
+def hash_algorithm(password_hash: bytes) -> Optional[str]:
+    """The algorithm that produced a stored hash, from its prefix; None if unrecognised."""
+    if password_hash.startswith(b"$argon2id$"):
+        return "argon2id"
+    if password_hash.startswith((b"$2a$", b"$2b$", b"$2y$")):
+        return "bcrypt"
+    return None
+
+
+@dataclass(frozen=True)
+class HashPolicy:
+    """Algorithm and cost new password hashes are made with."""
+
+    algorithm: str = "bcrypt"
+    bcrypt_rounds: int = 12
+    argon2_time_cost: int = 3
+    argon2_memory_cost_kib: int = 65536
+    argon2_parallelism: int = 1
+    # Replace outdated hashes after a successful login
+    rehash_on_login: bool = True
+
+    def __post_init__(self) -> None:
+        if self.algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unknown password hash algorithm: {self.algorithm}")
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "HashPolicy":
+        return cls(
+            algorithm=settings.password_hash_algorithm,
+            bcrypt_rounds=settings.bcrypt_rounds,
+            argon2_time_cost=settings.argon2_time_cost,
+            argon2_memory_cost_kib=settings.argon2_memory_cost_kib,
+            argon2_parallelism=settings.argon2_parallelism,
+            rehash_on_login=settings.password_rehash_enabled,
+        )
+
+    def hash_call(self) -> Tuple[Callable[..., bytes], Tuple[Any, ...]]:
+        """Module-level hash function and its cost arguments (after the password), picklable for process pools."""
+        if self.algorithm == "argon2id":
+            return argon2_hash, (self.argon2_time_cost, self.argon2_memory_cost_kib, self.argon2_parallelism)
+        return bcrypt_hash, (self.bcrypt_rounds,)
+
+    def describe(self) -> str:
+        if self.algorithm == "argon2id":
+            return (
+                f"argon2id t={self.argon2_time_cost} m={self.argon2_memory_cost_kib}KiB p={self.argon2_parallelism}"
+            )
+        return f"bcrypt rounds={self.bcrypt_rounds}"
+
+    def needs_rehash(self, password_hash: bytes) -> bool:
+        """Whether a stored hash was made with another algorithm or cost than this policy's."""
+        algorithm = hash_algorithm(password_hash)
+        if algorithm != self.algorithm:
+            return True
+        if algorithm == "bcrypt":
+            return password_hash[4:6] != b"%02d" % self.bcrypt_rounds
+        hasher = Argon2Hasher(
+            time_cost=self.argon2_time_cost, memory_cost=self.argon2_memory_cost_kib, parallelism=self.argon2_parallelism
+        )
+        return hasher.check_needs_rehash(password_hash.decode())
+
+
+def get_hash_policy() -> HashPolicy:
+    global _hash_policy
+    if _hash_policy is None:
+        _hash_policy = HashPolicy.from_settings(Settings())
+    return _hash_policy
+
+
+class CredentialCache:
+    """
+    Recently verified (email, password) pairs, so retries within the TTL skip
+    bcrypt. Entries are keyed by an HMAC-SHA256 of the pair under a random
+    per-process key and hold only the stored hash the password was verified
+    against; plaintext is never kept. A hit counts only while that hash is
+    still the user's current one, so a password change invalidates it, and
+    the user record is always read fresh, so activation is never stale.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._key = secrets.token_bytes(32)
+        self._entries: "OrderedDict[bytes, Tuple[bytes, float]]" = OrderedDict()
+
+    def _digest(self, email: str, password: str) -> bytes:
+        return hmac.new(self._key, f"{email}\0{password}".encode(), hashlib.sha256).digest()
+
+    def verified(self, email: str, password: str, password_hash: bytes) -> bool:
+        key = self._digest(email, password)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic() or not hmac.compare_digest(entry[0], password_hash):
+            if entry is not None:
+                del self._entries[key]
+            CREDENTIAL_CACHE_LOOKUPS.labels("miss").inc()
+            return False
+        self._entries.move_to_end(key)
+        CREDENTIAL_CACHE_LOOKUPS.labels("hit").inc()
+        return True
+
+    def remember(self, email: str, password: str, password_hash: bytes) -> None:
+        key = self._digest(email, password)
+        self._entries[key] = (password_hash, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_credential_cache: Optional[CredentialCache] = None
+
+def get_credential_cache() -> Optional[CredentialCache]:
+    """The process-wide cache, created on first use; None when disabled."""
+    global _credential_cache
+    if _credential_cache is None:
+        settings = Settings()
+        if settings.credential_cache_enabled:
+            _credential_cache = CredentialCache(
+                settings.credential_cache_ttl_seconds, settings.credential_cache_max_entries
+            )
+    return _credential_cache
+
 
 class AuthService:
     
     @staticmethod
-    def hash_password(password: str, rounds: int) -> bytes:
-        salt = bcrypt.gensalt(rounds=rounds)
-        return bcrypt.hashpw(password.encode(), salt)
+    async def hash_password(password: str, policy: Optional[HashPolicy] = None) -> bytes:
+        """Hash with the given policy, by default the configured one (PASSWORD_HASH_ALGORITHM and its cost)."""
+        func, args = (policy or get_hash_policy()).hash_call()
+        password_hash: bytes = await get_hashing_executor().run(func, password, *args)
+        return password_hash
 
     @staticmethod
-    def verify_password(password: str, password_hash: bytes) -> bool:
-        try:
-            return bcrypt.checkpw(password.encode(), password_hash)
-        except ValueError:
-            return False
+    async def verify_password(password: str, password_hash: bytes) -> bool:
+        """Verify against a stored hash of either algorithm, detected from its prefix."""
+        verify = argon2_verify if hash_algorithm(password_hash) == "argon2id" else bcrypt_verify
+        verified: bool = await get_hashing_executor().run(verify, password, password_hash)
+        return verified
 
     @staticmethod
-    def fetch_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, email, created_at, active FROM users WHERE email=%s", (email,))
-                row = cur.fetchone()
-                if not row:
-                    return None
-                return {
-                    "id": str(row[0]),
-                    "email": row[1],
-                    "created_at": row[2].isoformat(),
-                    "active": row[3],
-                }
-    
+    def schedule_rehash(email: str, user_id: str, password: str, old_hash: bytes) -> None:
+        """
+        Upgrade an outdated hash in a background task, off the request path.
+        Not a FastAPI background task: those are dropped when the endpoint
+        then raises, as activation does for a wrong code.
+        """
+        task = asyncio.create_task(AuthService.rehash_password(email, user_id, password, old_hash))
+        _rehash_tasks.add(task)
+        task.add_done_callback(_rehash_tasks.discard)
+
     @staticmethod
-    def verify_user_password(email: str, password: str) -> bool:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT password_hash FROM users WHERE email=%s", (email,))
-                row = cur.fetchone()
-                if not row:
-                    return False
-                return AuthService.verify_password(password, bytes(row[0]))
-    
+    async def wait_for_rehashes(timeout: float) -> None:
+        if _rehash_tasks:
+            await asyncio.wait(list(_rehash_tasks), timeout=timeout)
+
     @staticmethod
-    def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
-        if not AuthService.verify_user_password(email, password):
-            logger.warning(f"Authentication failed for user: {email}")
-            return None
-            
-        user = AuthService.fetch_user_by_email(email)
-        logger.info(f"User authenticated: {email}")
-        return user
-    
+    async def rehash_password(email: str, user_id: str, password: str, old_hash: bytes) -> None:
+        """
+        Replace an outdated hash with one made under the current policy. The
+        update only applies if the stored hash is still old_hash, so a
+        concurrent password change wins.
+        """
+        try:
+            new_hash = await AuthService.hash_password(password)
+            updated = await UserRepository.update_password_hash(email, user_id, old_hash, new_hash)
+        except Exception as e:
+            PASSWORD_REHASHES.labels("failed").inc()
+            logger.warning("Password rehash failed for user %s: %s", user_id, e)
+            return
+        PASSWORD_REHASHES.labels("upgraded" if updated else "superseded").inc()
+        if updated:
+            logger.info("Upgraded password hash for user %s to %s", user_id, get_hash_policy().describe())
+
+    @staticmethod
+    async def dummy_password_hash() -> bytes:
+        """
+        Hash checked against when the email is unknown, so a miss costs the same
+        hashing work as a wrong password and response time does not reveal
+        which accounts exist.
+        """
+        global _dummy_hash
+        if _dummy_hash is None:
+            _dummy_hash = await AuthService.hash_password(secrets.token_urlsafe(16))
+        return _dummy_hash
+
+    @staticmethod
+    async def warm_up(concurrency: int) -> None:
+        """
+        Compute the dummy hash and run one verification per hashing worker
+        so the pool's threads or processes are started before traffic.
+        """
+        dummy_hash = await AuthService.dummy_password_hash()
+        await asyncio.gather(
+            *(AuthService.verify_password(secrets.token_urlsafe(8), dummy_hash) for _ in range(concurrency))
+        )
+
     @staticmethod
-    def is_user_active(user: Dict[str, Any]) -> bool:
-        return user.get("active", False)
+    async def fetch_credentials(email: str, read_only: bool = False) -> Optional[UserCredentials]:
+        """Fetch the user record and password hash in one query, from the email's shard."""
+        shard = (await get_shard_map()).shard_for(email)
+        async with get_async_conn(read_only, shard) as conn:
+            async with conn.cursor(row_factory=UserCredentials.row_factory) as cur:
+                with timed(DB_QUERY_SECONDS, query="users.credentials_by_email"):
+                    await cur.execute(
+                        "SELECT id, email, created_at, active, password_hash FROM users WHERE email=%s",
+                        (email,)
+                    )
+                return await cur.fetchone()
     
     @staticmethod
-    def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-        return AuthService.fetch_user_by_email(email)
+    async def authenticate_user(email: str, password: str) -> Optional[UserRecord]:
+        """Check Basic auth credentials; an outdated stored hash is upgraded in the background."""
+        credentials = await AuthService.fetch_credentials(email, read_only=True)
+        if credentials is None and has_replicas():
+            # Registered too recently to have reached the replica
+            credentials = await AuthService.fetch_credentials(email)
+        if credentials is None:
+            await AuthService.verify_password(password, await AuthService.dummy_password_hash())
+            logger.warning("Authentication failed for user: %s", email)
+            return None
+
+        cache = get_credential_cache()
+        if cache is not None and cache.verified(email, password, credentials.password_hash):
+            logger.info("User authenticated from cache: %s", email)
+            return credentials.user
+
+        if not await AuthService.verify_password(password, credentials.password_hash):
+            logger.warning("Authentication failed for user: %s", email)
+            return None
+
+        if cache is not None:
+            cache.remember(email, password, credentials.password_hash)
+        policy = get_hash_policy()
+        if policy.rehash_on_login and policy.needs_rehash(credentials.password_hash):
+            AuthService.schedule_rehash(email, credentials.user.id, password, credentials.password_hash)
+
+        logger.info("User authenticated: %s", email)
+        return credentials.user
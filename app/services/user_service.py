@@ -1,12 +1,18 @@
+import asyncio
 import secrets
 import logging
-from typing import Any, Dict, Optional
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
 
 from config import Settings
+from email_client import activation_email
+from email_filter import get_email_filter
 from errors import EmailAlreadyUsed
+from hashing_executor import get_hashing_executor
+from metrics import EMAIL_PRECHECKS, PASSWORD_HASH_SECONDS_SAVED
+from models import UserRecord
 from repositories.user_repository import UserRepository
 from services.activation_service import ActivationService
-from services.auth_service import AuthService
+from services.auth_service import AuthService, get_hash_policy
 
 logger = logging.getLogger(__name__)
 
@@ -16,29 +22,116 @@ class UserService:
     def __init__(self, settings: Optional[Settings] = None):
         self.settings = settings or Settings()
     
-    def register_user(self, email: str, password: str) -> Dict[str, Any]:
-        logger.info(f"Registering user: {email}")
-        
-        pwd_hash = AuthService.hash_password(password, rounds=self.settings.bcrypt_rounds)
+    async def registered_emails(self, emails: Sequence[str]) -> Set[str]:
+        """
+        Which of emails are already registered, checked before any password is
+        hashed. Emails the Bloom filter has never seen skip the lookup; the rest
+        are confirmed with an indexed query. Each rejection is credited with the
+        average hashing time it saved.
+        """
+        if not self.settings.email_precheck_enabled:
+            return set()
+
+        email_filter = get_email_filter()
+        candidates = [email for email in emails if email_filter is None or email_filter.might_contain(email)]
+        if len(candidates) < len(emails):
+            EMAIL_PRECHECKS.labels("filter_negative").inc(len(emails) - len(candidates))
+        if not candidates:
+            return set()
+
+        if len(candidates) == 1:
+            registered = {candidates[0]} if await UserRepository.email_exists(candidates[0]) else set()
+        else:
+            registered = await UserRepository.existing_emails(candidates)
+        if len(registered) < len(candidates):
+            EMAIL_PRECHECKS.labels("new").inc(len(candidates) - len(registered))
+        if registered:
+            EMAIL_PRECHECKS.labels("duplicate").inc(len(registered))
+            hash_function, _ = get_hash_policy().hash_call()
+            saved = get_hashing_executor().average_seconds(hash_function.__name__)
+            PASSWORD_HASH_SECONDS_SAVED.inc(len(registered) * saved)
+        return registered
+
+    @staticmethod
+    def remember_emails(emails: Sequence[str]) -> None:
+        email_filter = get_email_filter()
+        if email_filter is not None:
+            for email in emails:
+                email_filter.add(email)
+
+    async def register_user(self, email: str, password: str) -> UserRecord:
+        logger.info("Registering user: %s", email)
+
+        if await self.registered_emails([email]):
+            logger.warning("Registration rejected before hashing - email already exists: %s", email)
+            raise EmailAlreadyUsed()
+
+        pwd_hash = await AuthService.hash_password(password)
         code = f"{secrets.randbelow(10000):04d}"
 
         try:
-            user = UserRepository.create_user(email, pwd_hash)
-            
-            activation_service = ActivationService()
-            activation_service.create_activation(user["id"], code)
+            code_hash, salt = ActivationService().new_code_hash(code)
+            user = await UserRepository.create_user_with_activation(
+                email, pwd_hash, code_hash, salt, activation_email(email, code)
+            )
             
-            logger.info(f"User registered successfully: {user['id']}")
-            return {"user": user, "activation_code": code}
+            logger.info("User registered successfully: %s", user.id)
+            self.remember_emails([email])
+            return user
         except EmailAlreadyUsed:
-            logger.warning(f"Registration failed - email already exists: {email}")
+            logger.warning("Registration failed - email already exists: %s", email)
+            self.remember_emails([email])
             raise
     
-    def activate_user(self, user_id: str, activation_code: str) -> None:
+    async def register_users(self, items: Sequence[Tuple[str, str]]) -> List[Union[UserRecord, EmailAlreadyUsed]]:
+        """
+        Register (email, password) items in one transaction. Returns a record
+        per item, in order, or EmailAlreadyUsed for emails already registered
+        or repeated earlier in the batch; other items are still created.
+        """
+        logger.info("Registering batch of %d users", len(items))
+
+        first_index: Dict[str, int] = {}
+        for index, (email, _) in enumerate(items):
+            first_index.setdefault(email, index)
+        registered = await self.registered_emails(list(first_index))
+        unique = [index for email, index in first_index.items() if email not in registered]
+
+        # At most one hash per worker in flight, so a large batch uses the whole
+        # pool without tripping the executor's pending limit on its own
+        slots = asyncio.Semaphore(get_hashing_executor().max_workers)
+
+        async def hash_password(password: str) -> bytes:
+            async with slots:
+                pwd_hash: bytes = await AuthService.hash_password(password)
+                return pwd_hash
+
+        pwd_hashes = await asyncio.gather(*(hash_password(items[index][1]) for index in unique))
+
+        activation_service = ActivationService()
+        rows = []
+        for index, pwd_hash in zip(unique, pwd_hashes):
+            email = items[index][0]
+            code = f"{secrets.randbelow(10000):04d}"
+            code_hash, salt = activation_service.new_code_hash(code)
+            rows.append((email, pwd_hash, code_hash, salt, activation_email(email, code)))
+        records = await UserRepository.create_users_with_activation(rows) if rows else []
+        # Every row's email is registered now, by this batch or earlier
+        self.remember_emails([row[0] for row in rows])
+
+        results: List[Union[UserRecord, EmailAlreadyUsed]] = [EmailAlreadyUsed() for _ in items]
+        for index, record in zip(unique, records):
+            if record is not None:
+                results[index] = record
+        created = sum(record is not None for record in records)
+        logger.info("Batch registered %d of %d users", created, len(items))
+        return results
+
+    async def activate_user(self, user_id: str, activation_code: str, email: str) -> None:
         try:
             activation_service = ActivationService()
-            activation_service.verify_and_use_code(user_id, activation_code)
-            logger.info(f"User activated: {user_id}")
+            await activation_service.verify_and_use_code(user_id, activation_code, email)
+            logger.info("User activated: %s", user_id)
         except Exception as e:
-            logger.warning(f"Activation failed for user {user_id}: {e}")
+            logger.warning("Activation failed for user %s: %s", user_id, e)
             raise
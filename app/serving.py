@@ -0,0 +1,27 @@
+from typing import Any
+
+from uvicorn.workers import UvicornWorker
+
+from config import Settings
+
+
+class ServingWorker(UvicornWorker):
+    """
+    Uvicorn worker for gunicorn (see gunicorn.conf.py).
+
+    On shutdown uvicorn stops accepting connections and waits for in-flight
+    requests, then runs the lifespan shutdown. The request drain is capped so
+    that stopping background jobs still fits in gunicorn's graceful_timeout,
+    after which the master kills the worker. A failing lifespan startup (for
+    example, the database is unreachable during pool warmup) stops the worker
+    instead of serving without its resources.
+    """
+
+    CONFIG_KWARGS = {"loop": "auto", "http": "auto", "lifespan": "on"}
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        settings = Settings()
+        self.config.timeout_graceful_shutdown = max(
+            int(self.cfg.graceful_timeout - settings.app_shutdown_task_timeout_seconds - 1), 1
+        )
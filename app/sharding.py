@@ -0,0 +1,190 @@
+"""
+Horizontal sharding of users and their activation codes by email.
+
+Every email hashes to one of SHARD_BUCKETS buckets: the first four bytes of
+its SHA-256, big-endian, modulo SHARD_BUCKETS (the shard_bucket() SQL
+function of migration 0008 computes the same). Emails are hashed as stored,
+that is as normalized by EmailStr validation, so lookups hash to the shard
+the user was written to. A user's activation codes and outbox rows are
+written on the same connection as the user, so they live on its shard.
+
+The shard_map table on the primary assigns buckets to the DB_SHARDS names;
+buckets without a row stay on the primary, shard "0". Each worker caches
+the map and reloads it every DB_SHARD_MAP_REFRESH_SECONDS.
+
+reshard.py moves buckets between shards while the API runs. When a bucket's
+cutover commits, the source shard records it in shard_bucket_moves. Writes
+take the bucket's advisory lock in shared mode and check that table first
+(fence), so a worker whose map is stale cannot write to the old shard after
+the cutover: it gets ShardMoved and on_shard / on_shards retry on the new
+shard. Reads are not fenced; for up to a map refresh after a move they may
+be served by the old shard's copy, which reshard.py --cleanup removes once
+the grace period is over.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, TypeVar
+
+import psycopg
+
+from background import PeriodicTask
+from config import Settings
+from database import PRIMARY_SHARD, get_async_conn, init_async_pool, shard_names
+from metrics import DB_SHARD_REDIRECTS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SHARD_BUCKETS = 1024
+# First key of the two-key advisory locks fencing buckets (the second is the bucket)
+SHARD_LOCK_KEY = 72_410_002
+# A write follows at most this many moves before giving up
+MAX_REDIRECTS = 3
+
+MOVED_QUERY = "SELECT bucket, moved_to FROM shard_bucket_moves WHERE bucket = ANY(%s)"
+
+
+def shard_bucket(email: str) -> int:
+    return int.from_bytes(hashlib.sha256(email.encode()).digest()[:4], "big") % SHARD_BUCKETS
+
+
+class ShardMoved(Exception):
+    """Buckets written to on a shard they have been moved off, with the shard each went to."""
+
+    def __init__(self, moves: Dict[int, str]):
+        super().__init__(", ".join(f"bucket {bucket} moved to shard {shard}" for bucket, shard in moves.items()))
+        self.moves = moves
+
+
+def is_sharded() -> bool:
+    """Whether DB_SHARDS adds shards to the primary. Only valid once the pool is initialized."""
+    return len(shard_names()) > 1
+
+
+async def fence(conn: psycopg.AsyncConnection, buckets: Iterable[int]) -> None:
+    """
+    Hold the buckets' advisory locks in shared mode until conn's transaction
+    ends, then raise ShardMoved if any of them has left this shard. Call it
+    first in every transaction that writes users of those buckets; reshard.py
+    takes the lock exclusively for a cutover, which therefore waits for those
+    transactions and is seen by every later one. The check is a separate
+    statement so it reads the moves committed while the lock was awaited.
+    """
+    if not is_sharded():
+        return
+    buckets = sorted(set(buckets))
+    await conn.execute(
+        "SELECT pg_advisory_xact_lock_shared(%s, bucket) FROM unnest(%s::int[]) AS bucket",
+        (SHARD_LOCK_KEY, buckets)
+    )
+    moved = await (await conn.execute(MOVED_QUERY, (buckets,))).fetchall()
+    if moved:
+        raise ShardMoved(dict(moved))
+
+
+class ShardMap:
+    """The bucket -> shard assignments of the primary's shard_map table."""
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or Settings()
+        self.assignments: Dict[int, str] = {}
+
+    def shard_of_bucket(self, bucket: int) -> str:
+        return self.assignments.get(bucket, PRIMARY_SHARD)
+
+    def shard_for(self, email: str) -> str:
+        return self.shard_of_bucket(shard_bucket(email))
+
+    def group(self, emails: Sequence[str], indexes: Optional[Iterable[int]] = None) -> Dict[str, List[int]]:
+        """Indexes of emails (all, or the given ones) by the shard they map to."""
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for index in range(len(emails)) if indexes is None else indexes:
+            groups[self.shard_for(emails[index])].append(index)
+        return groups
+
+    def record_moves(self, moves: Dict[int, str]) -> None:
+        """Apply moves a fence reported, ahead of the next reload."""
+        self.assignments.update(moves)
+
+    async def load(self) -> None:
+        """
+        Reload the map from the primary. A map naming a shard that DB_SHARDS
+        does not configure is rejected and the current one kept.
+        """
+        async with get_async_conn() as conn:
+            rows = await (await conn.execute("SELECT bucket, shard FROM shard_map")).fetchall()
+        assignments = {bucket: shard for bucket, shard in rows if shard != PRIMARY_SHARD}
+        unknown = set(assignments.values()) - set(shard_names())
+        if unknown:
+            raise ValueError(f"shard_map assigns buckets to unconfigured shards: {', '.join(sorted(unknown))}")
+        self.assignments = assignments
+
+    def periodic(self) -> PeriodicTask:
+        return PeriodicTask("shard-map", self.load, self.settings.db_shard_map_refresh_seconds)
+
+
+_shard_map: Optional[ShardMap] = None
+_shard_map_lock = asyncio.Lock()
+
+async def get_shard_map(settings: Optional[Settings] = None) -> ShardMap:
+    """The process-wide map, loaded on first use; empty (everything on the primary) without DB_SHARDS."""
+    global _shard_map
+    if _shard_map is None:
+        async with _shard_map_lock:
+            if _shard_map is None:
+                # The configured shards are known once the pools exist
+                await init_async_pool()
+                shard_map = ShardMap(settings)
+                if is_sharded():
+                    await shard_map.load()
+                _shard_map = shard_map
+    return _shard_map
+
+
+async def on_shard(email: str, operation: Callable[[str], Awaitable[T]]) -> T:
+    """
+    Run operation(shard) on the shard of email's bucket, following the bucket
+    to its new shard if the operation's fence reports that it has moved.
+    """
+    shard_map = await get_shard_map()
+    redirects = 0
+    while True:
+        try:
+            return await operation(shard_map.shard_for(email))
+        except ShardMoved as moved:
+            if redirects == MAX_REDIRECTS:
+                raise
+            redirects += 1
+            shard_map.record_moves(moved.moves)
+            DB_SHARD_REDIRECTS.inc()
+            logger.info("Retrying write on the new shard: %s", moved)
+
+
+async def on_shards(emails: Sequence[str], operation: Callable[[str, List[int]], Awaitable[None]]) -> None:
+    """
+    Run operation(shard, indexes) concurrently for each shard, with the
+    indexes of the emails it holds. A group whose fence reports moved buckets
+    is regrouped and retried; the other groups' work stands, so the overall
+    result is only atomic per shard.
+    """
+    shard_map = await get_shard_map()
+
+    async def run(shard: str, indexes: List[int], redirects: int) -> None:
+        try:
+            await operation(shard, indexes)
+        except ShardMoved as moved:
+            if redirects == MAX_REDIRECTS:
+                raise
+            shard_map.record_moves(moved.moves)
+            DB_SHARD_REDIRECTS.inc()
+            logger.info("Retrying writes on the new shards: %s", moved)
+            await run_groups(indexes, redirects + 1)
+
+    async def run_groups(indexes: Optional[Iterable[int]], redirects: int) -> None:
+        groups = shard_map.group(emails, indexes)
+        await asyncio.gather(*(run(shard, group, redirects) for shard, group in groups.items()))
+
+    await run_groups(None, 0)
@@ -0,0 +1,46 @@
+import json
+import logging
+import uuid
+from typing import Any, Dict, Iterator
+
+import psycopg
+
+from config import get_db_dsn
+from services.activation_service import ActivationService
+
+logger = logging.getLogger("tests")
+
+
+def iter_plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+def explain(query: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    with psycopg.connect(get_db_dsn()) as conn:
+        # Table size in a test database is tiny; disabling seq scans makes the
+        # planner show what it would pick once the table is large.
+        conn.execute("SET LOCAL enable_seqscan = off")
+        row = conn.execute(f"EXPLAIN (FORMAT JSON) {query}", params).fetchone()
+        conn.rollback()
+    assert row is not None
+    plan = json.loads(row[0]) if isinstance(row[0], str) else row[0]
+    root: Dict[str, Any] = plan[0]["Plan"]
+    return root
+
+
+def test_latest_code_lookup_uses_index_scan():
+    """The locking latest-code lookup activation runs must be an index scan without a sort step"""
+    plan = explain(ActivationService.LOCK_LATEST_CODE_QUERY, {"user_id": str(uuid.uuid4()), "ttl": 600})
+    nodes = list(iter_plan_nodes(plan))
+    node_types = [node["Node Type"] for node in nodes]
+    logger.info(f"Latest code lookup plan: {node_types}")
+
+    assert "Seq Scan" not in node_types
+    assert "Sort" not in node_types
+    assert any(
+        node["Node Type"] in ("Index Scan", "Index Only Scan")
+        and node.get("Relation Name") == "activation_codes"
+        for node in nodes
+    )
@@ -0,0 +1,78 @@
+import asyncio
+import uuid
+
+from database import close_async_pool, get_async_conn, init_async_pool
+from email_client import activation_email
+from errors import CodeExpired, InvalidCode
+from models import UserRecord
+from repositories.user_repository import UserRepository
+from services.activation_service import ActivationService
+from sharding import get_shard_map
+
+
+async def create_user_with_code(code: str) -> UserRecord:
+    email = f"race-{uuid.uuid4().hex[:8]}@example.com"
+    code_hash, salt = ActivationService().new_code_hash(code)
+    return await UserRepository.create_user_with_activation(
+        email, b"not-a-real-hash", code_hash, salt, activation_email(email, code)
+    )
+
+
+async def is_active(user: UserRecord) -> bool:
+    async with get_async_conn(shard=(await get_shard_map()).shard_for(user.email)) as conn:
+        row = await (await conn.execute("SELECT active FROM users WHERE id=%s", (user.id,))).fetchone()
+    assert row is not None
+    active: bool = row[0]
+    return active
+
+
+def test_parallel_activations_use_the_code_once():
+    """Of many simultaneous attempts with the right code, exactly one activates; the rest see it used"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            user = await create_user_with_code("4321")
+            attempts = await asyncio.gather(
+                *(ActivationService().verify_and_use_code(user.id, "4321", user.email) for _ in range(10)),
+                return_exceptions=True,
+            )
+            return attempts, await is_active(user)
+        finally:
+            await close_async_pool()
+
+    attempts, active = asyncio.run(go())
+    assert sum(result is None for result in attempts) == 1
+    assert all(isinstance(result, InvalidCode) for result in attempts if result is not None)
+    assert active
+
+
+async def attempt(user: UserRecord, code: str):
+    try:
+        await ActivationService().verify_and_use_code(user.id, code, user.email)
+    except (InvalidCode, CodeExpired) as e:
+        return type(e)
+    return None
+
+
+def test_wrong_and_expired_codes_leave_user_inactive():
+    """A wrong code is INVALID_CODE, the right code past its TTL is CODE_EXPIRED, and neither activates"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            user = await create_user_with_code("1111")
+            wrong = await attempt(user, "2222")
+            async with get_async_conn(shard=(await get_shard_map()).shard_for(user.email)) as conn:
+                await conn.execute(
+                    "UPDATE activation_codes SET created_at = now() - interval '1 day' WHERE user_id=%s", (user.id,)
+                )
+                await conn.commit()
+            expired = await attempt(user, "1111")
+            return wrong, expired, await is_active(user)
+        finally:
+            await close_async_pool()
+
+    wrong, expired, active = asyncio.run(go())
+    assert (wrong, expired) == (InvalidCode, CodeExpired)
+    assert not active
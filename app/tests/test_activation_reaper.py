@@ -0,0 +1,44 @@
+import asyncio
+import time
+import uuid
+
+from prometheus_client import REGISTRY
+
+from activation_reaper import ActivationReaper
+from config import Settings
+from database import close_async_pool, get_async_conn, init_async_pool
+from services.activation_service import ActivationService
+
+
+def purged(category: str) -> float:
+    return REGISTRY.get_sample_value("reaper_rows_deleted_total", {"category": category}) or 0.0
+
+
+def test_reaper_reports_rows_removed_per_category():
+    """A run counts the used code it deletes under used_codes and records its completion"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            code_hash, salt = ActivationService().new_code_hash("1234")
+            async with get_async_conn() as conn:
+                await conn.execute(
+                    """
+                    WITH u AS (INSERT INTO users (email, password_hash) VALUES (%s, %s) RETURNING id)
+                    INSERT INTO activation_codes (user_id, code_hash, salt, used) SELECT id, %s, %s, TRUE FROM u
+                    """,
+                    (f"reaper-{uuid.uuid4().hex[:8]}@example.com", b"hash", code_hash, salt)
+                )
+                await conn.commit()
+            settings = Settings().model_copy(update={"reaper_batch_pause_ms": 0, "reaper_inactive_user_retention_seconds": 0})
+            return await ActivationReaper(settings).run_once()
+        finally:
+            await close_async_pool()
+
+    before = purged("used_codes")
+    started = time.time()
+    stats = asyncio.run(go())
+    assert stats.deleted["used_codes"] >= 1
+    assert purged("used_codes") - before == stats.deleted["used_codes"]
+    assert REGISTRY.get_sample_value("reaper_last_success_timestamp_seconds") >= started
+    assert REGISTRY.get_sample_value("reaper_run_duration_seconds_count") >= 1
@@ -0,0 +1,155 @@
+import asyncio
+import uuid
+
+import bcrypt
+
+from bulk_import import BulkImporter, aiter_file_lines
+from config import Settings
+from database import close_async_pool, get_async_conn, init_async_pool
+from email_client import activation_email
+from repositories.user_repository import UserRepository
+from services.activation_service import ActivationService
+from sharding import get_shard_map
+
+
+def run_import(lines, on_conflict="skip", chunk_size=2):
+    async def go():
+        await init_async_pool()
+        try:
+            settings = Settings().model_copy(update={"import_chunk_size": chunk_size})
+            importer = BulkImporter(settings, on_conflict=on_conflict)
+            return [result async for result in importer.run(aiter_file_lines(lines), "csv")]
+        finally:
+            await close_async_pool()
+
+    return asyncio.run(go())
+
+
+def test_bulk_import_reports_every_row():
+    """Rows are created once per email; repeats in later chunks, invalid rows and existing users are reported, not written"""
+    run = uuid.uuid4().hex[:8]
+    existing_hash = bcrypt.hashpw(b"Imported123", bcrypt.gensalt(4)).decode()
+    lines = [
+        "email,password,active\n",
+        f"plain-{run}@example.com,Password123,true\n",
+        f"hashed-{run}@example.com,{existing_hash},\n",
+        f"plain-{run}@example.com,Password456,\n",
+        "not-an-email,Password123,\n",
+        f"short-{run}@example.com,short,\n",
+    ]
+
+    results = run_import(lines)
+    assert [(r.line, r.status) for r in results] == [
+        (2, "created"), (3, "created"), (4, "duplicate"), (5, "invalid"), (6, "invalid"),
+    ]
+    assert all(r.user_id for r in results[:2])
+
+    again = run_import(lines[:3])
+    assert [r.status for r in again] == ["exists", "exists"]
+
+    updated = run_import(lines[:3], on_conflict="update")
+    assert [(r.status, r.user_id) for r in updated] == [("updated", results[0].user_id), ("updated", results[1].user_id)]
+
+
+def test_bulk_import_dedupes_normalized_emails():
+    """Emails differing only in the case of the domain are one user, stored as a registration would store it"""
+    run = uuid.uuid4().hex[:8]
+    lines = [
+        "email,password\n",
+        f"Mixed-{run}@Example.COM,Password123\n",
+        f"Mixed-{run}@example.com,Password456\n",
+    ]
+
+    results = run_import(lines)
+    assert [(r.status, r.email) for r in results] == [
+        ("created", f"Mixed-{run}@example.com"), ("duplicate", f"Mixed-{run}@example.com"),
+    ]
+
+    async def stored():
+        await init_async_pool()
+        try:
+            return await UserRepository.existing_emails([f"Mixed-{run}@example.com", f"Mixed-{run}@Example.COM"])
+        finally:
+            await close_async_pool()
+
+    assert set(asyncio.run(stored())) == {f"Mixed-{run}@example.com"}
+
+
+def users(*emails):
+    """email -> (active, password_hash) of each registered email, read from its shard"""
+    async def go():
+        await init_async_pool()
+        try:
+            found = {}
+            for email in emails:
+                shard = (await get_shard_map()).shard_for(email)
+                async with get_async_conn(shard=shard) as conn:
+                    row = await (await conn.execute(
+                        "SELECT active, password_hash FROM users WHERE email = %s", (email,)
+                    )).fetchone()
+                if row:
+                    found[email] = (row[0], bytes(row[1]))
+            return found
+        finally:
+            await close_async_pool()
+
+    return asyncio.run(go())
+
+
+def test_bulk_import_update_keeps_activation_state():
+    """--on-conflict update replaces the password of a user who never activated but leaves them inactive"""
+    email = f"pending-{uuid.uuid4().hex[:8]}@example.com"
+
+    async def register():
+        await init_async_pool()
+        try:
+            code_hash, salt = ActivationService().new_code_hash("1234")
+            await UserRepository.create_user_with_activation(
+                email, b"hash", code_hash, salt, activation_email(email, "1234")
+            )
+        finally:
+            await close_async_pool()
+
+    asyncio.run(register())
+    results = run_import(["email,password\n", f"{email},Password123\n"], on_conflict="update")
+    assert [r.status for r in results] == ["updated"]
+    active, password_hash = users(email)[email]
+    assert active is False
+    assert bcrypt.checkpw(b"Password123", password_hash)
+
+
+def test_bulk_import_rejects_inactive_rows():
+    """active=false is invalid, so it neither creates a user that can never activate nor deactivates an existing one"""
+    run = uuid.uuid4().hex[:8]
+    existing, new = f"active-{run}@example.com", f"inactive-{run}@example.com"
+    run_import(["email,password\n", f"{existing},Password123\n"])
+
+    results = run_import(
+        ["email,password,active\n", f"{existing},Password456,false\n", f"{new},Password456,false\n"],
+        on_conflict="update",
+    )
+    assert [(r.status, r.error) for r in results] == [
+        ("invalid", "active=false is not supported: imported users get no activation code")
+    ] * 2
+    found = users(existing, new)
+    assert list(found) == [existing]
+    assert found[existing][0] is True
+    assert bcrypt.checkpw(b"Password123", found[existing][1])
+
+
+def test_bulk_import_results_do_not_depend_on_chunk_size():
+    """The first row for an email wins and later repeats are duplicates, within a chunk or across chunks"""
+    statuses = {}
+    for chunk_size in (1, 100):
+        run = uuid.uuid4().hex[:8]
+        lines = [
+            "email,password\n",
+            f"a-{run}@example.com,Password123\n",
+            f"a-{run}@example.com,Password456\n",
+            f"b-{run}@example.com,Password123\n",
+            f"a-{run}@Example.com,Password789\n",
+        ]
+        statuses[chunk_size] = [r.status for r in run_import(lines, on_conflict="update", chunk_size=chunk_size)]
+        assert bcrypt.checkpw(b"Password123", users(f"a-{run}@example.com")[f"a-{run}@example.com"][1])
+
+    assert statuses[1] == statuses[100] == ["created", "duplicate", "created", "duplicate"]
@@ -0,0 +1,58 @@
+import io
+import json
+import logging
+
+from prometheus_client import REGISTRY
+
+from config import Settings
+from log_pipeline import LogPipeline, request_id_var
+
+
+def pipeline_settings(**update):
+    return Settings().model_copy(update={"log_format": "json", "log_level": "info", **update})
+
+
+def dropped(reason: str) -> float:
+    return REGISTRY.get_sample_value("log_records_dropped_total", {"reason": reason}) or 0.0
+
+
+def test_records_are_written_as_json_with_the_request_id():
+    """Args are formatted by the writer; the request id and extra fields are carried along"""
+    stream = io.StringIO()
+    pipeline = LogPipeline(pipeline_settings(), stream)
+    pipeline.start()
+    token = request_id_var.set("abc123")
+    try:
+        logging.getLogger("services.user_service").info("Registering user: %s", "a@example.com", extra={"batch": 2})
+    finally:
+        request_id_var.reset(token)
+        pipeline.stop()
+
+    (entry,) = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert entry["message"] == "Registering user: a@example.com"
+    assert (entry["level"], entry["logger"], entry["request_id"], entry["batch"]) == (
+        "INFO", "services.user_service", "abc123", 2
+    )
+
+
+def test_sampling_spares_warnings_and_a_full_queue_drops_records():
+    """A zero sample rate silences a logger's INFO but not its warnings; overflow is counted, not waited for"""
+    stream = io.StringIO()
+    pipeline = LogPipeline(pipeline_settings(log_sample_rates="noisy=0"), stream)
+    pipeline.start()
+    sampled_before = dropped("sampled")
+    try:
+        logging.getLogger("noisy.child").info("dropped")
+        logging.getLogger("noisy.child").warning("kept")
+    finally:
+        pipeline.stop()
+    assert [json.loads(line)["message"] for line in stream.getvalue().splitlines()] == ["kept"]
+    assert dropped("sampled") == sampled_before + 1
+
+    # Not started, so nothing drains the queue
+    full = LogPipeline(pipeline_settings(log_queue_size=1), io.StringIO())
+    full_before = dropped("queue_full")
+    for n in range(3):
+        full.handler.handle(logging.LogRecord("x", logging.INFO, __file__, 0, "record %d", (n,), None))
+    assert full.queue.qsize() == 1
+    assert dropped("queue_full") == full_before + 2
@@ -0,0 +1,60 @@
+import asyncio
+import uuid
+
+from activation_reaper import ActivationReaper
+from config import Settings
+from database import close_async_pool, get_async_conn, init_async_pool
+from email_client import activation_email
+from outbox_dispatcher import OutboxDispatcher
+from repositories.user_repository import UserRepository
+from services.activation_service import ActivationService
+from sharding import get_shard_map
+
+
+def test_expired_activation_email_is_dead_lettered_without_its_code():
+    """An email whose code expired before delivery is not sent; its body is cleared and the reaper purges it"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            email = f"outbox-{uuid.uuid4().hex[:8]}@example.com"
+            code_hash, salt = ActivationService().new_code_hash("1234")
+            user = await UserRepository.create_user_with_activation(
+                email, b"hash", code_hash, salt, activation_email(email, "1234")
+            )
+            shard = (await get_shard_map()).shard_for(email)
+
+            async def outbox():
+                async with get_async_conn(shard=shard) as conn:
+                    return await (await conn.execute(
+                        "SELECT status, body, expires_at > created_at FROM email_outbox WHERE user_id = %s", (user.id,)
+                    )).fetchall()
+
+            # Right away, before a running dispatcher can deliver it
+            async with get_async_conn(shard=shard) as conn:
+                queued = await (await conn.execute(
+                    """
+                    UPDATE email_outbox SET created_at = created_at - interval '1 day',
+                        expires_at = expires_at - interval '1 day'
+                    WHERE user_id = %s
+                    RETURNING status, body, expires_at > created_at
+                    """,
+                    (user.id,)
+                )).fetchall()
+                await conn.commit()
+            await OutboxDispatcher().run_once()
+            dead = await outbox()
+
+            settings = Settings().model_copy(update={
+                "reaper_batch_pause_ms": 0, "reaper_inactive_user_retention_seconds": 0,
+                "reaper_dead_email_retention_seconds": 3600,
+            })
+            await ActivationReaper(settings).run_once()
+            return queued, dead, await outbox()
+        finally:
+            await close_async_pool()
+
+    queued, dead, purged = asyncio.run(go())
+    assert queued == [("pending", "Your code is: 1234", True)]
+    assert dead == [("dead", None, True)]
+    assert purged == []
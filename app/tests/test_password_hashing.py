@@ -0,0 +1,19 @@
+from services.auth_service import HashPolicy, argon2_hash, argon2_verify, bcrypt_hash, bcrypt_verify, hash_algorithm
+
+FAST_ARGON2 = dict(argon2_time_cost=1, argon2_memory_cost_kib=1024)
+
+
+def test_algorithm_detected_from_hash_prefix_and_outdated_hashes_flagged():
+    """Stored hashes are recognised by prefix; another algorithm or cost than the policy's needs a rehash"""
+    bcrypt_4 = bcrypt_hash("Password123", 4)
+    argon2 = argon2_hash("Password123", 1, 1024, 1)
+    assert (hash_algorithm(bcrypt_4), hash_algorithm(argon2), hash_algorithm(b"plain")) == ("bcrypt", "argon2id", None)
+    assert bcrypt_verify("Password123", bcrypt_4) and argon2_verify("Password123", argon2)
+    assert not argon2_verify("Password124", argon2) and not argon2_verify("Password123", bcrypt_4)
+
+    assert not HashPolicy(bcrypt_rounds=4).needs_rehash(bcrypt_4)
+    assert HashPolicy(bcrypt_rounds=5).needs_rehash(bcrypt_4)
+    assert HashPolicy(algorithm="argon2id", **FAST_ARGON2).needs_rehash(bcrypt_4)
+    assert not HashPolicy(algorithm="argon2id", **FAST_ARGON2).needs_rehash(argon2)
+    assert HashPolicy(algorithm="argon2id", argon2_time_cost=2, argon2_memory_cost_kib=1024).needs_rehash(argon2)
+    assert HashPolicy(bcrypt_rounds=4).needs_rehash(argon2)
@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+
+from config import Settings
+from middleware.rate_limiting import BATCH_ITEM_MAX_BYTES, InMemoryRateLimiter, RateLimitMiddleware
+
+
+def batch(count: int):
+    return {"items": [{"email": f"p{i}@example.com", "password": "Password123"} for i in range(count)]}
+
+
+def test_batch_registration_is_charged_per_item():
+    """A batch larger than what is left of the item budget gets 429, and the app sees the body the middleware read"""
+    received = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        received.append(message["body"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    settings = Settings().model_copy(update={
+        "rate_limit_enabled": True, "rate_limit_batch_registration_max_items": 5, "rate_limit_window_seconds": 3600,
+    })
+    middleware = RateLimitMiddleware(app, InMemoryRateLimiter(), settings)
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test") as client:
+            return [(await client.post("/v1/users:batch", json=batch(count))).status_code for count in (3, 3, 2)]
+
+    assert asyncio.run(go()) == [200, 429, 200]
+    assert received == [httpx.Request("POST", "/", json=batch(count)).content for count in (3, 2)]
+
+
+def test_oversized_batch_body_is_rejected_unread():
+    """A batch body past what BATCH_REGISTRATION_MAX_ITEMS items could take gets 413, declared or streamed"""
+    read = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("the app must not be called")
+
+    async def chunks():
+        for _ in range(4):
+            read.append(BATCH_ITEM_MAX_BYTES)
+            yield b" " * BATCH_ITEM_MAX_BYTES
+
+    settings = Settings().model_copy(update={"rate_limit_enabled": True, "batch_registration_max_items": 2})
+    middleware = RateLimitMiddleware(app, InMemoryRateLimiter(), settings)
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test") as client:
+            declared = await client.post("/v1/users:batch", content=b" " * (2 * BATCH_ITEM_MAX_BYTES + 1))
+            streamed = await client.post("/v1/users:batch", content=chunks())
+            return declared, streamed
+
+    declared, streamed = asyncio.run(go())
+    assert declared.status_code == streamed.status_code == 413
+    assert declared.json()["detail"]["code"] == "DM_REG_010"
+    # Reading stopped at the chunk that crossed the limit
+    assert len(read) == 3
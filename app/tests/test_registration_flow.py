@@ -7,13 +7,25 @@ import os
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("tests")
 
-APP_BASE = "http://app:8000"
-MAILER_BASE = "http://mailer:8081"
+APP_BASE = os.getenv("APP_BASE", "http://app:8000")
+MAILER_BASE = os.getenv("MAILER_BASE", "http://mailer:8081")
+PARTNER_TOKEN = os.getenv("PARTNER_API_TOKEN", "dev-partner-token")
 
 def setup_module():
     logger.info("Starting Dailymotion Registration API Tests")
 
 
+def wait_for_code(email: str, timeout: float = 5.0):
+    """Poll the mock mailer until the activation code for email arrives"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        r = httpx.get(f"{MAILER_BASE}/__last_code", params={"email": email}, timeout=2.0)
+        if r.status_code == 200:
+            return r.json()["code"]
+        time.sleep(0.1)
+    return None
+
+
 def test_full_registration_flow():
     """Test complete user registration and activation flow"""
     email = f"alice-{uuid.uuid4().hex[:8]}@example.com"
@@ -34,12 +46,8 @@ def test_full_registration_flow():
         assert "id" in user_data
         
         logger.info("Waiting for activation email to be sent...")
-        time.sleep(2)
-        
-        logger.info("Retrieving activation code from mailer...")
-        r = httpx.get(f"{MAILER_BASE}/__last_code", params={"email": email}, timeout=2.0)
-        assert r.status_code == 200
-        code = r.json()["code"]
+        code = wait_for_code(email)
+        assert code is not None
         logger.info(f"Activation code received: {code}")
         assert len(code) == 4
         
@@ -58,6 +66,59 @@ def test_full_registration_flow():
         logger.info("Registration and activation flow completed successfully")
 
 
+def test_batch_registration_reports_duplicates_per_item():
+    """A batch creates every new email and returns EMAIL_ALREADY_USED for the rest"""
+    run = uuid.uuid4().hex[:8]
+    existing = f"batch-old-{run}@example.com"
+    new = [f"batch-{i}-{run}@example.com" for i in range(3)]
+    password = "SuperSecret123!"
+
+    with httpx.Client() as c:
+        r = c.post(f"{APP_BASE}/v1/users", json={"email": existing, "password": password})
+        assert r.status_code == 201
+
+        emails = [new[0], existing, new[1], new[0], new[2]]
+        items = {"items": [{"email": e, "password": password} for e in emails]}
+        r = c.post(f"{APP_BASE}/v1/users:batch", json=items)
+        assert r.status_code == 403
+        assert r.json()["detail"]["code"] == "DM_REG_009"
+
+        r = c.post(f"{APP_BASE}/v1/users:batch", json=items, headers={"Authorization": f"Bearer {PARTNER_TOKEN}"})
+        assert r.status_code == 200
+        body = r.json()
+        assert (body["created"], body["failed"]) == (3, 2)
+        assert [item["status"] for item in body["results"]] == [201, 409, 201, 409, 201]
+        assert body["results"][1]["error"]["code"] == "DM_REG_001"
+        assert [item["user"]["email"] for item in body["results"] if item["user"]] == new
+
+        for email in new:
+            code = wait_for_code(email)
+            assert code is not None
+        r = c.post(f"{APP_BASE}/v1/users/activate", json={"code": code}, auth=(new[2], password))
+        assert r.status_code == 200
+
+
+def test_duplicate_email_rejected_before_hashing():
+    """A repeat signup gets 409 from the pre-check without running bcrypt"""
+    email = f"dup-{uuid.uuid4().hex[:8]}@example.com"
+    with httpx.Client() as c:
+        r = c.post(f"{APP_BASE}/v1/users", json={"email": email, "password": "SuperSecret123!"})
+        assert r.status_code == 201
+
+        def metric(prefix):
+            """Sum of the samples whose line starts with prefix, across label sets"""
+            lines = c.get(f"{APP_BASE}/metrics").text.splitlines()
+            return sum(float(line.split()[-1]) for line in lines if line.startswith(prefix))
+
+        duplicates_before = metric('email_prechecks_total{outcome="duplicate"}')
+        hashes_before = metric("password_hash_duration_seconds_count")
+        r = c.post(f"{APP_BASE}/v1/users", json={"email": email, "password": "AnotherSecret123!"})
+        assert r.status_code == 409
+        assert r.json()["detail"]["code"] == "DM_REG_001"
+        assert metric('email_prechecks_total{outcome="duplicate"}') == duplicates_before + 1
+        assert metric("password_hash_duration_seconds_count") == hashes_before
+
+
 def test_invalid_code():
     """Test that invalid codes are rejected"""
     email = f"bob-{uuid.uuid4().hex[:8]}@example.com"
@@ -83,8 +144,40 @@ def test_invalid_code():
         logger.info("Invalid code test passed")
 
 
+def test_repeated_activation_attempts_reuse_verified_credentials():
+    """Retries after INVALID_CODE are authenticated from the credential cache, and activation state stays fresh"""
+    email = f"retry-{uuid.uuid4().hex[:8]}@example.com"
+    password = "SuperSecret123!"
+
+    def cache_hits(c):
+        for line in c.get(f"{APP_BASE}/metrics").text.splitlines():
+            if line.startswith('credential_cache_lookups_total{result="hit"}'):
+                return float(line.split()[-1])
+        return 0.0
+
+    with httpx.Client() as c:
+        r = c.post(f"{APP_BASE}/v1/users", json={"email": email, "password": password})
+        assert r.status_code == 201
+        code = wait_for_code(email)
+        wrong = "0000" if code != "0000" else "1111"
+
+        before = cache_hits(c)
+        for _ in range(3):
+            r = c.post(f"{APP_BASE}/v1/users/activate", json={"code": wrong}, auth=(email, password))
+            assert r.status_code == 400
+        # Each worker process has its own cache, so with several workers only some retries hit
+        assert cache_hits(c) >= before + 1
+
+        r = c.post(f"{APP_BASE}/v1/users/activate", json={"code": code}, auth=(email, "NotThePassword1"))
+        assert r.status_code == 401
+        r = c.post(f"{APP_BASE}/v1/users/activate", json={"code": code}, auth=(email, password))
+        assert r.status_code == 200
+        r = c.post(f"{APP_BASE}/v1/users/activate", json={"code": code}, auth=(email, password))
+        assert r.status_code == 409
+
+
 def test_background_task_sends_email():
-    """Test that FastAPI BackgroundTasks sends emails asynchronously"""
+    """Test that the activation email is delivered asynchronously from the outbox"""
     email = f"bg-task-{uuid.uuid4().hex[:8]}@example.com"
     password = "StrongPass123!"
 
@@ -109,4 +202,40 @@ def test_background_task_sends_email():
         time.sleep(0.5)
     
     logger.error(f"Background task failed to send email to {email}")
-    raise AssertionError(f"Background task did not send email to {email}")
\ No newline at end of file
+    raise AssertionError(f"Background task did not send email to {email}")
+
+def test_liveness_and_readiness_probes():
+    """Liveness needs no dependencies; readiness reports the cached dependency checks"""
+    with httpx.Client() as c:
+        r = c.get(f"{APP_BASE}/health/live")
+        assert r.status_code == 200
+        assert r.json() == {"status": "alive"}
+
+        r = c.get(f"{APP_BASE}/health/ready")
+        logger.info(f"Readiness response: {r.status_code} {r.text}")
+        assert r.status_code == 200
+        body = r.json()
+        assert body["status"] == "ready"
+        assert body["checks"]["database"]["ok"] is True
+        assert {"size", "available", "waiting", "avg_wait_ms"} <= body["checks"]["pool"].keys()
+
+
+def test_metrics_endpoint_exposes_hot_path_histograms():
+    """Registration is reflected in the request, bcrypt and SQL histograms"""
+    email = f"metrics-{uuid.uuid4().hex[:8]}@example.com"
+    with httpx.Client() as c:
+        r = c.post(f"{APP_BASE}/v1/users", json={"email": email, "password": "SuperSecret123!"})
+        assert r.status_code == 201
+
+        r = c.get(f"{APP_BASE}/metrics")
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/plain")
+        body = r.text
+        for sample in (
+            'http_request_duration_seconds_count',
+            'route="/v1/users"',
+            'password_hash_duration_seconds_count{operation="bcrypt_hash"}',
+            'db_query_duration_seconds_count{query="users.register_with_activation"}',
+            'db_pool_wait_seconds_count',
+        ):
+            assert sample in body, f"{sample} missing from /metrics"
@@ -0,0 +1,82 @@
+import asyncio
+import uuid
+
+import bcrypt
+import pytest
+
+from config import Settings
+from database import check_replicas, close_async_pool, get_async_conn, get_replica_status, init_async_pool
+from email_client import activation_email
+from repositories.user_repository import UserRepository
+from services.activation_service import ActivationService
+from services.auth_service import AuthService
+
+needs_replicas = pytest.mark.skipif(
+    not Settings().db_replica_hosts, reason="set DB_REPLICA_HOSTS (docker compose --profile replicas)"
+)
+
+
+async def read_from_standby() -> bool:
+    async with get_async_conn(read_only=True) as conn:
+        row = await (await conn.execute("SELECT pg_is_in_recovery()")).fetchone()
+    assert row is not None
+    in_recovery: bool = row[0]
+    return in_recovery
+
+
+@needs_replicas
+def test_reads_leave_a_lagging_replica_for_the_primary():
+    """Read-only connections use a replica within the lag limit and the primary once it is exceeded"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            settings = Settings()
+            await check_replicas(settings)
+            healthy = await read_from_standby()
+            await check_replicas(settings.model_copy(update={"db_replica_max_lag_seconds": -1.0}))
+            lagging = await read_from_standby(), get_replica_status()
+            return healthy, lagging
+        finally:
+            await close_async_pool()
+
+    healthy, (lagging, status) = asyncio.run(go())
+    assert healthy
+    assert not lagging
+    assert status and not any(replica["healthy"] for replica in status.values())
+
+
+def test_login_right_after_registration_finds_the_user():
+    """A user the replica has not replayed yet is authenticated from the primary"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            await check_replicas()
+            email = f"replica-{uuid.uuid4().hex[:8]}@example.com"
+            code_hash, salt = ActivationService().new_code_hash("1234")
+            password_hash = bcrypt.hashpw(b"Password123", bcrypt.gensalt(4))
+            await UserRepository.create_user_with_activation(
+                email, password_hash, code_hash, salt, activation_email(email, "1234")
+            )
+            return await AuthService.authenticate_user(email, "Password123"), email
+        finally:
+            await close_async_pool()
+
+    user, email = asyncio.run(go())
+    assert user is not None and user.email == email
+
+
+def test_unknown_shard_is_a_clear_error():
+    """A connection to a shard that is not configured fails with a ValueError naming it, not a bare KeyError"""
+
+    async def go():
+        await init_async_pool()
+        try:
+            async with get_async_conn(shard="no-such-shard"):
+                pass
+        finally:
+            await close_async_pool()
+
+    with pytest.raises(ValueError, match="no-such-shard"):
+        asyncio.run(go())
@@ -0,0 +1,28 @@
+import json
+from datetime import datetime, timezone
+
+from errors import EmailAlreadyUsed
+from models import UserRecord
+from schemas import CreateUserResponse, CreateUsersBatchResponse
+from serialization import batch_item_json, json_response, user_json
+
+
+def test_encoded_bodies_match_the_response_models():
+    """Pre-encoded bodies validate against the documented models and match what they would have produced"""
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+    user = UserRecord(id="7d0c5a1e-0000-4000-8000-000000000001", email="a@example.com", created_at=created_at, active=False)
+
+    body = json_response(user_json(user), 201).body
+    expected = CreateUserResponse(id=user.id, email=user.email, created_at=created_at.isoformat(), active=False)
+    assert CreateUserResponse.model_validate_json(body) == expected
+    assert json.loads(body) == expected.model_dump()
+
+    error = EmailAlreadyUsed()
+    batch = {
+        "created": 1,
+        "failed": 1,
+        "results": [batch_item_json(0, 201, user=user), batch_item_json(1, error.status_code, error=error.detail)],
+    }
+    parsed = CreateUsersBatchResponse.model_validate_json(json_response(batch).body)
+    assert json.loads(json_response(batch).body) == parsed.model_dump()
+    assert parsed.results[0].user == expected and parsed.results[1].user is None
@@ -0,0 +1,133 @@
+import asyncio
+import uuid
+
+import bcrypt
+import pytest
+
+from config import Settings
+from database import close_async_pool, get_async_conn, init_async_pool
+from email_client import activation_email
+from repositories.user_repository import UserRepository
+from reshard import Resharder
+from services.activation_service import ActivationService
+from services.auth_service import AuthService
+from sharding import get_shard_map, shard_bucket
+
+pytestmark = pytest.mark.skipif(
+    not Settings().db_shards, reason="set DB_SHARDS (docker compose --profile shards)"
+)
+
+SHARD = "1"
+
+
+def emails_in_one_bucket(count: int):
+    first = f"shard-{uuid.uuid4().hex[:8]}@example.com"
+    emails = [first]
+    while len(emails) < count:
+        email = f"shard-{uuid.uuid4().hex[:8]}@example.com"
+        if shard_bucket(email) == shard_bucket(first):
+            emails.append(email)
+    return emails
+
+
+async def register(email: str, code: str = "1234"):
+    code_hash, salt = ActivationService().new_code_hash(code)
+    password_hash = bcrypt.hashpw(b"Password123", bcrypt.gensalt(4))
+    return await UserRepository.create_user_with_activation(
+        email, password_hash, code_hash, salt, activation_email(email, code)
+    )
+
+
+async def rows_on(shard: str, user_id: str):
+    """(active, activation codes, outbox rows) of a user on shard, or None if it is not there."""
+    async with get_async_conn(shard=shard) as conn:
+        row = await (await conn.execute(
+            """
+            SELECT active,
+                   (SELECT count(*) FROM activation_codes WHERE user_id = u.id),
+                   (SELECT count(*) FROM email_outbox WHERE user_id = u.id)
+            FROM users u WHERE id = %s
+            """,
+            (user_id,)
+        )).fetchone()
+    return row
+
+
+async def move_back(buckets):
+    resharder = Resharder()
+    await resharder.move(buckets, "0")
+    await resharder.cleanup(0)
+    await (await get_shard_map()).load()
+
+
+def test_users_live_with_their_codes_on_the_shard_of_their_bucket():
+    """Registration, batch registration, login and activation follow the shard map"""
+
+    async def go():
+        await init_async_pool()
+        emails = emails_in_one_bucket(3)
+        bucket = shard_bucket(emails[0])
+        try:
+            await Resharder().move([bucket], SHARD)
+            await (await get_shard_map()).load()
+
+            user = await register(emails[0])
+            others = [f"shard-{uuid.uuid4().hex[:8]}@example.com" for _ in range(4)]
+            code_hash, salt = ActivationService().new_code_hash("1234")
+            batch = await UserRepository.create_users_with_activation(
+                [(email, b"hash", code_hash, salt, activation_email(email, "1234")) for email in [emails[1], *others]]
+            )
+            placed = await rows_on(SHARD, user.id), await rows_on("0", user.id), await rows_on(SHARD, batch[0].id)
+            found = await UserRepository.existing_emails([emails[1], *others, "nobody@example.com"])
+
+            authenticated = await AuthService.authenticate_user(emails[0], "Password123")
+            await ActivationService().verify_and_use_code(user.id, "1234", user.email)
+            return placed, found, authenticated, await rows_on(SHARD, user.id)
+        finally:
+            await move_back([bucket])
+            await close_async_pool()
+
+    (on_shard, on_primary, batch_user), found, authenticated, activated = asyncio.run(go())
+    assert on_shard == (False, 1, 1) and on_primary is None
+    assert batch_user == (False, 1, 1)
+    assert len(found) == 5 and "nobody@example.com" not in found
+    assert authenticated is not None
+    assert activated[0] is True
+
+
+def test_reshard_moves_a_bucket_under_writers_with_a_stale_map():
+    """Users, codes and undelivered email follow a moved bucket; writes routed by the old map are redirected"""
+
+    async def go():
+        await init_async_pool()
+        emails = emails_in_one_bucket(2)
+        bucket = shard_bucket(emails[0])
+        try:
+            user = await register(emails[0], "4321")
+            async with get_async_conn() as conn:
+                # Out of reach of any running dispatcher, so the move has an undelivered email to carry
+                await conn.execute(
+                    "UPDATE email_outbox SET next_attempt_at = now() + interval '1 hour' WHERE user_id = %s", (user.id,)
+                )
+                await conn.commit()
+            resharder = Resharder(batch_size=1)
+            moved = await resharder.move([bucket], SHARD)
+
+            # This process's map still puts the bucket on the primary
+            stale = (await get_shard_map()).shard_of_bucket(bucket)
+            await ActivationService().verify_and_use_code(user.id, "4321", user.email)
+            late = await register(emails[1])
+            after_move = await rows_on(SHARD, user.id), await rows_on(SHARD, late.id), await rows_on("0", late.id)
+
+            await resharder.cleanup(0)
+            return moved, stale, after_move, await rows_on("0", user.id), await resharder.owner(bucket)
+        finally:
+            await move_back([bucket])
+            await close_async_pool()
+
+    moved, stale, (user_rows, late_rows, late_on_primary), user_on_primary, owner = asyncio.run(go())
+    assert moved >= 1 and stale == "0"
+    assert user_rows == (True, 1, 1)
+    assert late_rows == (False, 1, 1) and late_on_primary is None
+    assert user_on_primary is None
+    assert owner == SHARD
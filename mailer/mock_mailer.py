@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, EmailStr
-from typing import Dict
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from typing import Any, Dict, List
 
 app = FastAPI(title="Mock Mailer Service")
 
@@ -9,10 +9,13 @@ class MailRequest(BaseModel):
     subject: str
     body: str
 
+class BatchMailRequest(BaseModel):
+    # Validated one by one so a bad message is rejected on its own
+    messages: List[Dict[str, Any]] = Field(max_length=1000)
+
 _last: Dict[str, str] = {}
 
-@app.post("/send", status_code=202)
-def send_mail(req: MailRequest):
+def _record(req: MailRequest) -> None:
     # Pretend to send mail and store last code by recipient for tests
     try:
         code = req.body.strip().split(":")[-1].strip()
@@ -20,8 +23,27 @@ def send_mail(req: MailRequest):
             _last[req.to] = code
     except Exception:
         pass
+
+@app.get("/health")
+def health():
+    return {"status": "healthy"}
+
+@app.post("/send", status_code=202)
+def send_mail(req: MailRequest):
+    _record(req)
     return {"status": "accepted"}
 
+@app.post("/send/batch")
+def send_mail_batch(req: BatchMailRequest):
+    results = []
+    for index, raw in enumerate(req.messages):
+        try:
+            _record(MailRequest.model_validate(raw))
+            results.append({"index": index, "status": "accepted"})
+        except ValidationError as e:
+            results.append({"index": index, "status": "rejected", "error": str(e.errors()[0]["msg"])})
+    return {"results": results}
+
 @app.get("/__last_code")
 def last_code(email: EmailStr):
     code = _last.get(email)